@@ -0,0 +1,182 @@
+# 刀 AI 数据库扩展技术 - 访问控制
+# 本脚本实现授权的快速路径：角色和权限在加载时编译为位掩码，权限检查只需一次按位与；
+# 认证成功后签发会话令牌，会话缓存在带 TTL 和撤销功能的 LRU 中；高频的允许决策按采样或聚合方式写审计日志。
+
+import random
+import secrets
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Iterable, Optional, Set, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+AUDIT_MODES = ('all', 'sampled', 'aggregated')
+
+
+class PermissionRegistry:
+    """权限名到位的映射；角色定义编译为位掩码，未知权限在检查时视为无权限"""
+
+    def __init__(self, permissions: Iterable[str] = (), roles: Optional[Dict[str, Iterable[str]]] = None):
+        self.bits: Dict[str, int] = {}
+        self.roles: Dict[str, int] = {}
+        for permission in permissions:
+            self.register(permission)
+        for role, role_permissions in (roles or {}).items():
+            self.roles[role] = self.compile(role_permissions, register=True)
+
+    def register(self, permission: str) -> int:
+        bit = self.bits.get(permission)
+        if bit is None:
+            bit = self.bits[permission] = 1 << len(self.bits)
+        return bit
+
+    def compile(self, permissions: Iterable[str], register: bool = False) -> int:
+        """把权限名列表编译为位掩码；register 为 False 时忽略未注册的权限"""
+        mask = 0
+        for permission in permissions:
+            mask |= self.register(permission) if register else self.bits.get(permission, 0)
+        return mask
+
+    def role_mask(self, roles: Iterable[str]) -> int:
+        mask = 0
+        for role in roles:
+            mask |= self.roles.get(role, 0)
+        return mask
+
+    def names(self, mask: int) -> List[str]:
+        """把位掩码还原为权限名列表（用于展示和审计）"""
+        return [permission for permission, bit in self.bits.items() if mask & bit]
+
+    def allows(self, mask: int, permission: str) -> bool:
+        bit = self.bits.get(permission, 0)
+        return bit != 0 and mask & bit == bit
+
+
+class Session:
+    """已认证的会话"""
+
+    __slots__ = ('token', 'username', 'mask', 'created_at', 'expires_at')
+
+    def __init__(self, token: str, username: str, mask: int, ttl: float):
+        now = time.monotonic()
+        self.token = token
+        self.username = username
+        self.mask = mask
+        self.created_at = now
+        self.expires_at = now + ttl
+
+
+class SessionCache:
+    """会话缓存：按令牌查找为 O(1)，会话数超过上限时淘汰最久未使用的会话，过期会话在访问时删除"""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_sessions: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, username: str, mask: int) -> Session:
+        session = Session(secrets.token_urlsafe(24), username, mask, self.ttl_seconds)
+        with self._lock:
+            self.sessions[session.token] = session
+            self._by_user.setdefault(username, set()).add(session.token)
+            while len(self.sessions) > self.max_sessions:
+                _, evicted = self.sessions.popitem(last=False)
+                self._forget(evicted)
+        return session
+
+    def get(self, token: str) -> Optional[Session]:
+        """返回有效会话；过期的会话被删除并返回 None"""
+        with self._lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if time.monotonic() >= session.expires_at:
+                del self.sessions[token]
+                self._forget(session)
+                return None
+            self.sessions.move_to_end(token)
+            return session
+
+    def revoke(self, token: str) -> bool:
+        with self._lock:
+            session = self.sessions.pop(token, None)
+            if session is not None:
+                self._forget(session)
+            return session is not None
+
+    def revoke_user(self, username: str) -> int:
+        """撤销用户的全部会话（如修改权限或密码后），返回撤销的会话数"""
+        with self._lock:
+            tokens = self._by_user.pop(username, set())
+            for token in tokens:
+                self.sessions.pop(token, None)
+            return len(tokens)
+
+    def update_mask(self, username: str, mask: int) -> None:
+        """权限变更后同步更新该用户现有会话的权限"""
+        with self._lock:
+            for token in self._by_user.get(username, ()):
+                self.sessions[token].mask = mask
+
+    def _forget(self, session: Session) -> None:
+        tokens = self._by_user.get(session.username)
+        if tokens is not None:
+            tokens.discard(session.token)
+            if not tokens:
+                del self._by_user[session.username]
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+
+class DecisionAuditor:
+    """访问决策的审计策略：拒绝决策总是逐条记录；允许决策按模式逐条记录（all）、
+    按比例采样（sampled，事件中带上采样率以便还原总量）或按 (用户, 操作) 聚合计数后定期汇总（aggregated）"""
+
+    def __init__(self, emit: Callable[[str, Dict[str, Any]], Any], mode: str = 'all', sample_rate: float = 0.01,
+                 aggregate_interval: float = 60.0, max_aggregate_keys: int = 10000):
+        if mode not in AUDIT_MODES:
+            raise ValueError(f"不支持的访问审计模式: {mode}")
+        self.emit = emit
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.aggregate_interval = aggregate_interval
+        self.max_aggregate_keys = max_aggregate_keys
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._window_start = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, username: str, action: str, allowed: bool) -> None:
+        if not allowed or self.mode == 'all':
+            self.emit('access_check', {'username': username, 'action': action, 'allowed': allowed})
+        elif self.mode == 'sampled':
+            if random.random() < self.sample_rate:
+                self.emit('access_check', {'username': username, 'action': action, 'allowed': True,
+                                           'sample_rate': self.sample_rate})
+        else:
+            key = (username, action)
+            with self._lock:
+                self._counts[key] = self._counts.get(key, 0) + 1
+                due = (len(self._counts) >= self.max_aggregate_keys
+                       or time.time() - self._window_start >= self.aggregate_interval)
+            if due:
+                self.flush()
+
+    def flush(self) -> None:
+        """输出当前窗口的允许决策汇总"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            window_start, self._window_start = self._window_start, time.time()
+        if counts:
+            self.emit('access_summary', {
+                'window_start': window_start,
+                'window_end': self._window_start,
+                'allowed': [{'username': username, 'action': action, 'count': count}
+                            for (username, action), count in counts.items()]
+            })
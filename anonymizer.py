@@ -0,0 +1,168 @@
+# 刀 AI 数据库扩展技术 - 批量匿名化
+# 本脚本实现按列批量匿名化：字段规则按列名编译一次，带密钥的 HMAC 假名经有界 LRU 缓存复用（同一用户标识大量重复），
+# 每列先去重再计算；大批量导出可以拆分后交给进程池并行处理。
+
+import hmac
+import re
+import threading
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Deque, Iterable, Iterator, Optional, Sequence, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ANONYMIZE_ACTIONS = ('pseudonymize', 'redact', 'drop', 'keep')
+# 未配置规则时沿用原有行为：列名包含 user 的字符串字段替换为假名
+DEFAULT_RULES = [{'field': 'user', 'action': 'pseudonymize'}]
+REDACTED = '***'
+
+
+class BatchAnonymizer:
+    """按列批量匿名化；规则按顺序匹配列名（正则、不区分大小写），第一条匹配的规则生效，未匹配的列保持不变"""
+
+    def __init__(self, key: bytes, rules: Optional[List[Dict[str, str]]] = None, memo_size: int = 100000,
+                 prefix: str = 'anon_', digest_chars: int = 16):
+        """key 为 HMAC 密钥，相同密钥下同一原值的假名稳定（可跨批次、跨进程关联），不知道密钥则无法通过穷举还原；
+        memo_size 为假名 LRU 缓存的条目数"""
+        self.key = key
+        self.rules = list(rules if rules is not None else DEFAULT_RULES)
+        self._compiled: List[Tuple[re.Pattern, str]] = []
+        for rule in self.rules:
+            action = rule.get('action', 'pseudonymize')
+            if action not in ANONYMIZE_ACTIONS:
+                raise ValueError(f"不支持的匿名化操作: {action}")
+            self._compiled.append((re.compile(rule['field'], re.IGNORECASE), action))
+        self.memo_size = memo_size
+        self.prefix = prefix
+        self.digest_chars = digest_chars
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        self._plans: Dict[Tuple[str, ...], List[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def action_for(self, field: str) -> str:
+        for pattern, action in self._compiled:
+            if pattern.search(field):
+                return action
+        return 'keep'
+
+    def plan(self, fields: Sequence[str]) -> List[Tuple[str, str]]:
+        """返回每列的处理方式；同一列集合只匹配一次规则"""
+        key = tuple(fields)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = [(field, self.action_for(field)) for field in key]
+            if len(self._plans) >= 1024:
+                self._plans.clear()
+            self._plans[key] = plan
+        return plan
+
+    def pseudonyms(self, values: Iterable[str]) -> Dict[str, str]:
+        """计算一组去重后原值的假名，命中 LRU 缓存的不再计算 HMAC"""
+        result: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._lock:
+            memo = self._memo
+            for value in values:
+                pseudonym = memo.get(value)
+                if pseudonym is None:
+                    missing.append(value)
+                else:
+                    memo.move_to_end(value)
+                    result[value] = pseudonym
+            self.memo_hits += len(result)
+            self.memo_misses += len(missing)
+        if not missing:
+            return result
+        key, prefix, chars = self.key, self.prefix, self.digest_chars
+        computed = {value: prefix + hmac.digest(key, value.encode('utf-8'), 'sha256').hex()[:chars]
+                    for value in missing}
+        result.update(computed)
+        with self._lock:
+            memo = self._memo
+            memo.update(computed)
+            while len(memo) > self.memo_size:
+                memo.popitem(last=False)
+        return result
+
+    def pseudonymize(self, value: str) -> str:
+        return self.pseudonyms((value,))[value]
+
+    def _pseudonymize_column(self, column: Sequence[Any]) -> List[Any]:
+        """只替换字符串值，其他类型（数值、None）保持不变"""
+        unique = [value for value in dict.fromkeys(column) if isinstance(value, str)]
+        mapping = self.pseudonyms(unique)
+        get = mapping.get
+        return [get(value, value) if isinstance(value, str) else value for value in column]
+
+    def anonymize_batch(self, batch: Dict[str, Sequence[Any]]) -> Dict[str, Sequence[Any]]:
+        """匿名化列式批次 {列名: 值序列}；保持不变的列原样返回，不复制"""
+        result: Dict[str, Sequence[Any]] = {}
+        for field, action in self.plan(list(batch)):
+            column = batch[field]
+            if action == 'keep':
+                result[field] = column
+            elif action == 'pseudonymize':
+                result[field] = self._pseudonymize_column(column)
+            elif action == 'redact':
+                result[field] = [REDACTED if value is not None else None for value in column]
+        return result
+
+    def anonymize_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """匿名化单条记录"""
+        result: Dict[str, Any] = {}
+        for field, action in self.plan(list(record)):
+            value = record[field]
+            if action == 'pseudonymize' and isinstance(value, str):
+                result[field] = self.pseudonymize(value)
+            elif action == 'redact' and value is not None:
+                result[field] = REDACTED
+            elif action != 'drop':
+                result[field] = value
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {'memo_entries': len(self._memo), 'memo_hits': self.memo_hits, 'memo_misses': self.memo_misses}
+
+
+def split_batch(batch: Dict[str, Sequence[Any]], chunk_rows: int) -> Iterator[Dict[str, Sequence[Any]]]:
+    """按行数把列式批次切分为若干子批次"""
+    rows = len(next(iter(batch.values()))) if batch else 0
+    for start in range(0, rows, chunk_rows):
+        yield {field: column[start:start + chunk_rows] for field, column in batch.items()}
+
+
+# 工作进程内的匿名化器，由进程池初始化函数创建，进程内的假名缓存在各子批次之间复用
+_worker_anonymizer: Optional[BatchAnonymizer] = None
+
+
+def _init_worker(key: bytes, rules: List[Dict[str, str]], memo_size: int) -> None:
+    global _worker_anonymizer
+    _worker_anonymizer = BatchAnonymizer(key, rules, memo_size)
+
+
+def _anonymize_in_worker(batch: Dict[str, Sequence[Any]]) -> Dict[str, Sequence[Any]]:
+    return _worker_anonymizer.anonymize_batch(batch)
+
+
+def anonymize_batches(batches: Iterable[Dict[str, Sequence[Any]]], key: bytes,
+                      rules: Optional[List[Dict[str, str]]] = None, workers: int = 4,
+                      memo_size: int = 100000, chunk_rows: int = 50000) -> Iterator[Dict[str, Sequence[Any]]]:
+    """用进程池并行匿名化大量列式批次，按输入顺序产出结果（超过 chunk_rows 行的批次先切分）；
+    各进程使用同一密钥，同一原值在所有进程中得到相同的假名"""
+    chunks = (chunk for batch in batches for chunk in split_batch(batch, chunk_rows))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(key, list(rules if rules is not None else DEFAULT_RULES),
+                                       memo_size)) as executor:
+        # 同时提交的子批次不超过 2 * workers，避免一次性物化整个导出
+        pending: Deque[Future] = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_anonymize_in_worker, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
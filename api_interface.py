@@ -1,27 +1,109 @@
 # 刀 AI 数据库扩展技术 - API 接口
 # 本脚本模拟 API 接口，用于外部系统与刀 AI 系统的交互。
-# 注意：此代码仅用于演示目的，不运行实际的 API 服务。
+# 注意：此代码仅用于演示目的，接口返回的数据为模拟数据；服务本身基于 asyncio HTTP 服务器真实监听 api.port。
 
+import asyncio
+import base64
+import inspect
+import signal
 import time
 import random
 import yaml
 import logging
 import json
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from datetime import datetime, timezone
+
+from http_server import AsyncHTTPServer, HTTPRequest, HTTPResponse
+from metrics_stream import MetricsBroadcaster, STREAM_FORMATS
+from optimization_jobs import JobManager, JobQueueFull, OptimizationJob
+from response_cache import ResponseCache
+from request_limits import RateLimiter, RequestAccounting, UNAUTHENTICATED_KEY
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def _parse_time(value: Any) -> float:
+    """解析 Unix 时间戳或 ISO 8601 时间（无时区时按 UTC）"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _encode_cursor(timestamp: float, skip: int) -> str:
+    """游标记录上一页最后一条的时间戳及该时间戳下已返回的条数，不透明地编码给客户端"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, skip]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        timestamp, skip = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(timestamp), int(skip)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
 class APIInterface:
     """API 接口类，模拟处理外部请求以查询系统状态和触发操作"""
     
-    def __init__(self, config_path: str):
-        """初始化 API 接口，加载配置文件"""
+    def __init__(self, config_path: str, knowledge_base: Any = None, optimization_executor: Any = None,
+                 security_module: Any = None):
+        """初始化 API 接口，加载配置文件；提供 knowledge_base 时性能指标从其历史数据中读取，
+        提供 optimization_executor 时优化任务交由其执行，提供 security_module 时请求凭其签发的会话令牌授权"""
         self.config = self._load_config(config_path)
-        self.api_requests: List[Dict] = []
+        self.knowledge_base = knowledge_base
+        self.security_module = security_module
+        self.optimization_executor = optimization_executor
         self.api_key = "demo_api_key_123456"  # 模拟 API 密钥
+        self.server: Optional[AsyncHTTPServer] = None
+        stream_config = (self.config.get('api', {}) or {}).get('stream', {}) or {}
+        self.broadcaster = MetricsBroadcaster(queue_size=stream_config.get('queue_size', 256),
+                                              history_size=stream_config.get('history_size', 10000),
+                                              overflow=stream_config.get('overflow', 'coalesce'))
+        jobs_config = (self.config.get('api', {}) or {}).get('jobs', {}) or {}
+        self.jobs = JobManager(self._run_optimization, max_workers=jobs_config.get('max_workers', 4),
+                               max_queued=jobs_config.get('max_queued', 100),
+                               max_jobs=jobs_config.get('max_jobs', 1000))
+        cache_config = (self.config.get('api', {}) or {}).get('cache', {}) or {}
+        self.response_cache: Optional[ResponseCache] = None
+        if cache_config.get('enabled', True):
+            self.response_cache = ResponseCache(max_entries=cache_config.get('max_entries', 1024),
+                                                gzip_min_bytes=cache_config.get('gzip_min_bytes', 1024),
+                                                gzip_level=cache_config.get('gzip_level', 6))
+        ttls = cache_config.get('ttl_seconds', {}) or {}
+        # 可缓存的 GET 接口及其缓存时间（秒）
+        self._cache_ttls = {'/system_status': ttls.get('system_status', 1),
+                            '/performance_metrics': ttls.get('performance_metrics', 5)}
+        self._routes = {
+            ('GET', '/system_status'): self._handle_system_status,
+            ('GET', '/performance_metrics'): self._handle_performance_metrics,
+            ('POST', '/trigger_optimization'): self._handle_trigger_optimization,
+            ('GET', '/metrics/stream'): self._handle_metrics_stream,
+            ('GET', '/optimization_status'): self._handle_optimization_status,
+            ('GET', '/optimization_jobs'): self._handle_optimization_jobs,
+            ('GET', '/api_stats'): self._handle_api_stats
+        }
+        # 须在事件循环线程中执行的同步处理函数（订阅指标推送），其他同步处理函数在线程池中执行，不阻塞事件循环
+        self._loop_handlers = {self._handle_metrics_stream}
+        # 请求统计只保留每个接口固定大小的计数器和延迟直方图
+        self.request_accounting = RequestAccounting(path for _, path in self._routes)
+        limit_config = (self.config.get('api', {}) or {}).get('rate_limit', {}) or {}
+        self.rate_limiter: Optional[RateLimiter] = None
+        if limit_config.get('enabled', True):
+            self.rate_limiter = RateLimiter(rate=limit_config.get('requests_per_second', 200),
+                                            burst=limit_config.get('burst', 400),
+                                            max_keys=limit_config.get('max_keys', 10000))
         logger.info("API 接口已初始化，配置文件: %s", config_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -35,19 +117,30 @@ class APIInterface:
             logger.error("加载配置文件失败: %s", str(e))
             return {}
     
-    def authenticate_request(self, api_key: str) -> bool:
-        """模拟验证 API 请求的密钥"""
-        logger.info("验证 API 密钥: %s", api_key)
+    def authenticate_request(self, api_key: str, permission: str = 'read') -> bool:
+        """验证 API 请求：接入安全模块时把密钥作为会话令牌并检查 permission 权限，否则与模拟 API 密钥比较"""
+        if self.security_module is not None:
+            return self.security_module.authorize(api_key, permission)
         is_valid = api_key == self.api_key
         if is_valid:
-            logger.info("API 密钥验证成功")
+            logger.debug("API 密钥验证成功")
         else:
             logger.warning("API 密钥验证失败")
         return is_valid
     
+    def _rate_limit_key(self, request: HTTPRequest) -> str:
+        """返回请求的限流键：有效的 API 密钥各用一个令牌桶，缺失或无效的密钥共用一个令牌桶，
+        随机密钥既不能绕过限流，也不会把正常客户端的令牌桶挤出"""
+        api_key = self._request_api_key(request)
+        if self.security_module is not None:
+            valid = bool(api_key) and self.security_module.sessions.get(api_key) is not None
+        else:
+            valid = api_key == self.api_key
+        return api_key if valid else UNAUTHENTICATED_KEY
+    
     def get_system_status(self, api_key: str) -> Dict:
         """模拟获取系统状态"""
-        logger.info("处理 GET /system_status 请求")
+        logger.debug("处理 GET /system_status 请求")
         
         if not self.authenticate_request(api_key):
             return {"error": "Invalid API key", "status_code": 401}
@@ -64,78 +157,308 @@ class APIInterface:
             "uptime_seconds": random.randint(3600, 86400)
         }
         
-        self.api_requests.append({"endpoint": "system_status", "timestamp": time.time()})
-        logger.info("返回系统状态: %s", status)
+        logger.debug("返回系统状态: %s", status)
         return {"data": status, "status_code": 200}
     
-    def get_performance_metrics(self, api_key: str, start_time: str, end_time: str) -> Dict:
-        """模拟获取性能指标"""
+    def get_performance_metrics(self, api_key: str, start_time: str, end_time: str, cursor: Optional[str] = None,
+                                limit: Optional[int] = None, max_points: Optional[int] = None) -> Dict:
+        """获取性能指标：按时间戳稳定排序并以游标分页；指定 max_points 时返回服务端降采样的分桶序列
+        （每桶保留最小值、最大值和平均值），响应大小与时间范围无关"""
         logger.info("处理 GET /performance_metrics 请求，时间范围: %s - %s", start_time, end_time)
         
         if not self.authenticate_request(api_key):
             return {"error": "Invalid API key", "status_code": 401}
         
-        # 模拟性能指标数据
-        metrics = [
-            {
-                "timestamp": start_time,
-                "query_execution_time": random.uniform(0.1, 1.5),
-                "cpu_usage": random.uniform(20.0, 80.0),
-                "memory_usage": random.uniform(30.0, 90.0)
-            },
-            {
-                "timestamp": end_time,
-                "query_execution_time": random.uniform(0.1, 1.5),
-                "cpu_usage": random.uniform(20.0, 80.0),
-                "memory_usage": random.uniform(30.0, 90.0)
-            }
-        ]
+        api_config = self.config.get('api', {}) or {}
+        try:
+            start, end = _parse_time(start_time), _parse_time(end_time)
+            after = _decode_cursor(cursor) if cursor else None
+            limit = min(int(limit or api_config.get('page_size', 500)), api_config.get('max_page_size', 5000))
+            if max_points is not None:
+                max_points = min(int(max_points), api_config.get('max_points_limit', 5000))
+        except ValueError as e:
+            return {"error": f"Invalid parameter: {e}", "status_code": 400}
+        if limit <= 0 or (max_points is not None and max_points <= 0):
+            return {"error": "limit and max_points must be positive", "status_code": 400}
+        
+        if self.knowledge_base is None:
+            # 未接入知识库时返回模拟数据
+            metrics = [
+                {
+                    "timestamp": start_time,
+                    "query_execution_time": random.uniform(0.1, 1.5),
+                    "cpu_usage": random.uniform(20.0, 80.0),
+                    "memory_usage": random.uniform(30.0, 90.0)
+                },
+                {
+                    "timestamp": end_time,
+                    "query_execution_time": random.uniform(0.1, 1.5),
+                    "cpu_usage": random.uniform(20.0, 80.0),
+                    "memory_usage": random.uniform(30.0, 90.0)
+                }
+            ]
+            logger.info("返回模拟性能指标，记录数: %d", len(metrics))
+            return {"data": metrics, "next_cursor": None, "status_code": 200}
         
-        self.api_requests.append({"endpoint": "performance_metrics", "timestamp": time.time()})
+        if max_points is not None:
+            aggregated = self.knowledge_base.retrieve_aggregated_data(start, end, max_points=max_points)
+            logger.info("返回降采样性能指标，粒度: %d 秒", aggregated['resolution'])
+            return {"data": aggregated, "status_code": 200}
+        
+        # 从游标位置开始二分定位，只物化当前页的记录
+        skip = 0
+        if after is not None:
+            start, skip = max(start, after[0]), after[1] if after[0] >= start else 0
+        view = self.knowledge_base.retrieve_historical_data(start, end)
+        page = view[skip:skip + limit]
+        metrics = [{"timestamp": _format_time(record['timestamp']), **record.get('metrics', {})} for record in page]
+        next_cursor = None
+        if len(view) > skip + limit:
+            last = page[-1]['timestamp']
+            same = 0
+            for record in reversed(page):
+                if record['timestamp'] != last:
+                    break
+                same += 1
+            next_cursor = _encode_cursor(last, same + (skip if last == start else 0))
         logger.info("返回性能指标，记录数: %d", len(metrics))
-        return {"data": metrics, "status_code": 200}
+        return {"data": metrics, "next_cursor": next_cursor, "status_code": 200}
     
-    def trigger_optimization(self, api_key: str, action: str) -> Dict:
-        """模拟触发优化操作"""
+    def trigger_optimization(self, api_key: str, action: str, parameters: Optional[Dict] = None,
+                             idempotency_key: Optional[str] = None) -> Dict:
+        """提交优化任务并立即返回 202 和任务编号；相同幂等键的重复提交返回已有任务"""
         logger.info("处理 POST /trigger_optimization 请求，动作: %s", action)
         
-        if not self.authenticate_request(api_key):
+        if not self.authenticate_request(api_key, 'optimize'):
             return {"error": "Invalid API key", "status_code": 401}
         
-        # 模拟优化操作
-        success = random.choice([True, False])
+        try:
+            job, created = self.jobs.submit(action, parameters, owner=api_key, idempotency_key=idempotency_key)
+        except JobQueueFull as e:
+            logger.warning("优化任务被拒绝: %s", str(e))
+            return {"error": "Too many pending optimization jobs", "status_code": 503}
+        
+        data = job.to_dict()
+        data['duplicate'] = not created
+        data['status_url'] = f"/optimization_status?job_id={job.job_id}"
+        return {"data": data, "status_code": 202}
+    
+    def _run_optimization(self, job: OptimizationJob) -> Dict:
+        """在任务线程中执行优化：接入执行器时调用其 apply_optimization，否则模拟耗时操作并分步上报进度"""
+        started = time.perf_counter()
+        if self.optimization_executor is not None:
+            success = self.optimization_executor.apply_optimization({'action': job.action,
+                                                                     'parameters': job.parameters})
+            impact: Dict[str, float] = {}
+        else:
+            scale = ((self.config.get('api', {}) or {}).get('jobs', {}) or {}).get('simulated_time_scale', 1.0)
+            duration = random.uniform(0.2, 5.0) * scale
+            for step in range(1, 11):
+                time.sleep(duration / 10)
+                job.report_progress(step / 10)
+            success = random.choice([True, False])
+            impact = {"query_time_reduction": random.uniform(10.0, 50.0)}
         result = {
-            "action": action,
+            "action": job.action,
             "success": success,
-            "execution_time": random.uniform(0.2, 5.0),
-            "estimated_impact": {"query_time_reduction": random.uniform(10.0, 50.0)}
+            "execution_time": time.perf_counter() - started,
+            "estimated_impact": impact
         }
-        
-        self.api_requests.append({"endpoint": "trigger_optimization", "timestamp": time.time()})
+        if self.knowledge_base is not None:
+            self.knowledge_base.store_optimization_result({**result, 'parameters': job.parameters,
+                                                          'impact': impact})
         logger.info("优化操作结果: %s", result)
-        return {"data": result, "status_code": 200 if success else 500}
+        return result
+    
+    def get_optimization_status(self, api_key: str, job_id: str) -> Dict:
+        """查询优化任务的状态和进度"""
+        if not self.authenticate_request(api_key):
+            return {"error": "Invalid API key", "status_code": 401}
+        job = self.jobs.get(job_id)
+        if job is None or job.owner != api_key:
+            return {"error": "Job not found", "status_code": 404}
+        return {"data": job.to_dict(), "status_code": 200}
+    
+    @staticmethod
+    def _request_api_key(request: HTTPRequest) -> str:
+        """从 X-API-Key 头、Bearer 令牌或 api_key 查询参数中取得 API 密钥"""
+        api_key = request.headers.get('x-api-key')
+        if api_key:
+            return api_key
+        authorization = request.headers.get('authorization', '')
+        if authorization.startswith('Bearer '):
+            return authorization[7:]
+        return request.query.get('api_key', '')
+    
+    @staticmethod
+    def _json_response(result: Dict) -> HTTPResponse:
+        """把接口方法返回的 {data/error, status_code} 转换为 JSON 响应"""
+        status_code = result.get('status_code', 200)
+        body = {key: value for key, value in result.items() if key != 'status_code'}
+        return HTTPResponse(status_code, json.dumps(body, ensure_ascii=False).encode('utf-8'))
+    
+    def _handle_system_status(self, request: HTTPRequest) -> Dict:
+        return self.get_system_status(self._request_api_key(request))
+    
+    def _handle_performance_metrics(self, request: HTTPRequest) -> Dict:
+        start_time, end_time = request.query.get('start_time'), request.query.get('end_time')
+        if not start_time or not end_time:
+            return {"error": "start_time and end_time are required", "status_code": 400}
+        return self.get_performance_metrics(self._request_api_key(request), start_time, end_time,
+                                            cursor=request.query.get('cursor'), limit=request.query.get('limit'),
+                                            max_points=request.query.get('max_points'))
+    
+    def _handle_trigger_optimization(self, request: HTTPRequest) -> Dict:
+        try:
+            payload = json.loads(request.body) if request.body else {}
+        except ValueError:
+            return {"error": "Invalid JSON body", "status_code": 400}
+        action = payload.get('action') or request.query.get('action')
+        if not action:
+            return {"error": "action is required", "status_code": 400}
+        idempotency_key = request.headers.get('idempotency-key') or payload.get('idempotency_key')
+        return self.trigger_optimization(self._request_api_key(request), action, payload.get('parameters'),
+                                         idempotency_key=idempotency_key)
+    
+    async def _handle_optimization_status(self, request: HTTPRequest) -> Dict:
+        """查询任务状态；wait 参数（秒）开启长轮询，任务完成或超时后返回"""
+        api_key = self._request_api_key(request)
+        job_id = request.query.get('job_id', '')
+        try:
+            wait = float(request.query.get('wait', 0))
+        except ValueError:
+            return {"error": "Invalid wait", "status_code": 400}
+        max_wait = ((self.config.get('api', {}) or {}).get('jobs', {}) or {}).get('max_wait_seconds', 30)
+        job = self.jobs.get(job_id)
+        if wait > 0 and job is not None and job.owner == api_key:
+            await self.jobs.wait(job, min(wait, max_wait))
+        return self.get_optimization_status(api_key, job_id)
+    
+    def _handle_optimization_jobs(self, request: HTTPRequest) -> Dict:
+        api_key = self._request_api_key(request)
+        if not self.authenticate_request(api_key):
+            return {"error": "Invalid API key", "status_code": 401}
+        return {"data": [job.to_dict() for job in self.jobs.list_jobs(owner=api_key)], "status_code": 200}
+    
+    def _handle_metrics_stream(self, request: HTTPRequest) -> Any:
+        """订阅指标推送：format 为 sse 或 ndjson，cursor（或 SSE 的 Last-Event-ID 头）用于断线续传；
+        事件来源通过 MonitoringAgent.add_listener(api.broadcaster.publish) 接入"""
+        if not self.authenticate_request(self._request_api_key(request)):
+            return {"error": "Invalid API key", "status_code": 401}
+        fmt = request.query.get('format', 'sse')
+        if fmt not in STREAM_FORMATS:
+            return {"error": f"Unsupported format: {fmt}", "status_code": 400}
+        cursor = request.query.get('cursor') or request.headers.get('last-event-id')
+        try:
+            cursor = int(cursor) if cursor else None
+        except ValueError:
+            return {"error": "Invalid cursor", "status_code": 400}
+        types = set(request.query['types'].split(',')) if request.query.get('types') else None
+        heartbeat = ((self.config.get('api', {}) or {}).get('stream', {}) or {}).get('heartbeat_seconds', 15)
+        subscriber = self.broadcaster.subscribe(cursor, types)
+        logger.info("新增指标推送订阅，格式: %s，续传游标: %s，订阅者数: %d",
+                    fmt, cursor, len(self.broadcaster.subscribers))
+        content_type = 'text/event-stream; charset=utf-8' if fmt == 'sse' else 'application/x-ndjson; charset=utf-8'
+        return HTTPResponse(200, content_type=content_type, headers={'Cache-Control': 'no-cache'},
+                            stream=self.broadcaster.stream(subscriber, fmt, heartbeat))
+    
+    def _cached_response(self, request: HTTPRequest, handler: Any, ttl: float) -> HTTPResponse:
+        """经响应缓存处理 GET 请求：先校验密钥，再按路径和查询参数取缓存的响应体，
+        按 Accept/Accept-Encoding 协商编码和压缩，条件请求命中时返回 304"""
+        if not self.authenticate_request(self._request_api_key(request)):
+            return self._json_response({"error": "Invalid API key", "status_code": 401})
+        key = (request.path, tuple(sorted((name, value) for name, value in request.query.items()
+                                          if name != 'api_key')))
+        entry, result = self.response_cache.get_or_build(key, ttl, lambda: handler(request))
+        if entry is None:
+            return self._json_response(result)
+        status_code, body, headers = entry.render(request.headers)
+        return HTTPResponse(status_code, body, headers=headers, content_type=headers.pop('Content-Type'))
+    
+    def _handle_api_stats(self, request: HTTPRequest) -> Dict:
+        """返回各接口的请求统计以及限流、响应缓存和优化任务的状态"""
+        if not self.authenticate_request(self._request_api_key(request), 'admin'):
+            return {"error": "Invalid API key", "status_code": 401}
+        return {"data": {
+            "endpoints": self.request_accounting.get_stats(),
+            "rate_limiter": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+            "jobs": self.jobs.stats()
+        }, "status_code": 200}
+    
+    async def handle_request(self, request: HTTPRequest) -> HTTPResponse:
+        """处理 HTTP 请求并按接口记录状态码和耗时（流式响应记录到响应头就绪为止）"""
+        started = time.perf_counter()
+        response = await self._route_request(request)
+        self.request_accounting.record(request.path, response.status, time.perf_counter() - started)
+        return response
+    
+    async def _route_request(self, request: HTTPRequest) -> HTTPResponse:
+        """先按 API 密钥限流（超出时直接返回 429，无效密钥共用一个令牌桶），再按方法和路径分发请求；
+        同步处理函数在线程池中执行"""
+        if self.rate_limiter is not None:
+            allowed, wait = self.rate_limiter.acquire(self._rate_limit_key(request))
+            if not allowed:
+                response = self._json_response({"error": "Rate limit exceeded", "status_code": 429})
+                response.headers['Retry-After'] = self.rate_limiter.retry_after(wait)
+                return response
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return self._json_response({"error": "Method not allowed", "status_code": 405})
+            return self._json_response({"error": "Not found", "status_code": 404})
+        loop = asyncio.get_running_loop()
+        ttl = self._cache_ttls.get(request.path) if request.method == 'GET' else None
+        if ttl and self.response_cache is not None:
+            return await loop.run_in_executor(None, self._cached_response, request, handler, ttl)
+        if inspect.iscoroutinefunction(handler) or handler in self._loop_handlers:
+            result = handler(request)
+            if inspect.isawaitable(result):
+                result = await result
+        else:
+            # 同步处理函数可能读取知识库或等待锁，放到线程池执行
+            result = await loop.run_in_executor(None, handler, request)
+        return result if isinstance(result, HTTPResponse) else self._json_response(result)
+    
+    def create_server(self) -> AsyncHTTPServer:
+        """根据 api 配置创建 HTTP 服务器"""
+        api_config = self.config.get('api', {}) or {}
+        return AsyncHTTPServer(self.handle_request,
+                               host=api_config.get('host', '127.0.0.1'),
+                               port=api_config.get('port', 8080),
+                               max_connections=api_config.get('max_connections', 1000),
+                               keepalive_timeout=api_config.get('keepalive_timeout', 15),
+                               max_pipelined_requests=api_config.get('max_pipelined_requests', 16),
+                               max_body_bytes=api_config.get('max_body_bytes', 1048576),
+                               drain_timeout=api_config.get('drain_timeout', 10))
+    
+    async def serve(self, stop_event: Optional[asyncio.Event] = None) -> None:
+        """启动 HTTP 服务，直到 stop_event 被设置或收到 SIGINT/SIGTERM，然后优雅排空"""
+        stop_event = stop_event or asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # 非主线程或不支持信号处理的平台
+        self.broadcaster.attach_loop(loop)
+        self.server = self.create_server()
+        await self.server.start()
+        logger.info("API 服务运行在端口: %d", self.server.port)
+        try:
+            await stop_event.wait()
+        finally:
+            # 先结束推送订阅，使流式响应正常收尾，再排空连接
+            self.broadcaster.close()
+            await self.server.shutdown()
+            self.jobs.shutdown(wait=False)
     
     def run(self) -> None:
-        """模拟运行 API 服务"""
-        logger.info("模拟启动 API 服务...")
-        port = self.config.get('api', {}).get('port', 8080)
-        logger.info("API 服务运行在端口: %d", port)
-        
-        while True:
-            # 模拟处理 API 请求
-            sample_request = random.choice([
-                lambda: self.get_system_status(self.api_key),
-                lambda: self.get_performance_metrics(self.api_key, "2025-05-14T18:00:00Z", "2025-05-14T18:01:00Z"),
-                lambda: self.trigger_optimization(self.api_key, random.choice(["create_index", "partition_data"]))
-            ])
-            response = sample_request()
-            logger.info("模拟 API 响应: %s", response)
-            
-            # 模拟休眠
-            time.sleep(600)  # 每10分钟模拟一次请求
+        """运行 API 服务"""
+        asyncio.run(self.serve())
 
 if __name__ == "__main__":
-    # 模拟启动 API 接口
+    # 启动 API 接口
     api = APIInterface(config_path="config.yaml")
     try:
         api.run()
@@ -0,0 +1,328 @@
+# 刀 AI 数据库扩展技术 - 审计日志写入器
+# 本脚本实现只追加的审计日志：调用方只在一把短锁内分配单调递增的事件编号并入队，后台线程批量写入并统一 fsync（组提交），
+# 文件达到大小上限后轮转；每个文件按固定条数分块记录时间范围和文件偏移，按时间范围查询只读取相关文件的相关块。
+
+import os
+import json
+import time
+import itertools
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Any, Deque, Iterator, Optional
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_INDEX_FILE = 'audit_index.jsonl'
+
+
+class _FileIndex:
+    """单个审计文件的索引：编号和时间范围，以及每 block_events 条一个的块（最小时间、最大时间、起始偏移）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.first_id: Optional[int] = None
+        self.last_id: Optional[int] = None
+        self.max_id = 0
+        self.min_ts = float('inf')
+        self.max_ts = float('-inf')
+        self.count = 0
+        self.size = 0
+        self.blocks: List[List[float]] = []
+
+    def add(self, event_id: int, timestamp: float, offset: int, length: int, block_events: int) -> None:
+        if self.count % block_events == 0:
+            self.blocks.append([timestamp, timestamp, offset])
+        block = self.blocks[-1]
+        block[0] = min(block[0], timestamp)
+        block[1] = max(block[1], timestamp)
+        if self.first_id is None:
+            self.first_id = event_id
+        self.last_id = event_id
+        self.max_id = max(self.max_id, event_id)
+        self.min_ts = min(self.min_ts, timestamp)
+        self.max_ts = max(self.max_ts, timestamp)
+        self.count += 1
+        self.size = offset + length
+
+    def overlaps(self, start: float, end: float) -> bool:
+        return self.count > 0 and self.min_ts <= end and self.max_ts >= start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'file': self.name, 'first_id': self.first_id, 'last_id': self.last_id, 'max_id': self.max_id, 'min_ts': self.min_ts,
+                'max_ts': self.max_ts, 'count': self.count, 'size': self.size, 'blocks': self.blocks}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> '_FileIndex':
+        index = cls(data['file'])
+        index.first_id, index.last_id = data['first_id'], data['last_id']
+        index.max_id = data.get('max_id', data['last_id'] or 0)
+        index.min_ts, index.max_ts = data['min_ts'], data['max_ts']
+        index.count, index.size, index.blocks = data['count'], data['size'], data['blocks']
+        return index
+
+
+class AuditLogWriter:
+    """缓冲的异步审计日志写入器：append 只入队，后台线程批量写入轮转文件；未指定目录时只在内存中保留最近的事件"""
+
+    def __init__(self, directory: Optional[str] = None, queue_size: int = 10000, flush_interval: float = 0.05,
+                 max_file_bytes: int = 16 * 1024 * 1024, max_files: Optional[int] = None,
+                 block_events: int = 256, overflow: str = 'block', fsync: bool = True,
+                 memory_events: int = 10000):
+        """queue_size 为待写入事件上限，写线程落后时按 overflow 处理：block（调用方等待）或 drop（丢弃并计数）；
+        max_files 为保留的已轮转文件数（None 表示全部保留）；memory_events 为内存模式下保留的最近事件数"""
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"不支持的队列溢出策略: {overflow}")
+        self.directory = directory
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.block_events = block_events
+        self.overflow = overflow
+        self.fsync = fsync
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self._queue: Deque[Any] = deque()
+        self._recent: Deque[Dict] = deque(maxlen=memory_events)
+        self._sealed: List[_FileIndex] = []
+        self._active: Optional[_FileIndex] = None
+        self._file = None
+        self._offset = 0  # 当前文件已写出（可能尚未刷盘）的字节数
+        self._wake = threading.Event()
+        self._space = threading.Event()
+        self._read_lock = threading.Lock()  # 写线程更新索引和查询读取索引之间互斥
+        self._append_lock = threading.Lock()  # 编号分配和入队在同一把锁内，保证队列（即文件）中的编号有序
+        self._closed = False
+        next_id = 1
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            next_id = self._recover()
+        self._ids = itertools.count(next_id)
+        self._thread = threading.Thread(target=self._writer_loop, name='audit_log_writer', daemon=True)
+        self._thread.start()
+
+    def _recover(self) -> int:
+        """读取已轮转文件的索引，重新扫描最后一个（未轮转的）文件，返回下一个事件编号"""
+        index_path = os.path.join(self.directory, _INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._sealed.append(_FileIndex.from_dict(json.loads(line)))
+                    except (ValueError, KeyError):
+                        break  # 崩溃时未写完的最后一行
+        sealed_names = {index.name for index in self._sealed}
+        active = sorted(name for name in os.listdir(self.directory)
+                        if name.startswith('audit-') and name.endswith('.jsonl') and name not in sealed_names)
+        max_id = max((index.max_id for index in self._sealed), default=0)
+        if active:
+            self._active = self._scan(active[-1])
+            max_id = max(max_id, self._active.max_id)
+        return max_id + 1
+
+    def _scan(self, name: str) -> _FileIndex:
+        """扫描文件重建索引，截掉崩溃时未写完的尾部"""
+        index = _FileIndex(name)
+        path = os.path.join(self.directory, name)
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break
+                index.add(event['event_id'], event['timestamp'], offset, len(line), self.block_events)
+                offset += len(line)
+        if os.path.getsize(path) != offset:
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return index
+
+    def append(self, event_type: str, details: Dict[str, Any]) -> int:
+        """记录审计事件并返回其编号；只分配编号并入队，不做磁盘 IO。队列已满且策略为 drop 时返回 -1"""
+        if self._closed:
+            self.dropped += 1
+            return -1
+        if len(self._queue) >= self.queue_size:
+            if self.overflow == 'drop':
+                self.dropped += 1
+                return -1
+            self._wake.set()
+            while len(self._queue) >= self.queue_size and not self._closed:
+                self._space.clear()
+                self._space.wait(self.flush_interval)
+        with self._append_lock:
+            event_id = next(self._ids)
+            self._queue.append({'event_id': event_id, 'timestamp': time.time(), 'event_type': event_type,
+                                'details': details})
+        return event_id
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的事件全部写入（并 fsync），返回是否在超时前完成"""
+        if self._closed:
+            return not self._queue
+        done = threading.Event()
+        self._queue.append(done)
+        self._wake.set()
+        return done.wait(timeout)
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closed
+            self._write_pending()
+            if closing:
+                return
+
+    def _write_pending(self) -> None:
+        """取走队列中的全部事件，写入后统一刷盘一次，再唤醒等待的 flush 调用方"""
+        waiters: List[threading.Event] = []
+        events: List[Dict] = []
+        while self._queue:
+            item = self._queue.popleft()
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            else:
+                events.append(item)
+        self._space.set()
+        if events:
+            try:
+                self._write_batch(events)
+            except Exception as e:
+                # 任何异常都不能终止写线程，否则 flush 和阻塞模式的 append 会永远等待
+                logger.error("审计日志写入失败，丢失事件数: %d，错误: %s", len(events), str(e))
+                self.dropped += len(events)
+        for waiter in waiters:
+            waiter.set()
+
+    def _write_batch(self, events: List[Dict]) -> None:
+        if not self.directory:
+            with self._read_lock:
+                self._recent.extend(events)
+            self.written += len(events)
+            self.batches += 1
+            return
+        marks = []
+        for event in events:
+            if self._file is None or self._offset >= self.max_file_bytes:
+                self._commit(marks)
+                marks = []
+                self._rotate(event['event_id'])
+            line = (json.dumps(event, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+            self._file.write(line)
+            marks.append((event['event_id'], event['timestamp'], self._offset, len(line)))
+            self._offset += len(line)
+        self._commit(marks)
+        self.written += len(events)
+        self.batches += 1
+    
+    def _commit(self, marks: List[tuple]) -> None:
+        """刷盘后再把事件登记到索引，查询只会读到已完整写入的行"""
+        if not marks:
+            return
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        with self._read_lock:
+            for event_id, timestamp, offset, length in marks:
+                self._active.add(event_id, timestamp, offset, length, self.block_events)
+
+    def _rotate(self, next_event_id: int) -> None:
+        """把当前文件登记到索引（已轮转），打开以下一个事件编号命名的新文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._active is not None and self._active.count and self._active.size >= self.max_file_bytes:
+            with open(os.path.join(self.directory, _INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self._active.to_dict()) + '\n')
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            with self._read_lock:
+                self._sealed.append(self._active)
+                self._active = None
+            self._expire()
+        if self._active is None:
+            self._active = _FileIndex(f"audit-{next_event_id:012d}.jsonl")
+        self._file = open(os.path.join(self.directory, self._active.name), 'ab')
+        self._offset = self._active.size
+
+    def _expire(self) -> None:
+        """已轮转文件超过 max_files 时删除最旧的文件并重写索引"""
+        if not self.max_files or len(self._sealed) <= self.max_files:
+            return
+        with self._read_lock:
+            expired = self._sealed[:-self.max_files]
+            self._sealed = self._sealed[-self.max_files:]
+        index_path = os.path.join(self.directory, _INDEX_FILE)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            for index in self._sealed:
+                f.write(json.dumps(index.to_dict()) + '\n')
+        os.replace(index_path + '.tmp', index_path)
+        for index in expired:
+            try:
+                os.remove(os.path.join(self.directory, index.name))
+            except FileNotFoundError:
+                pass
+        logger.info("审计日志轮转文件超过上限，已删除文件数: %d", len(expired))
+
+    def query(self, start: float, end: float, event_type: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        """按时间范围查询已写入的审计事件（按写入顺序）；只读取时间范围重叠的文件中重叠的块"""
+        return list(itertools.islice(self._iter_range(start, end, event_type), limit))
+
+    def _iter_range(self, start: float, end: float, event_type: Optional[str]) -> Iterator[Dict]:
+        with self._read_lock:
+            if not self.directory:
+                candidates = list(self._recent)
+                files = []
+            else:
+                candidates = []
+                files = [(index.name, [list(block) for block in index.blocks], index.size)
+                         for index in self._sealed + ([self._active] if self._active else [])
+                         if index.overlaps(start, end)]
+        for event in candidates:
+            if start <= event['timestamp'] <= end and (event_type is None or event['event_type'] == event_type):
+                yield event
+        for name, blocks, size in files:
+            try:
+                f = open(os.path.join(self.directory, name), 'rb')
+            except FileNotFoundError:
+                continue  # 查询期间文件已过期删除
+            with f:
+                for i, (block_min, block_max, offset) in enumerate(blocks):
+                    if block_min > end or block_max < start:
+                        continue
+                    block_end = blocks[i + 1][2] if i + 1 < len(blocks) else size
+                    f.seek(int(offset))
+                    for line in f.read(int(block_end - offset)).splitlines():
+                        event = json.loads(line)
+                        if start <= event['timestamp'] <= end and \
+                                (event_type is None or event['event_type'] == event_type):
+                            yield event
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': len(self._queue),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'files': len(self._sealed) + (1 if self._active is not None else 0)
+        }
+
+    def close(self) -> None:
+        """写完队列中的剩余事件后停止写线程并关闭文件"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._space.set()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,432 @@
+# 刀 AI 数据库扩展技术 - 图表数据加载器
+# 本脚本实现数据可视化模块的可插拔数据加载器，统一以列数组（NumPy）的形式提供数据：
+# json 加载器沿用原有的样本数据文件（整体加载到内存）；ndjson 加载器逐行流式读取，按批产出列数组，不保留记录字典；
+# columnar 加载器通过内存映射读取列式文件，列数组直接映射到文件，不复制数据；ISO 8601 时间字符串列以 datetime64 存储。
+# 字段名可以用点号访问嵌套字段，如 estimated_impact.query_time_reduction。
+
+import os
+import re
+import json
+import logging
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+LOADER_FORMATS = ('json', 'ndjson', 'columnar')
+NDJSON_SUFFIX = '.ndjson'
+COLUMNAR_META = 'meta.json'
+COLUMN_SUFFIX = '.col'
+# 列式文件中原样存储的数值类型，其他类型（字符串等）按字典编码存储
+_RAW_KINDS = 'fiubM'
+_DECODER = json.JSONDecoder()
+# 按 datetime64 存储的 ISO 8601（UTC）时间字符串
+_ISO_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d{1,3})?)?)?Z?$')
+_CONVERT_ROWS = 1 << 20
+
+
+def _field(record: Dict[str, Any], field: str) -> Any:
+    """读取记录中的字段，支持点号分隔的嵌套字段，缺失时返回 None"""
+    if '.' not in field:
+        return record.get(field)
+    value: Any = record
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+_NUMERIC_TYPES = {int, float, type(None)}
+
+
+def to_array(values: List[Any]) -> np.ndarray:
+    """把一批值转换为列数组：全为布尔值时为 bool，全为整数时为 int64，数值（缺失记为 NaN）为 float64，其他为 object"""
+    types = set(map(type, values))
+    if types == {bool}:
+        return np.array(values, dtype=bool)
+    if types == {int}:
+        return np.array(values, dtype=np.int64)
+    if types <= _NUMERIC_TYPES:
+        # None 转换为 NaN
+        return np.array(values, dtype=np.float64)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _datetime_strings(array: np.ndarray) -> List[Optional[str]]:
+    """把 datetime64 数组格式化为 ISO 8601（UTC）时间字符串，NaT 还原为 None"""
+    valid = ~np.isnat(array)
+    millis = array[valid].astype('datetime64[ms]').astype(np.int64)
+    unit = 'ms' if (millis % 1000).any() else 's'
+    return [None if v == 'NaT' else v + 'Z' for v in np.datetime_as_string(array, unit=unit).tolist()]
+
+
+def to_list(values: Any) -> List[Any]:
+    """把列数组转换为列表用于输出，浮点列中的 NaN 还原为 None，时间列还原为 ISO 8601 字符串"""
+    array = np.asarray(values)
+    if array.dtype.kind == 'f':
+        return [None if v != v else v for v in array.tolist()]
+    if array.dtype.kind == 'M':
+        return _datetime_strings(array)
+    return array.tolist()
+
+
+def _concat(parts: List[np.ndarray]) -> np.ndarray:
+    if not parts:
+        return np.empty(0, dtype=np.float64)
+    if len(parts) == 1:
+        return parts[0]
+    kinds = {part.dtype.kind for part in parts}
+    if len(kinds) > 1 and not kinds <= set('if'):
+        parts = [part.astype(object) for part in parts]
+    return np.concatenate(parts)
+
+
+class RecordsLoader:
+    """内存中的记录列表（原有的 JSON 样本数据），按需把字段转换为列数组"""
+
+    random_access = True
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+
+    @classmethod
+    def from_json(cls, path: str) -> 'RecordsLoader':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _records(self, dataset: str) -> List[Dict]:
+        records = self.data.get(dataset, [])
+        return records if isinstance(records, list) else []
+
+    def count(self, dataset: str) -> int:
+        return len(self._records(dataset))
+
+    def columns(self, dataset: str, fields: Sequence[str], start: int = 0) -> Dict[str, np.ndarray]:
+        records = self._records(dataset)[start:]
+        return {field: to_array([_field(record, field) for record in records]) for field in fields}
+
+    def iter_batches(self, dataset: str, fields: Sequence[str], batch_rows: Optional[int] = None,
+                     start: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+        batch_rows = batch_rows or 65536
+        records = self._records(dataset)
+        for lo in range(start, len(records), batch_rows):
+            batch = records[lo:lo + batch_rows]
+            yield {field: to_array([_field(record, field) for record in batch]) for field in fields}
+
+    def close(self) -> None:
+        pass
+
+
+class NDJSONLoader:
+    """NDJSON 流式加载器：目录下每个数据集一个 <数据集>.ndjson 文件，每行一条记录（空行忽略）。
+    逐行解析并只保留所需字段，按 batch_rows 行产出列数组；记住已读取位置的文件偏移，
+    增量读取时从上次的位置继续，开销只与新增的行数有关"""
+
+    random_access = False
+
+    def __init__(self, directory: str, batch_rows: int = 65536):
+        self.directory = directory
+        self.batch_rows = batch_rows
+        # 数据集 -> {已读取的行数: 对应的文件偏移}
+        self._offsets: Dict[str, Dict[int, int]] = {}
+
+    def path(self, dataset: str) -> str:
+        return os.path.join(self.directory, dataset + NDJSON_SUFFIX)
+
+    def _remember(self, dataset: str, rows: int, offset: int) -> None:
+        offsets = self._offsets.setdefault(dataset, {})
+        offsets[rows] = offset
+        while len(offsets) > 8:
+            del offsets[min(offsets)]
+
+    def _seek(self, f, dataset: str, start: int) -> int:
+        """定位到第 start 行之前，优先使用记住的偏移；返回已跳过的行数"""
+        offsets = self._offsets.get(dataset, {})
+        known = max((rows for rows in offsets if rows <= start), default=0)
+        offset = offsets.get(known, 0)
+        if offset > os.fstat(f.fileno()).st_size:
+            # 文件被截断或替换，记住的偏移失效
+            self._offsets.pop(dataset, None)
+            known, offset = 0, 0
+        f.seek(offset)
+        return known
+
+    def _lines(self, dataset: str, start: int = 0) -> Iterator[bytes]:
+        """产出第 start 行起的非空行，读到文件末尾时记住位置；最后一行没有换行符时视为正在写入，不读取"""
+        path = self.path(dataset)
+        if not os.path.exists(path):
+            self._offsets.pop(dataset, None)
+            return
+        with open(path, 'rb') as f:
+            rows = self._seek(f, dataset, start)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    self._remember(dataset, rows, offset)
+                    return
+                if not line.strip():
+                    continue
+                if rows >= start:
+                    yield line
+                rows += 1
+
+    def count(self, dataset: str) -> int:
+        """返回行数；只扫描上次记住的位置之后新增的内容"""
+        for _ in self._lines(dataset, max(self._offsets.get(dataset, {}), default=0)):
+            pass
+        return max(self._offsets.get(dataset, {}), default=0)
+
+    def iter_batches(self, dataset: str, fields: Sequence[str], batch_rows: Optional[int] = None,
+                     start: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+        batch_rows = batch_rows or self.batch_rows
+        values: Dict[str, List[Any]] = {field: [] for field in fields}
+        # 顶层字段直接用 dict.get 读取，只有嵌套字段才逐级查找
+        simple = [(field, values[field].append) for field in fields if '.' not in field]
+        nested = [(field, values[field].append) for field in fields if '.' in field]
+        decode = _DECODER.raw_decode
+        rows = 0
+        for line in self._lines(dataset, start):
+            record = decode(line.decode('utf-8').strip())[0]
+            for field, append in simple:
+                append(record.get(field))
+            for field, append in nested:
+                append(_field(record, field))
+            rows += 1
+            if rows == batch_rows:
+                yield {field: to_array(column) for field, column in values.items()}
+                values = {field: [] for field in fields}
+                simple = [(field, values[field].append) for field in fields if '.' not in field]
+                nested = [(field, values[field].append) for field in fields if '.' in field]
+                rows = 0
+        if rows:
+            yield {field: to_array(column) for field, column in values.items()}
+
+    def columns(self, dataset: str, fields: Sequence[str], start: int = 0) -> Dict[str, np.ndarray]:
+        """读取整列（内存与所需列的大小成正比），大文件应使用 iter_batches"""
+        parts: Dict[str, List[np.ndarray]] = {field: [] for field in fields}
+        for batch in self.iter_batches(dataset, fields, start=start):
+            for field in fields:
+                parts[field].append(batch[field])
+        return {field: _concat(parts[field]) for field in fields}
+
+    def close(self) -> None:
+        self._offsets.clear()
+
+
+class DictionaryColumn:
+    """字典编码的列：按下标访问时才解码，整列不物化为字符串数组"""
+
+    def __init__(self, codes: np.ndarray, dictionary: List[Any]):
+        self.codes = codes
+        self.dictionary = dictionary
+        self._values = np.empty(len(dictionary), dtype=object)
+        self._values[:] = dictionary
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(object)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> Any:
+        if isinstance(index, (int, np.integer)):
+            return self.dictionary[self.codes[index]]
+        return self._values[self.codes[index]]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        values = self._values[self.codes]
+        return values if dtype is None else values.astype(dtype)
+
+
+class ColumnarLoader:
+    """内存映射的列式加载器：目录下每个数据集一个子目录，包含 meta.json（行数及各列类型）和每列一个原始数据文件；
+    数值列直接映射为数组视图，字符串列按字典编码存储"""
+
+    random_access = True
+
+    def __init__(self, directory: str, batch_rows: int = 65536):
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self._meta: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    def _dataset_meta(self, dataset: str) -> Optional[Dict[str, Any]]:
+        """读取数据集元数据，文件更新后重新读取"""
+        path = os.path.join(self.directory, dataset, COLUMNAR_META)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        cached = self._meta.get(dataset)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = self._meta[dataset] = (mtime, json.load(f))
+        return cached[1]
+
+    def count(self, dataset: str) -> int:
+        meta = self._dataset_meta(dataset)
+        return meta['count'] if meta else 0
+
+    def column(self, dataset: str, field: str) -> Union[np.ndarray, DictionaryColumn]:
+        meta = self._dataset_meta(dataset)
+        count = meta['count'] if meta else 0
+        spec = meta['columns'].get(field) if meta else None
+        if spec is None:
+            return np.full(count, np.nan)
+        if count == 0:
+            values = np.empty(0, dtype=spec['dtype'])
+        else:
+            values = np.memmap(os.path.join(self.directory, dataset, spec['file']), dtype=spec['dtype'],
+                               mode='r', shape=(count,))
+        return DictionaryColumn(values, spec['dictionary']) if 'dictionary' in spec else values
+
+    def columns(self, dataset: str, fields: Sequence[str], start: int = 0) -> Dict[str, Any]:
+        """返回各列的映射视图（不复制数据）"""
+        return {field: self.column(dataset, field)[start:] if start else self.column(dataset, field)
+                for field in fields}
+
+    def iter_batches(self, dataset: str, fields: Sequence[str], batch_rows: Optional[int] = None,
+                     start: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+        batch_rows = batch_rows or self.batch_rows
+        columns = {field: self.column(dataset, field) for field in fields}
+        for lo in range(start, self.count(dataset), batch_rows):
+            yield {field: np.asarray(column[lo:lo + batch_rows]) for field, column in columns.items()}
+
+    def close(self) -> None:
+        self._meta.clear()
+
+
+def _parse_timestamps(values: np.ndarray) -> Optional[np.ndarray]:
+    """把 ISO 8601（UTC）时间字符串列（可含缺失值）解析为 datetime64[ms]，不是时间字符串列时返回 None"""
+    items = values.tolist()
+    if not any(isinstance(v, str) for v in items):
+        return None
+    if not all(v is None or (isinstance(v, str) and _ISO_TIMESTAMP.match(v)) for v in items):
+        return None
+    try:
+        return np.array(['NaT' if v is None else v.rstrip('Z') for v in items], dtype='datetime64[ms]')
+    except ValueError:
+        return None
+
+
+def _dictionary_values(values: np.ndarray) -> List[Any]:
+    """字典编码前把列数组转换为原始值，浮点列的 NaN 和时间列的 NaT 记为 None"""
+    if values.dtype.kind in 'fM':
+        return to_list(values)
+    return values.tolist()
+
+
+def _widen(old: str, new: np.dtype) -> Optional[np.dtype]:
+    """返回能同时无损保存两种类型的原样存储类型（如 int64 与 float64 合并为 float64），无法合并时返回 None"""
+    old_dtype = np.dtype(old)
+    if old_dtype.kind in 'biuf' and new.kind in 'biuf' or old_dtype.kind == new.kind == 'M':
+        return np.result_type(old_dtype, new).newbyteorder('<')
+    return None
+
+
+def _rewrite(path: str, dtype: str, rows: int, convert) -> None:
+    """按块读取已写入的 rows 行并用 convert 转换后重写文件"""
+    with open(path, 'rb') as src, open(path + '.convert', 'wb') as dst:
+        for _ in range(0, rows, _CONVERT_ROWS):
+            dst.write(convert(np.fromfile(src, dtype=dtype, count=_CONVERT_ROWS)))
+    os.replace(path + '.convert', path)
+
+
+def write_columnar(directory: str, dataset: str, batches: Iterable[Dict[str, np.ndarray]]) -> int:
+    """把列数组批次流式写入列式数据集并返回行数。数值列原样追加，ISO 8601 时间字符串列以 datetime64[ms] 存储，
+    其他列按字典编码；后续批次的类型与已写入的不一致时先拓宽列类型（整数与浮点合并为 float64，
+    无法合并的改为字典编码）并转换已写入的数据，不截断或丢失值。元数据最后原子写入，写入过程中读取方看到的仍是旧数据"""
+    target = os.path.join(directory, dataset)
+    os.makedirs(target, exist_ok=True)
+    specs: Dict[str, Dict[str, Any]] = {}
+    dictionaries: Dict[str, Dict[Any, int]] = {}
+    files = {}
+    written: Dict[str, int] = {}
+    count = 0
+
+    def encode(field: str, values: List[Any]) -> bytes:
+        codes = dictionaries[field]
+        return np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int32,
+                           count=len(values)).astype('<i4').tobytes()
+
+    def convert(field: str, dtype: Optional[np.dtype]) -> None:
+        """把已写入的列转换为 dtype 原样存储，dtype 为 None 时转换为字典编码"""
+        spec = specs[field]
+        path = os.path.join(target, spec['file'] + '.tmp')
+        files[field].close()
+        if dtype is None:
+            dictionaries[field] = {}
+            _rewrite(path, spec['dtype'], written[field], lambda data: encode(field, _dictionary_values(data)))
+            spec['dtype'] = '<i4'
+            logger.info("列 %s 的类型不一致，已改为字典编码", field)
+        else:
+            _rewrite(path, spec['dtype'], written[field], lambda data: data.astype(dtype).tobytes())
+            logger.info("列 %s 的类型已从 %s 拓宽为 %s", field, spec['dtype'], dtype.str)
+            spec['dtype'] = dtype.str
+        files[field] = open(path, 'ab')
+
+    try:
+        for batch in batches:
+            for field, values in batch.items():
+                values = np.asarray(values)
+                if values.dtype.kind == 'O' and field not in dictionaries:
+                    parsed = _parse_timestamps(values)
+                    if parsed is not None:
+                        values = parsed
+                if field in specs and specs[field]['dtype'][1] == 'M' and values.dtype.kind == 'f' \
+                        and np.isnan(values).all():
+                    # 时间列中整批缺失的值
+                    values = np.full(len(values), np.datetime64('NaT'), dtype=specs[field]['dtype'])
+                raw = values.dtype.kind in _RAW_KINDS
+                if field not in specs:
+                    name = field.replace(os.sep, '_') + COLUMN_SUFFIX
+                    if raw:
+                        specs[field] = {'file': name, 'dtype': values.dtype.newbyteorder('<').str}
+                    else:
+                        specs[field] = {'file': name, 'dtype': '<i4'}
+                        dictionaries[field] = {}
+                    files[field] = open(os.path.join(target, name + '.tmp'), 'wb')
+                    written[field] = 0
+                elif field not in dictionaries and np.dtype(specs[field]['dtype']) != values.dtype:
+                    widened = _widen(specs[field]['dtype'], values.dtype) if raw else None
+                    if widened is None or widened != np.dtype(specs[field]['dtype']):
+                        convert(field, widened)
+                if field in dictionaries:
+                    files[field].write(encode(field, _dictionary_values(values)))
+                else:
+                    files[field].write(np.ascontiguousarray(values, dtype=specs[field]['dtype']).tobytes())
+                written[field] += len(values)
+            count += len(next(iter(batch.values()))) if batch else 0
+    finally:
+        for f in files.values():
+            f.close()
+    for field, spec in specs.items():
+        os.replace(os.path.join(target, spec['file'] + '.tmp'), os.path.join(target, spec['file']))
+        if field in dictionaries:
+            spec['dictionary'] = list(dictionaries[field])
+    meta_path = os.path.join(target, COLUMNAR_META)
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'count': count, 'columns': specs}, f, ensure_ascii=False)
+    os.replace(meta_path + '.tmp', meta_path)
+    logger.info("列式数据集已写入: %s，行数: %d", target, count)
+    return count
+
+
+def create_loader(config: Dict[str, Any], data_path: str, data: Optional[Dict[str, Any]] = None):
+    """根据 visualization.loader 配置创建加载器；json 格式直接使用已加载的样本数据"""
+    fmt = config.get('format', 'json')
+    if fmt not in LOADER_FORMATS:
+        raise ValueError(f"不支持的数据加载格式: {fmt}")
+    batch_rows = config.get('batch_rows', 65536)
+    if fmt == 'ndjson':
+        return NDJSONLoader(config.get('path', data_path), batch_rows)
+    if fmt == 'columnar':
+        return ColumnarLoader(config.get('path', data_path), batch_rows)
+    return RecordsLoader(data) if data is not None else RecordsLoader.from_json(config.get('path', data_path))
@@ -0,0 +1,375 @@
+# 刀 AI 数据库扩展技术 - 离线图表渲染
+# 本脚本把可视化模块生成的图表数据渲染为静态 SVG/PNG 文件，用于定时报表：
+# 图表先布局为与输出格式无关的图元（折线、矩形、包络带、标记、文字），再分别输出为 SVG 文本或光栅化为 PNG（NumPy + zlib，不依赖绘图库）；
+# 渲染结果按图表内容与渲染选项的哈希缓存在磁盘上，内容不变的图表不会重复渲染，未命中缓存的图表交给进程池并行渲染。
+
+import os
+import json
+import struct
+import zlib
+import hashlib
+import logging
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Deque, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RENDER_FORMATS = ('svg', 'png')
+# 渲染逻辑变化时递增，使旧的缓存文件失效
+RENDERER_VERSION = 1
+PALETTE = ('#1f77b4', '#ff7f0e', '#2ca02c', '#9467bd', '#8c564b', '#17becf')
+ANOMALY_COLOR = '#d62728'
+AXIS_COLOR = '#444444'
+BAND_COLOR = '#c6dbef'
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 60, 20, 36, 30
+
+# 图元：(类型, 参数...)，坐标均为像素
+Primitive = Tuple[Any, ...]
+
+
+def content_digest(chart: Dict[str, Any]) -> str:
+    """图表内容（不含生成时间）的 SHA-256 哈希"""
+    content = {key: value for key, value in chart.items() if key != 'generated_at'}
+    payload = json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def chart_key(digest: str, fmt: str, width: int, height: int) -> str:
+    """图表内容哈希与渲染选项组合为渲染缓存的键"""
+    return hashlib.sha256(f"{RENDERER_VERSION}:{fmt}:{width}x{height}:{digest}".encode('utf-8')).hexdigest()
+
+
+def _axis_values(values: Sequence[Any]) -> np.ndarray:
+    """横轴值转换为数值：数值原样使用，ISO 8601 时间字符串转换为秒，其他按位置排列"""
+    if not len(values):
+        return np.empty(0)
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return np.asarray(values, dtype=np.float64)
+    try:
+        parsed = np.array([v[:-1] if v.endswith('Z') else v for v in values], dtype='datetime64[ms]')
+        return parsed.astype(np.int64) / 1000.0
+    except (AttributeError, TypeError, ValueError):
+        return np.arange(len(values), dtype=np.float64)
+
+
+def _scale(values: np.ndarray, low: float, high: float, start: float, end: float) -> np.ndarray:
+    """把 [low, high] 线性映射到像素区间 [start, end]"""
+    span = high - low
+    if not np.isfinite(span) or span == 0:
+        return np.full(len(values), (start + end) / 2.0)
+    return start + (values - low) / span * (end - start)
+
+
+def _finite_range(*arrays: np.ndarray) -> Tuple[float, float]:
+    finite = [a[np.isfinite(a)] for a in arrays if len(a)]
+    finite = [a for a in finite if len(a)]
+    if not finite:
+        return 0.0, 1.0
+    return float(min(a.min() for a in finite)), float(max(a.max() for a in finite))
+
+
+def _as_float(values: Sequence[Any]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _layout_lines(chart: Dict[str, Any], width: int, height: int) -> List[Primitive]:
+    """折线图：每个序列一个面板（各自的纵轴范围），有包络时在折线下方绘制最小/最大值带"""
+    primitives: List[Primitive] = []
+    series = chart.get('y_axis', {})
+    x = _axis_values(chart.get('x_axis', []))
+    envelopes = chart.get('envelopes', {})
+    x_low, x_high = _finite_range(x, *(_axis_values(env['x']) for env in envelopes.values()))
+    left, right = MARGIN_LEFT, width - MARGIN_RIGHT
+    panel_height = (height - MARGIN_TOP - MARGIN_BOTTOM) / max(len(series), 1)
+    for i, (name, values) in enumerate(series.items()):
+        top = MARGIN_TOP + i * panel_height
+        bottom = top + panel_height - 12
+        y = _as_float(values)
+        envelope = envelopes.get(name)
+        low, high = _finite_range(y, *((_as_float(envelope['min']), _as_float(envelope['max'])) if envelope else ()))
+        if envelope:
+            band_x = _scale(_axis_values(envelope['x']), x_low, x_high, left, right)
+            primitives.append(('band', band_x, _scale(_as_float(envelope['max']), low, high, bottom, top),
+                               _scale(_as_float(envelope['min']), low, high, bottom, top), BAND_COLOR))
+        primitives.append(('polyline', _scale(x, x_low, x_high, left, right), _scale(y, low, high, bottom, top),
+                           PALETTE[i % len(PALETTE)]))
+        primitives.append(('axes', left, top, right, bottom, AXIS_COLOR))
+        primitives.append(('text', left + 4, top + 12, name, 'start', 11, PALETTE[i % len(PALETTE)]))
+        primitives.append(('text', left - 4, top + 10, f"{high:.4g}", 'end', 10, AXIS_COLOR))
+        primitives.append(('text', left - 4, bottom, f"{low:.4g}", 'end', 10, AXIS_COLOR))
+    labels = chart.get('x_axis', [])
+    if labels:
+        primitives.append(('text', left, height - 10, str(labels[0]), 'start', 10, AXIS_COLOR))
+        primitives.append(('text', right, height - 10, str(labels[-1]), 'end', 10, AXIS_COLOR))
+    return primitives
+
+
+def _layout_bars(chart: Dict[str, Any], width: int, height: int) -> List[Primitive]:
+    """柱状图：每个类别一组柱，组内每个序列一根"""
+    primitives: List[Primitive] = []
+    labels = chart.get('x_axis', [])
+    series = list(chart.get('y_axis', {}).items())
+    left, right, top, bottom = MARGIN_LEFT, width - MARGIN_RIGHT, MARGIN_TOP, height - MARGIN_BOTTOM
+    values = [_as_float(v) for _, v in series]
+    low, high = _finite_range(np.zeros(1), *values)
+    group = (right - left) / max(len(labels), 1)
+    bar = group * 0.8 / max(len(series), 1)
+    zero = float(_scale(np.zeros(1), low, high, bottom, top)[0])
+    for s, (name, _) in enumerate(series):
+        ys = _scale(values[s], low, high, bottom, top)
+        for i, y in enumerate(ys):
+            if np.isfinite(values[s][i]):
+                x0 = left + i * group + group * 0.1 + s * bar
+                primitives.append(('rect', x0, min(y, zero), x0 + bar, max(y, zero), PALETTE[s % len(PALETTE)]))
+    for i, label in enumerate(labels):
+        primitives.append(('text', left + (i + 0.5) * group, height - 10, str(label), 'middle', 10, AXIS_COLOR))
+    primitives.append(('axes', left, top, right, bottom, AXIS_COLOR))
+    primitives.append(('text', left - 4, top + 10, f"{high:.4g}", 'end', 10, AXIS_COLOR))
+    return primitives
+
+
+def _layout_anomalies(chart: Dict[str, Any], width: int, height: int) -> List[Primitive]:
+    """异常检测报告：异常分数折线，检测为异常的点用红色标记"""
+    rows = chart.get('data', [])
+    x = _axis_values([row.get('timestamp') for row in rows])
+    y = _as_float([row.get('anomaly_score') for row in rows])
+    detected = np.array([bool(row.get('anomaly_detected')) for row in rows], dtype=bool)
+    left, right, top, bottom = MARGIN_LEFT, width - MARGIN_RIGHT, MARGIN_TOP, height - MARGIN_BOTTOM
+    low, high = _finite_range(y)
+    px, py = _scale(x, *_finite_range(x), left, right), _scale(y, low, high, bottom, top)
+    primitives: List[Primitive] = [('polyline', px, py, PALETTE[0]),
+                                   ('markers', px[~detected], py[~detected], PALETTE[0]),
+                                   ('markers', px[detected], py[detected], ANOMALY_COLOR),
+                                   ('axes', left, top, right, bottom, AXIS_COLOR),
+                                   ('text', left - 4, top + 10, f"{high:.4g}", 'end', 10, AXIS_COLOR),
+                                   ('text', left - 4, bottom, f"{low:.4g}", 'end', 10, AXIS_COLOR)]
+    if rows:
+        primitives.append(('text', left, height - 10, str(rows[0].get('timestamp')), 'start', 10, AXIS_COLOR))
+        primitives.append(('text', right, height - 10, str(rows[-1].get('timestamp')), 'end', 10, AXIS_COLOR))
+    return primitives
+
+
+def layout_chart(chart: Dict[str, Any], width: int, height: int) -> List[Primitive]:
+    """把图表数据布局为图元列表"""
+    if chart.get('report_type') == 'table':
+        primitives = _layout_anomalies(chart, width, height)
+    elif chart.get('chart_type') == 'bar':
+        primitives = _layout_bars(chart, width, height)
+    else:
+        primitives = _layout_lines(chart, width, height)
+    primitives.append(('text', width / 2, 22, chart.get('title', ''), 'middle', 14, '#000000'))
+    return primitives
+
+
+def _points(xs: np.ndarray, ys: np.ndarray) -> str:
+    """SVG 坐标列表，所有点用一次格式化完成"""
+    if not len(xs):
+        return ''
+    return ('%.1f,%.1f ' * len(xs) % tuple(np.column_stack([xs, ys]).ravel().tolist()))[:-1]
+
+
+def _finite_runs(xs: np.ndarray, ys: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """按缺失值把折线拆分为连续的段"""
+    valid = np.isfinite(xs) & np.isfinite(ys)
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], valid.astype(np.int8), [0]])))
+    return [(xs[a:b], ys[a:b]) for a, b in zip(edges[0::2], edges[1::2])]
+
+
+def render_svg(chart: Dict[str, Any], width: int = 800, height: int = 400) -> bytes:
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="sans-serif">',
+             f'<rect width="{width}" height="{height}" fill="#ffffff"/>']
+    for primitive in layout_chart(chart, width, height):
+        kind = primitive[0]
+        if kind == 'polyline':
+            _, xs, ys, color = primitive
+            for run_x, run_y in _finite_runs(xs, ys):
+                parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="1.2" points="{_points(run_x, run_y)}"/>')
+        elif kind == 'band':
+            _, xs, upper, lower, color = primitive
+            for (run_x, run_upper), (_, run_lower) in zip(_finite_runs(xs, upper), _finite_runs(xs, lower)):
+                outline = _points(np.concatenate([run_x, run_x[::-1]]), np.concatenate([run_upper, run_lower[::-1]]))
+                parts.append(f'<polygon fill="{color}" stroke="none" points="{outline}"/>')
+        elif kind == 'rect':
+            _, x0, y0, x1, y1, color = primitive
+            parts.append(f'<rect x="{x0:.1f}" y="{y0:.1f}" width="{x1 - x0:.1f}" height="{y1 - y0:.1f}" fill="{color}"/>')
+        elif kind == 'markers':
+            _, xs, ys, color = primitive
+            parts.extend(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3" fill="{color}"/>'
+                         for x, y in zip(xs, ys) if np.isfinite(x) and np.isfinite(y))
+        elif kind == 'axes':
+            _, left, top, right, bottom, color = primitive
+            parts.append(f'<polyline fill="none" stroke="{color}" points="{left},{top:.1f} {left},{bottom:.1f} {right},{bottom:.1f}"/>')
+        elif kind == 'text':
+            _, x, y, text, anchor, size, color = primitive
+            parts.append(f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size}" text-anchor="{anchor}" fill="{color}">'
+                         f'{escape(str(text))}</text>')
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+@lru_cache(maxsize=64)
+def _rgb(color: str) -> np.ndarray:
+    return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)], dtype=np.uint8)
+
+
+def _plot(canvas: np.ndarray, xs: np.ndarray, ys: np.ndarray, color: str) -> None:
+    height, width, _ = canvas.shape
+    xs, ys = np.rint(xs).astype(np.int64), np.rint(ys).astype(np.int64)
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    canvas[ys[inside], xs[inside]] = _rgb(color)
+
+
+def _draw_polyline(canvas: np.ndarray, xs: np.ndarray, ys: np.ndarray, color: str) -> None:
+    """所有线段一次性向量化采样：每段按其像素长度取点"""
+    for run_x, run_y in _finite_runs(xs, ys):
+        if len(run_x) == 1:
+            _plot(canvas, run_x, run_y, color)
+            continue
+        dx, dy = np.diff(run_x), np.diff(run_y)
+        steps = np.maximum(np.ceil(np.maximum(np.abs(dx), np.abs(dy))), 1).astype(np.int64)
+        segment = np.repeat(np.arange(len(steps)), steps)
+        offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = offsets / steps[segment]
+        _plot(canvas, np.append(run_x[segment] + dx[segment] * t, run_x[-1]),
+              np.append(run_y[segment] + dy[segment] * t, run_y[-1]), color)
+
+
+def _fill_rect(canvas: np.ndarray, x0: float, y0: float, x1: float, y1: float, color: str) -> None:
+    height, width, _ = canvas.shape
+    left, right = max(int(round(x0)), 0), min(int(round(x1)) + 1, width)
+    top, bottom = max(int(round(y0)), 0), min(int(round(y1)) + 1, height)
+    if left < right and top < bottom:
+        canvas[top:bottom, left:right] = _rgb(color)
+
+
+def _fill_band(canvas: np.ndarray, xs: np.ndarray, upper: np.ndarray, lower: np.ndarray, color: str) -> None:
+    """包络带：每个桶在其像素列上填充 [上沿, 下沿] 的竖线，所有列一次性用掩码填充"""
+    height, width, _ = canvas.shape
+    valid = np.isfinite(xs) & np.isfinite(upper) & np.isfinite(lower)
+    columns = np.rint(xs[valid]).astype(np.int64)
+    top = np.rint(np.minimum(upper[valid], lower[valid]))[:, None]
+    bottom = np.rint(np.maximum(upper[valid], lower[valid]))[:, None]
+    inside = (columns >= 0) & (columns < width)
+    rows = np.arange(height)[None, :]
+    band, row = np.nonzero(((rows >= top) & (rows <= bottom))[inside])
+    canvas[row, columns[inside][band]] = _rgb(color)
+
+
+def _encode_png(canvas: np.ndarray, level: int = 6) -> bytes:
+    """把 RGB 画布编码为 PNG（每行过滤类型 0）"""
+    height, width, _ = canvas.shape
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), canvas.reshape(height, width * 3)], axis=1)
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), level))
+            + chunk(b'IEND', b''))
+
+
+def render_png(chart: Dict[str, Any], width: int = 800, height: int = 400) -> bytes:
+    """光栅化为 PNG；不依赖字体，文字图元不绘制（标题和刻度见 SVG 输出）"""
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    for primitive in layout_chart(chart, width, height):
+        kind = primitive[0]
+        if kind == 'polyline':
+            _draw_polyline(canvas, *primitive[1:])
+        elif kind == 'band':
+            _fill_band(canvas, *primitive[1:])
+        elif kind == 'rect':
+            _fill_rect(canvas, *primitive[1:])
+        elif kind == 'markers':
+            _, xs, ys, color = primitive
+            for x, y in zip(xs, ys):
+                if np.isfinite(x) and np.isfinite(y):
+                    _fill_rect(canvas, x - 2, y - 2, x + 2, y + 2, color)
+        elif kind == 'axes':
+            _, left, top, right, bottom, color = primitive
+            _draw_polyline(canvas, np.array([left, left, right], dtype=np.float64),
+                           np.array([top, bottom, bottom], dtype=np.float64), color)
+    return _encode_png(canvas)
+
+
+RENDERERS = {'svg': render_svg, 'png': render_png}
+
+
+class RenderCache:
+    """渲染结果的磁盘缓存：<目录>/<键前两位>/<键>.<格式>，文件先写临时文件再原子替换，缓存中只会有完整的文件"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str) -> Optional[str]:
+        path = self.path(key, fmt)
+        return path if os.path.exists(path) else None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_to_file(chart: Dict[str, Any], fmt: str, width: int, height: int, path: str) -> int:
+    """渲染并写入文件（在工作进程中执行，结果直接落盘，不回传图像数据），返回文件大小"""
+    data = RENDERERS[fmt](chart, width, height)
+    _write_atomic(path, data)
+    return len(data)
+
+
+def render_charts(charts: Dict[str, Dict[str, Any]], cache_dir: str, formats: Sequence[str] = RENDER_FORMATS,
+                  width: int = 800, height: int = 400, workers: int = 4) -> Dict[str, Dict[str, Any]]:
+    """渲染一批图表（{名称: 图表数据}）为各格式的文件，返回 {名称: {格式: 文件路径, 'rendered': 新渲染的格式列表}}。
+    命中缓存的图表不再渲染；内容相同的图表（如多个数据库的相同报表）只渲染一次；
+    未命中的图表超过一个时交给进程池并行渲染，同时提交的任务不超过 2 * workers"""
+    for fmt in formats:
+        if fmt not in RENDER_FORMATS:
+            raise ValueError(f"不支持的渲染格式: {fmt}")
+    cache = RenderCache(cache_dir)
+    results: Dict[str, Dict[str, Any]] = {}
+    pending: Dict[str, Tuple[Dict[str, Any], str, str]] = {}  # 缓存路径 -> (图表, 格式, 首个图表名称)
+    for name, chart in charts.items():
+        result = results[name] = {'rendered': []}
+        if not chart:
+            continue
+        digest = content_digest(chart)
+        for fmt in formats:
+            key = chart_key(digest, fmt, width, height)
+            path = cache.path(key, fmt)
+            result[fmt] = path
+            if path not in pending and cache.get(key, fmt) is None:
+                pending[path] = (chart, fmt, name)
+    if not pending:
+        return results
+    jobs = [(chart, fmt, width, height, path) for path, (chart, fmt, _) in pending.items()]
+    if workers <= 1 or len(jobs) == 1:
+        for job in jobs:
+            render_to_file(*job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            window: Deque[Future] = deque()
+            for job in jobs:
+                window.append(executor.submit(render_to_file, *job))
+                if len(window) >= 2 * workers:
+                    window.popleft().result()
+            while window:
+                window.popleft().result()
+    for path, (_, fmt, name) in pending.items():
+        results[name]['rendered'].append(fmt)
+    logger.info("图表渲染完成，图表数: %d，新渲染文件数: %d", len(charts), len(pending))
+    return results
@@ -0,0 +1,183 @@
+# 刀 AI 数据库扩展技术 - 增量图表存储
+# 本脚本实现图表的增量状态和有界的版本化存储：每次刷新只处理新增的源数据，生成包含新数据点和变化汇总值的增量，
+# 增量带全局单调递增的版本号并保存在有界缓冲区中，客户端可以按版本号获取此后的变化；
+# 过旧的版本已不在缓冲区中时返回全部图表的快照，由客户端重置本地状态。
+# 每个增量最多携带最近 max_points 个数据点（更早的点只计入汇总），刷新时先在 ChartUpdate 中读取新数据，
+# 再在存储的锁内合并到图表状态，读取快照的线程不会看到修改到一半的图表。
+
+import threading
+import logging
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Deque, Optional, Sequence, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DELTA_KINDS = ('append', 'reset')
+
+
+class SeriesSummary:
+    """序列的累计汇总（数量、总和、最小值、最大值），按新增数据增量更新，忽略缺失值和非数值"""
+
+    __slots__ = ('count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, values: Sequence[Any]) -> bool:
+        """合并新增的值，返回汇总是否发生变化"""
+        numbers = [v for v in values if isinstance(v, (int, float)) and v == v]
+        if not numbers:
+            return False
+        low, high = min(numbers), max(numbers)
+        self.count += len(numbers)
+        self.total += sum(numbers)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        return True
+
+    def copy(self) -> 'SeriesSummary':
+        summary = SeriesSummary()
+        summary.count, summary.total, summary.min, summary.max = self.count, self.total, self.min, self.max
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None}
+
+
+class ChartState:
+    """单个图表的增量状态：最近 max_points 个数据点（更早的点滚出窗口，但仍计入汇总）和各序列的累计汇总"""
+
+    def __init__(self, chart_id: str, meta: Dict[str, Any], series: Sequence[str], max_points: int = 10000):
+        self.chart_id = chart_id
+        self.meta = dict(meta)
+        self.max_points = max_points
+        self.series_names = tuple(series)
+        self.cursor = 0  # 已消费的源数据条数
+        self.version = 0  # 最近一次变化的版本号
+        self.reset()
+
+    def reset(self) -> None:
+        self.cursor = 0
+        self.x: Deque[Any] = deque(maxlen=self.max_points)
+        self.y: Dict[str, Deque[Any]] = {name: deque(maxlen=self.max_points) for name in self.series_names}
+        self.summaries: Dict[str, SeriesSummary] = {name: SeriesSummary() for name in self.series_names}
+
+    def begin(self, reset: bool = False) -> 'ChartUpdate':
+        """开始一次刷新：返回基于当前汇总（reset 时为空汇总）的更新，不修改图表状态"""
+        return ChartUpdate(self, reset)
+
+    def apply(self, update: 'ChartUpdate') -> Dict[str, Any]:
+        """合并更新并返回增量：最近 max_points 个新数据点、发生变化的序列汇总和新增的源数据条数；
+        新数据点多于 max_points 时 clipped 为 True，只携带最新的点（由存储在锁内调用）"""
+        if update.reset:
+            self.reset()
+        self.x.extend(update.x)
+        for name in self.series_names:
+            self.y[name].extend(update.y[name])
+        self.cursor += update.rows
+        self.summaries = update.summaries
+        return {'x': list(update.x), 'y': {name: list(values) for name, values in update.y.items()},
+                'aggregates': {name: self.summaries[name].to_dict() for name in update.changed},
+                'source_rows': update.rows, 'clipped': update.rows > len(update.x)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        chart = dict(self.meta)
+        chart.update({
+            'chart_id': self.chart_id,
+            'version': self.version,
+            'x_axis': list(self.x),
+            'y_axis': {name: list(values) for name, values in self.y.items()},
+            'aggregates': {name: summary.to_dict() for name, summary in self.summaries.items()},
+            'source_points': self.cursor
+        })
+        return chart
+
+
+class ChartUpdate:
+    """一次刷新读取的新数据：只保留最近 max_points 个数据点，汇总在副本上更新，内存与图表大小成正比"""
+
+    def __init__(self, state: ChartState, reset: bool):
+        self.reset = reset
+        self.rows = 0
+        self.x: Deque[Any] = deque(maxlen=state.max_points)
+        self.y: Dict[str, Deque[Any]] = {name: deque(maxlen=state.max_points) for name in state.series_names}
+        self.summaries = {name: SeriesSummary() if reset else summary.copy()
+                          for name, summary in state.summaries.items()}
+        self.changed = set()
+
+    def add(self, x_values: List[Any], columns: Dict[str, List[Any]]) -> None:
+        """追加一批新数据"""
+        self.x.extend(x_values)
+        self.rows += len(x_values)
+        for name, values in self.y.items():
+            batch = columns.get(name, [])
+            values.extend(batch)
+            if self.summaries[name].update(batch):
+                self.changed.add(name)
+
+
+class VersionedChartStore:
+    """有界的版本化图表存储：图表数超过 max_charts 时淘汰最久未更新的图表，最近 history_size 个增量供按版本续取"""
+
+    def __init__(self, history_size: int = 1000, max_charts: int = 64):
+        self.history_size = history_size
+        self.max_charts = max_charts
+        self.charts: "OrderedDict[str, ChartState]" = OrderedDict()
+        self.history: Deque[Tuple[int, str, str, Dict[str, Any]]] = deque(maxlen=history_size)
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def chart(self, chart_id: str, meta: Dict[str, Any], series: Sequence[str], max_points: int = 10000) -> ChartState:
+        """返回图表状态，不存在时创建"""
+        with self._lock:
+            state = self.charts.get(chart_id)
+            if state is None:
+                state = self.charts[chart_id] = ChartState(chart_id, meta, series, max_points)
+                while len(self.charts) > self.max_charts:
+                    evicted, _ = self.charts.popitem(last=False)
+                    logger.info("图表数超过上限，已淘汰图表: %s", evicted)
+            return state
+
+    def commit(self, state: ChartState, update: ChartUpdate) -> int:
+        """在锁内把更新合并到图表状态，记录增量并返回新版本号；reset 增量携带图表在新版本号下的完整快照"""
+        kind = 'reset' if update.reset else 'append'
+        with self._lock:
+            delta = state.apply(update)
+            self.version += 1
+            state.version = self.version
+            if update.reset:
+                delta = state.snapshot()
+            self.history.append((self.version, state.chart_id, kind, delta))
+            self.charts[state.chart_id] = state
+            self.charts.move_to_end(state.chart_id)
+            return self.version
+
+    def changes_since(self, version: int) -> Dict[str, Any]:
+        """返回版本号大于 version 的增量；所需增量已滚出缓冲区或版本号无效时返回全部图表快照并标记 reset"""
+        with self._lock:
+            current = self.version
+            if version == current:
+                return {'version': current, 'reset': False, 'changes': []}
+            oldest = self.history[0][0] if self.history else current + 1
+            # 客户端版本比当前版本新（如服务重启后）同样需要重置
+            if version < oldest - 1 or version > current:
+                return {'version': current, 'reset': True,
+                        'charts': [state.snapshot() for state in self.charts.values()]}
+            # 从新到旧扫描，开销只与返回的增量数有关
+            changes = []
+            for entry_version, chart_id, kind, delta in reversed(self.history):
+                if entry_version <= version:
+                    break
+                changes.append({'version': entry_version, 'chart_id': chart_id, 'kind': kind, 'delta': delta})
+            changes.reverse()
+            return {'version': current, 'reset': False, 'changes': changes}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'version': self.version, 'charts': [state.snapshot() for state in self.charts.values()]}
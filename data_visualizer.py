@@ -7,21 +7,71 @@ import random
 import yaml
 import logging
 import json
-from typing import Dict, List, Any
+from collections import deque
+from typing import Dict, List, Any, Deque, Optional, Sequence, Tuple
 from datetime import datetime
 
+import numpy as np
+
+from chart_loaders import RecordsLoader, create_loader, to_list
+from chart_renderer import MARGIN_LEFT, MARGIN_RIGHT, render_charts
+from chart_store import VersionedChartStore
+from downsampling import StreamingDownsampler, downsample_chart
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 性能趋势图包含的指标
+TREND_METRICS = ('query_execution_time', 'cpu_usage', 'memory_usage')
+
+# 增量刷新的图表：图表 ID -> (数据集, 图表元数据, 横轴字段, {序列名: 字段})
+INCREMENTAL_CHARTS: Dict[str, Tuple[str, Dict[str, str], str, Dict[str, str]]] = {
+    'performance_trend': (
+        'performance_metrics', {'chart_type': 'line', 'title': '数据库性能趋势'}, 'timestamp',
+        {name: name for name in TREND_METRICS}
+    ),
+    'optimization_impact': (
+        'optimization_suggestions', {'chart_type': 'bar', 'title': '优化效果分析'}, 'action',
+        {'query_time_reduction': 'estimated_impact.query_time_reduction'}
+    ),
+    'anomaly_report': (
+        'prediction_results', {'chart_type': 'table', 'title': '异常检测报告'}, 'timestamp',
+        {'anomaly_detected': 'anomaly_detected', 'anomaly_score': 'anomaly_score'}
+    )
+}
+
+
+def _timestamps_to_epoch(timestamps: Sequence[Any]) -> np.ndarray:
+    """把 Unix 时间戳、datetime64 或 ISO 8601（UTC）时间字符串序列转换为秒级浮点数组"""
+    if isinstance(timestamps, np.ndarray) and timestamps.dtype.kind == 'M':
+        return timestamps.astype('datetime64[ms]').astype(np.int64) / 1000.0
+    if len(timestamps) and isinstance(timestamps[0], str):
+        parsed = np.array([t[:-1] if t.endswith('Z') else t for t in timestamps], dtype='datetime64[ms]')
+        return parsed.astype(np.int64) / 1000.0
+    return np.asarray(timestamps, dtype=np.float64)
+
+
 class DataVisualizer:
     """数据可视化类，模拟生成性能指标和优化效果的图表"""
     
     def __init__(self, config_path: str, data_path: str = "sample_data.json"):
         """初始化数据可视化模块，加载配置文件和数据"""
         self.config = self._load_config(config_path)
-        self.data = self._load_data(data_path)
-        self.visualizations: List[Dict] = []
+        visualization_config = self.config.get('visualization', {}) or {}
+        loader_config = visualization_config.get('loader', {}) or {}
+        # json 格式沿用整体加载的样本数据（self.data 可被替换）；ndjson 和 columnar 格式由加载器按需读取
+        if loader_config.get('format', 'json') == 'json':
+            self.data = self._load_data(data_path)
+            self.loader = None
+        else:
+            self.data = {}
+            self.loader = create_loader(loader_config, data_path)
+        # 只保留最近生成的完整图表，历史变化由版本化存储按增量保存
+        self.visualizations: Deque[Dict] = deque(maxlen=visualization_config.get('max_visualizations', 100))
+        self.max_points = visualization_config.get('max_points', 10000)
+        self.store = VersionedChartStore(history_size=visualization_config.get('history_size', 1000),
+                                         max_charts=visualization_config.get('max_charts', 64))
         logger.info("数据可视化模块已初始化，配置文件: %s，数据文件: %s", config_path, data_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -46,13 +96,41 @@ class DataVisualizer:
             logger.error("加载样本数据失败: %s", str(e))
             return {}
     
-    def generate_performance_trend(self) -> Dict:
-        """模拟生成性能指标趋势图表"""
+    def generate_performance_trend(self, width: Optional[int] = None, envelope: Optional[bool] = None) -> Dict:
+        """生成性能指标趋势图表；数据点多于图表宽度（像素）时按序列做 LTTB 降采样，
+        并附带每个像素列的最小/最大值包络，图表数据量只取决于宽度"""
         logger.info("模拟生成性能指标趋势图表...")
         
-        # 模拟从样本数据中提取性能指标
-        metrics = self.data.get('performance_metrics', [])
-        if not metrics:
+        visualization_config = self.config.get('visualization', {}) or {}
+        width = width or visualization_config.get('chart_width', 1000)
+        envelope = visualization_config.get('envelope', True) if envelope is None else envelope
+        loader = self._data_loader()
+        fields = ('timestamp',) + TREND_METRICS
+        if loader.random_access:
+            # 可随机访问的列（内存中或内存映射）直接做精确的 LTTB
+            columns = loader.columns('performance_metrics', fields)
+            timestamps = columns['timestamp']
+            source_points = len(timestamps)
+            series = {name: np.asarray(columns[name], dtype=np.float64) for name in TREND_METRICS}
+            sampled = downsample_chart(_timestamps_to_epoch(timestamps), series, width, envelope)
+            indices = sampled['indices']
+            x_axis = to_list(timestamps[indices])
+            y_axis = {name: to_list(values[indices]) for name, values in series.items()}
+            envelopes = {name: {'x': to_list(timestamps[env['indices']]), 'min': to_list(env['min']),
+                                'max': to_list(env['max'])}
+                         for name, env in sampled['envelopes'].items()}
+        else:
+            # 流式数据单遍降采样，内存只取决于图表宽度
+            sampler = StreamingDownsampler(TREND_METRICS, width)
+            for batch in loader.iter_batches('performance_metrics', fields):
+                sampler.update(_timestamps_to_epoch(batch['timestamp']), batch, labels=batch['timestamp'])
+            sampled = sampler.result(envelope)
+            source_points = sampled['source_points']
+            x_axis = sampled['x']
+            y_axis = {name: to_list(values) for name, values in sampled['y'].items()}
+            envelopes = {name: {'x': env['x'], 'min': to_list(env['min']), 'max': to_list(env['max'])}
+                         for name, env in sampled['envelopes'].items()}
+        if not source_points:
             logger.warning("无性能指标数据可用于可视化")
             return {}
         
@@ -60,14 +138,15 @@ class DataVisualizer:
         chart_data = {
             'chart_type': 'line',
             'title': '数据库性能趋势',
-            'x_axis': [m['timestamp'] for m in metrics],
-            'y_axis': {
-                'query_execution_time': [m['query_execution_time'] for m in metrics],
-                'cpu_usage': [m['cpu_usage'] for m in metrics],
-                'memory_usage': [m['memory_usage'] for m in metrics]
-            },
+            'x_axis': x_axis,
+            'y_axis': y_axis,
             'generated_at': datetime.now().isoformat()
         }
+        if len(x_axis) < source_points:
+            chart_data['downsampling'] = {'method': 'lttb', 'width': width, 'source_points': source_points,
+                                          'points': len(x_axis)}
+            if envelopes:
+                chart_data['envelopes'] = envelopes
         
         self.visualizations.append(chart_data)
         logger.info("性能趋势图表生成完成: %s", chart_data['title'])
@@ -78,8 +157,9 @@ class DataVisualizer:
         logger.info("模拟生成优化效果柱状图...")
         
         # 模拟从样本数据中提取优化建议
-        suggestions = self.data.get('optimization_suggestions', [])
-        if not suggestions:
+        columns = self._data_loader().columns('optimization_suggestions',
+                                              ('action', 'estimated_impact.query_time_reduction'))
+        if not len(columns['action']):
             logger.warning("无优化建议数据可用于可视化")
             return {}
         
@@ -87,11 +167,9 @@ class DataVisualizer:
         chart_data = {
             'chart_type': 'bar',
             'title': '优化效果分析',
-            'x_axis': [s['action'] for s in suggestions],
+            'x_axis': to_list(columns['action']),
             'y_axis': {
-                'query_time_reduction': [
-                    s['estimated_impact']['query_time_reduction'] for s in suggestions
-                ]
+                'query_time_reduction': to_list(columns['estimated_impact.query_time_reduction'])
             },
             'generated_at': datetime.now().isoformat()
         }
@@ -105,8 +183,9 @@ class DataVisualizer:
         logger.info("模拟生成异常检测报告...")
         
         # 模拟从样本数据中提取预测结果
-        predictions = self.data.get('prediction_results', [])
-        if not predictions:
+        fields = ('timestamp', 'anomaly_detected', 'anomaly_score')
+        columns = self._data_loader().columns('prediction_results', fields)
+        if not len(columns['timestamp']):
             logger.warning("无预测结果数据可用于可视化")
             return {}
         
@@ -114,13 +193,7 @@ class DataVisualizer:
         report_data = {
             'report_type': 'table',
             'title': '异常检测报告',
-            'data': [
-                {
-                    'timestamp': p['timestamp'],
-                    'anomaly_detected': p['anomaly_detected'],
-                    'anomaly_score': p['anomaly_score']
-                } for p in predictions
-            ],
+            'data': [dict(zip(fields, row)) for row in zip(*(to_list(columns[field]) for field in fields))],
             'generated_at': datetime.now().isoformat()
         }
         
@@ -128,18 +201,61 @@ class DataVisualizer:
         logger.info("异常检测报告生成完成: %s", report_data['title'])
         return report_data
     
+    def report_charts(self, width: Optional[int] = None) -> Dict[str, Dict]:
+        """生成报表用的全部图表；width 为图像宽度（像素），趋势图按绘图区宽度降采样"""
+        plot_width = width - MARGIN_LEFT - MARGIN_RIGHT if width else None
+        return {
+            'performance_trend': self.generate_performance_trend(width=plot_width),
+            'optimization_impact': self.generate_optimization_impact(),
+            'anomaly_report': self.generate_anomaly_report()
+        }
+    
+    def render_report(self, formats: Optional[Sequence[str]] = None, prefix: str = '') -> Dict[str, Dict[str, Any]]:
+        """把报表图表渲染为静态 SVG/PNG 文件，返回 {图表名: {格式: 文件路径}}；内容未变的图表直接使用缓存文件。
+        多个数据库的报表可以先用 report_charts 收集后一次调用 chart_renderer.render_charts，共用一个进程池"""
+        render_config = (self.config.get('visualization', {}) or {}).get('render', {}) or {}
+        width = render_config.get('width', 800)
+        charts = {prefix + name: chart for name, chart in self.report_charts(width).items()}
+        return render_charts(charts, render_config.get('cache_dir', 'rendered_charts'),
+                             formats=formats or render_config.get('formats', ['svg', 'png']),
+                             width=width, height=render_config.get('height', 400),
+                             workers=render_config.get('workers', 4))
+    
+    def refresh(self) -> int:
+        """增量刷新各图表：只处理上次刷新之后新增的源数据，为每个有变化的图表提交一个增量，返回当前版本号。
+        源数据按批读取，每个增量最多保留最近 max_points 个数据点（更早的点只计入汇总）；
+        源数据变少（如重新加载）时重建该图表并提交带完整快照的 reset 增量"""
+        loader = self._data_loader()
+        for chart_id, (dataset, meta, x_field, fields) in INCREMENTAL_CHARTS.items():
+            state = self.store.chart(chart_id, meta, tuple(fields), self.max_points)
+            count = loader.count(dataset)
+            if count == state.cursor:
+                continue
+            reset = count < state.cursor
+            update = state.begin(reset)
+            for batch in loader.iter_batches(dataset, (x_field,) + tuple(fields.values()),
+                                             start=0 if reset else state.cursor):
+                update.add(to_list(batch[x_field]),
+                           {name: to_list(batch[field]) for name, field in fields.items()})
+            self.store.commit(state, update)
+        return self.store.version
+    
+    def _data_loader(self):
+        """返回当前的数据加载器；json 格式时包装 self.data"""
+        return self.loader if self.loader is not None else RecordsLoader(self.data)
+    
+    def changes_since(self, version: int) -> Dict[str, Any]:
+        """返回版本 version 之后的图表增量；版本过旧时返回全部图表快照（reset 为 True）"""
+        return self.store.changes_since(version)
+    
     def run(self) -> None:
-        """运行数据可视化模块，周期性生成图表"""
+        """运行数据可视化模块，周期性增量刷新图表"""
         refresh_interval = 300  # 每5分钟刷新一次
         while True:
-            # 模拟生成各种图表
-            performance_chart = self.generate_performance_trend()
-            optimization_chart = self.generate_optimization_impact()
-            anomaly_report = self.generate_anomaly_report()
+            version = self.refresh()
             
             # 模拟输出图表信息
-            logger.info("可视化更新完成，生成图表数: %d", len(self.visualizations))
-            logger.info("示例图表数据: %s", performance_chart.get('title', '无数据'))
+            logger.info("可视化更新完成，当前版本: %d，图表数: %d", version, len(self.store.charts))
             
             # 模拟休眠
             time.sleep(refresh_interval)
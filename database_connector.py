@@ -2,17 +2,291 @@
 # 本脚本模拟数据库连接器的功能，负责与数据库交互以支持监控和优化操作。
 # 注意：此代码仅用于演示目的，不执行实际的数据库连接或操作。
 
+import re
+import sys
 import time
 import random
 import yaml
 import logging
-from typing import Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple, List
 from datetime import datetime
 
+from latency_histogram import LatencyHistogram
+from shard_router import ShardRouter
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 写操作语句的首关键字，命中时按表失效查询缓存
+_WRITE_KEYWORDS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'MERGE', 'UPSERT',
+                   'CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'RENAME'}
+# 表名前可带库名（如 main.metrics），只捕获表名本身
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE|TABLE)\s+(?:[`"\[]?\w+[`"\]]?\.)?[`"\[]?(\w+)', re.IGNORECASE)
+# WITH 语句中的数据修改关键字（WITH ... INSERT/UPDATE/DELETE 是写语句）
+_DML_PATTERN = re.compile(r'\b(?:INSERT|UPDATE|DELETE|REPLACE|MERGE)\b', re.IGNORECASE)
+# 引号内的文本（字符串字面量和带引号的标识符），规范化时保持原样
+_QUOTED_TEXT = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+
+# 查询指纹化：字面量替换为占位符，使仅参数不同的查询归为同一指纹
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def _normalize_sql(query: str) -> str:
+    """规范化 SQL 文本：合并引号外的空白并去掉末尾分号，使仅格式不同的查询共享缓存键；
+    引号内的空白是数据的一部分，保持原样"""
+    parts = _QUOTED_TEXT.split(query)
+    # split 的结果中奇数位置是引号内的文本
+    normalized = ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+    return normalized.strip().rstrip(';').rstrip()
+
+
+def _extract_tables(query: str) -> Set[str]:
+    """从 SQL 中粗略提取涉及的表名（小写，不含库名）"""
+    return {name.lower() for name in _TABLE_PATTERN.findall(query)}
+
+
+def _is_write_statement(statement: str, query: str) -> bool:
+    """判断是否为写语句：首关键字为写关键字，或 WITH 子句后跟数据修改语句"""
+    if statement in _WRITE_KEYWORDS:
+        return True
+    return statement == 'WITH' and bool(_DML_PATTERN.search(_STRING_LITERAL.sub("''", query)))
+
+
+def _copy_result(result: Dict) -> Dict:
+    """复制查询结果及其中的结果行，缓存与调用方互不共享可变对象"""
+    copied = dict(result)
+    if isinstance(copied.get('data'), list):
+        copied['data'] = [dict(row) if isinstance(row, dict) else row for row in copied['data']]
+    return copied
+
+
+def _freeze_params(params: Any) -> Any:
+    """将查询参数转换为可哈希的形式，用作缓存键的一部分"""
+    if isinstance(params, dict):
+        return tuple(sorted((str(k), _freeze_params(v)) for k, v in params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(_freeze_params(v) for v in params)
+    try:
+        hash(params)
+        return params
+    except TypeError:
+        return repr(params)
+
+
+def _estimate_size(obj: Any) -> int:
+    """估算查询结果占用的内存字节数（仅在写入缓存时计算一次）"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_estimate_size(k) + _estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_estimate_size(v) for v in obj)
+    return size
+
+
+class QueryResultCache:
+    """读查询结果缓存：按规范化 SQL 与参数建键，受内存预算约束并按 LRU 淘汰，
+    写操作或 DDL 触及某表时失效该表相关的全部条目；每次失效递增该表的代数，
+    查询开始前取得的代数已变化时丢弃其结果，避免失效前开始的查询在失效后写回旧结果"""
+    
+    def __init__(self, max_bytes: int, ttl_seconds: float = 0.0):
+        """初始化缓存，ttl_seconds 为 0 时条目仅因淘汰或写失效而移除"""
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self._entries: "OrderedDict[Tuple, Tuple[Dict, int, float, Set[str]]]" = OrderedDict()
+        self._table_index: Dict[str, Set[Tuple]] = {}
+        self._generations: Dict[str, int] = {}  # 表名 -> 失效代数
+        self._epoch = 0  # clear() 的次数
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'stale_puts': 0}
+    
+    @staticmethod
+    def make_key(query: str, params: Optional[Dict] = None) -> Tuple:
+        """生成缓存键"""
+        return (_normalize_sql(query), _freeze_params(params))
+    
+    def _generation_of(self, tables: Set[str]) -> Tuple:
+        """返回各表当前的失效代数（调用方需持有锁）"""
+        return self._epoch, tuple(self._generations.get(table, 0) for table in sorted(tables))
+    
+    def generation(self, query: str) -> Tuple:
+        """返回查询涉及各表的失效代数，在查询开始前取得并传给 put"""
+        tables = _extract_tables(query)
+        with self._lock:
+            return self._generation_of(tables)
+    
+    def get(self, query: str, params: Optional[Dict] = None) -> Optional[Dict]:
+        """查找缓存结果，命中时返回结果副本（包括结果行），调用方修改副本不影响缓存"""
+        key = self.make_key(query, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            result, _, stored_at, _ = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        cached = _copy_result(result)
+        cached['cached'] = True
+        return cached
+    
+    def put(self, query: str, params: Optional[Dict], result: Dict, generation: Optional[Tuple] = None) -> bool:
+        """写入查询结果；无法识别表名或超出整体预算的结果不缓存，
+        generation 为查询开始前取得的代数，期间相关表已失效时丢弃结果"""
+        tables = _extract_tables(query)
+        if not tables:
+            return False
+        size = _estimate_size(result)
+        if size > self.max_bytes:
+            return False
+        key = self.make_key(query, params)
+        with self._lock:
+            if generation is not None and generation != self._generation_of(tables):
+                self.stats['stale_puts'] += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (_copy_result(result), size, time.time(), tables)
+            self.current_bytes += size
+            for table in tables:
+                self._table_index.setdefault(table, set()).add(key)
+            while self.current_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+        return True
+    
+    def invalidate_tables(self, tables: Set[str]) -> int:
+        """失效涉及指定表的全部缓存条目，返回失效条目数"""
+        removed = 0
+        with self._lock:
+            for table in tables:
+                self._generations[table.lower()] = self._generations.get(table.lower(), 0) + 1
+                for key in self._table_index.pop(table.lower(), set()):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            self.stats['invalidations'] += removed
+        return removed
+    
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._table_index.clear()
+            self.current_bytes = 0
+            self._epoch += 1
+    
+    def _remove(self, key: Tuple) -> None:
+        """移除单个条目并维护表索引（调用方需持有锁）"""
+        _, size, _, tables = self._entries.pop(key)
+        self.current_bytes -= size
+        for table in tables:
+            keys = self._table_index.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._table_index[table]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def fingerprint_query(query: str) -> str:
+    """计算查询指纹：规范化空白并把字符串、数字字面量和 IN 列表替换为占位符"""
+    normalized = _STRING_LITERAL.sub('?', _normalize_sql(query))
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    return _IN_LIST.sub('(?+)', normalized).upper()
+
+
+class QueryStats(LatencyHistogram):
+    """单个查询指纹的聚合统计：延迟直方图、调用次数、返回行数和慢查询计数"""
+    
+    __slots__ = ('rows_returned', 'slow_count', 'errors')
+    
+    def __init__(self):
+        super().__init__()
+        self.rows_returned = 0
+        self.slow_count = 0
+        self.errors = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        summary = super().to_dict()
+        summary.update({'rows_returned': self.rows_returned, 'slow_count': self.slow_count, 'errors': self.errors})
+        return summary
+
+
+class QueryInstrumentation:
+    """按查询指纹聚合延迟直方图与返回行数，并为慢查询缓存一次 EXPLAIN 执行计划"""
+    
+    def __init__(self, slow_query_threshold: float = 1.0, max_fingerprints: int = 10000):
+        """初始化统计，max_fingerprints 同时限制指纹数量和原始 SQL 到指纹的缓存大小"""
+        self.slow_query_threshold = slow_query_threshold
+        self.max_fingerprints = max_fingerprints
+        self.stats: Dict[str, QueryStats] = {}
+        self.plans: Dict[str, Any] = {}
+        self._fingerprint_cache: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    def fingerprint(self, query: str) -> str:
+        """返回查询指纹，同一原始 SQL 只做一次正则处理"""
+        fp = self._fingerprint_cache.get(query)
+        if fp is None:
+            fp = fingerprint_query(query)
+            if len(self._fingerprint_cache) >= self.max_fingerprints:
+                self._fingerprint_cache.clear()
+            self._fingerprint_cache[query] = fp
+        return fp
+    
+    def record(self, query: str, elapsed: float, rows: int, success: bool = True) -> Tuple[str, bool]:
+        """记录一次查询执行，返回 (指纹, 是否需要抓取执行计划)"""
+        fp = self.fingerprint(query)
+        slow = elapsed >= self.slow_query_threshold
+        with self._lock:
+            stats = self.stats.get(fp)
+            if stats is None:
+                if len(self.stats) >= self.max_fingerprints:
+                    return fp, False
+                stats = self.stats[fp] = QueryStats()
+            stats.add(elapsed)
+            stats.rows_returned += rows
+            if not success:
+                stats.errors += 1
+            if slow:
+                stats.slow_count += 1
+        return fp, slow and fp not in self.plans
+    
+    def store_plan(self, fp: str, plan: Any) -> None:
+        """缓存指纹对应的执行计划"""
+        with self._lock:
+            self.plans.setdefault(fp, {'plan': plan, 'captured_at': time.time()})
+    
+    def get_plan(self, fp: str) -> Optional[Dict]:
+        """返回已缓存的执行计划"""
+        return self.plans.get(fp)
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有指纹的统计快照"""
+        with self._lock:
+            return {fp: stats.to_dict() for fp, stats in self.stats.items()}
+    
+    def slow_queries(self) -> List[Dict[str, Any]]:
+        """返回出现过慢查询的指纹，按最大延迟降序排列，并附带执行计划"""
+        with self._lock:
+            items = [(fp, stats.to_dict()) for fp, stats in self.stats.items() if stats.slow_count]
+        items.sort(key=lambda item: item[1]['max_time'], reverse=True)
+        return [dict(stats, fingerprint=fp, plan=self.plans.get(fp)) for fp, stats in items]
+
+
 class DatabaseConnector:
     """数据库连接器类，模拟与数据库的连接和操作"""
     
@@ -21,6 +295,9 @@ class DatabaseConnector:
         self.config = self._load_config(config_path)
         self.connection_status: bool = False
         self.connection_params: Dict = {}
+        self.query_cache: Optional[QueryResultCache] = self._init_query_cache()
+        self.shard_router: Optional[ShardRouter] = None
+        self.instrumentation: Optional[QueryInstrumentation] = self._init_instrumentation()
         logger.info("数据库连接器已初始化，配置文件: %s", config_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -34,6 +311,34 @@ class DatabaseConnector:
             logger.error("加载配置文件失败: %s", str(e))
             return {}
     
+    def _init_query_cache(self) -> Optional[QueryResultCache]:
+        """根据配置创建查询结果缓存（默认关闭）"""
+        cache_config = self.config.get('database', {}).get('query_cache', {}) or {}
+        if not cache_config.get('enabled', False):
+            return None
+        max_bytes = int(cache_config.get('max_memory_mb', 64) * 1024 * 1024)
+        ttl_seconds = float(cache_config.get('ttl_seconds', 0))
+        logger.info("已启用查询结果缓存，内存预算: %d 字节，TTL: %.1f 秒", max_bytes, ttl_seconds)
+        return QueryResultCache(max_bytes, ttl_seconds)
+    
+    def _init_instrumentation(self) -> Optional[QueryInstrumentation]:
+        """根据配置创建查询统计（默认关闭）"""
+        instr_config = self.config.get('database', {}).get('instrumentation', {}) or {}
+        if not instr_config.get('enabled', False):
+            return None
+        threshold = float(instr_config.get('slow_query_threshold', 1.0))
+        logger.info("已启用查询统计，慢查询阈值: %.3f 秒", threshold)
+        return QueryInstrumentation(threshold, int(instr_config.get('max_fingerprints', 10000)))
+    
+    def _capture_plan(self, query: str, params: Optional[Dict], shard_key: Any) -> Any:
+        """获取查询执行计划：分片模式下执行 EXPLAIN QUERY PLAN，否则返回模拟计划"""
+        if self.shard_router is not None:
+            shard_names = self.shard_router.route(query, params, shard_key)
+            plan = self.shard_router.execute(f"EXPLAIN QUERY PLAN {query}", params, shard_key)
+            return {'shards': shard_names, 'steps': plan['data']} if plan['success'] else None
+        # 模拟执行计划
+        return {'steps': [{'detail': f"SCAN {table}"} for table in sorted(_extract_tables(query))]}
+    
     def connect(self) -> bool:
         """模拟建立数据库连接"""
         db_config = self.config.get('database', {})
@@ -51,9 +356,19 @@ class DatabaseConnector:
                     self.connection_params['port'],
                     self.connection_params['database_name'])
         
-        # 模拟连接过程
-        time.sleep(random.uniform(0.1, 0.5))  # 模拟连接延迟
-        self.connection_status = random.choice([True, False])  # 随机模拟连接成功或失败
+        sharding_config = db_config.get('sharding', {}) or {}
+        if sharding_config.get('enabled', False):
+            # 分片模式下连接本地分片，由路由器负责分发查询
+            try:
+                self.shard_router = ShardRouter.from_config(sharding_config)
+                self.connection_status = True
+            except (ValueError, KeyError) as e:
+                logger.error("分片配置无效: %s", str(e))
+                self.connection_status = False
+        else:
+            # 模拟连接过程
+            time.sleep(random.uniform(0.1, 0.5))  # 模拟连接延迟
+            self.connection_status = random.choice([True, False])  # 随机模拟连接成功或失败
         
         if self.connection_status:
             logger.info("数据库连接成功")
@@ -62,27 +377,55 @@ class DatabaseConnector:
         
         return self.connection_status
     
-    def execute_query(self, query: str, params: Optional[Dict] = None) -> Dict:
-        """模拟执行数据库查询"""
+    def execute_query(self, query: str, params: Optional[Dict] = None, shard_key: Any = None) -> Dict:
+        """模拟执行数据库查询；启用分片时由路由器按 shard_key 或参数中的分片键路由"""
         if not self.connection_status:
             logger.error("无法执行查询：数据库未连接")
             return {'success': False, 'error': 'No connection'}
         
-        logger.info("模拟执行查询: %s", query)
+        statement = query.lstrip().split(None, 1)[0].upper() if query.strip() else ''
+        is_write = _is_write_statement(statement, query)
+        cacheable = (self.query_cache is not None and statement in ('SELECT', 'WITH') and not is_write
+                     and 'FOR UPDATE' not in query.upper())
+        cache_params = params if shard_key is None else (params, shard_key)
+        if cacheable:
+            generation = self.query_cache.generation(query)
+            cached = self.query_cache.get(query, cache_params)
+            if cached is not None:
+                logger.debug("查询缓存命中: %s", query)
+                return cached
         
-        # 模拟查询执行
-        execution_time = random.uniform(0.01, 2.0)
-        time.sleep(execution_time)  # 模拟查询延迟
+        if self.shard_router is not None:
+            logger.info("路由分片查询: %s", query)
+            try:
+                result = self.shard_router.execute(query, params, shard_key)
+            except ValueError as e:
+                logger.error("分片查询路由失败: %s", str(e))
+                return {'success': False, 'error': str(e)}
+            execution_time = result['execution_time']
+        else:
+            logger.info("模拟执行查询: %s", query)
+            
+            # 模拟查询执行
+            execution_time = random.uniform(0.01, 2.0)
+            time.sleep(execution_time)  # 模拟查询延迟
+            
+            # 模拟查询结果
+            result = {
+                'success': random.choice([True, False]),
+                'execution_time': execution_time,
+                'rows_affected': random.randint(0, 100),
+                'data': [] if 'SELECT' not in query.upper() else [
+                    {'id': i, 'value': random.randint(1, 1000)} for i in range(random.randint(1, 10))
+                ]
+            }
         
-        # 模拟查询结果
-        result = {
-            'success': random.choice([True, False]),
-            'execution_time': execution_time,
-            'rows_affected': random.randint(0, 100),
-            'data': [] if 'SELECT' not in query.upper() else [
-                {'id': i, 'value': random.randint(1, 1000)} for i in range(random.randint(1, 10))
-            ]
-        }
+        if self.instrumentation is not None:
+            fp, needs_plan = self.instrumentation.record(
+                query, execution_time, len(result.get('data') or ()), result['success'])
+            if needs_plan and statement in ('SELECT', 'WITH') and not is_write:
+                logger.warning("慢查询 (%.2f秒)，抓取执行计划: %s", execution_time, fp)
+                self.instrumentation.store_plan(fp, self._capture_plan(query, params, shard_key))
         
         if result['success']:
             logger.info("查询执行成功，影响行数: %d，执行时间: %.2f秒", 
@@ -90,6 +433,17 @@ class DatabaseConnector:
         else:
             logger.warning("查询执行失败")
         
+        if self.query_cache is not None:
+            if is_write:
+                # 写操作无论成功与否都失效相关表，无法识别表名时整体清空
+                tables = _extract_tables(query)
+                if tables:
+                    self.query_cache.invalidate_tables(tables)
+                else:
+                    self.query_cache.clear()
+            elif cacheable and result['success']:
+                self.query_cache.put(query, cache_params, result, generation)
+        
         return result
     
     def apply_optimization(self, optimization: Dict) -> bool:
@@ -106,6 +460,14 @@ class DatabaseConnector:
         time.sleep(random.uniform(0.2, 1.0))  # 模拟优化执行时间
         success = random.choice([True, False])
         
+        if self.query_cache is not None:
+            # DDL 可能改变表结构或数据布局，失效该表的缓存结果
+            table = parameters.get('table')
+            if table:
+                self.query_cache.invalidate_tables({table})
+            else:
+                self.query_cache.clear()
+        
         if success:
             logger.info("优化操作成功: %s", action)
         else:
@@ -119,6 +481,12 @@ class DatabaseConnector:
             logger.info("断开数据库连接")
             self.connection_status = False
             self.connection_params = {}
+            if self.shard_router is not None:
+                self.shard_router.close()
+                self.shard_router = None
+            if self.query_cache is not None:
+                # 断开期间无法感知外部写入，丢弃已缓存结果
+                self.query_cache.clear()
         else:
             logger.info("数据库已断开，无需重复操作")
 
@@ -0,0 +1,209 @@
+# 刀 AI 数据库扩展技术 - 时间序列降采样
+# 本脚本实现图表用的时间序列降采样：LTTB（Largest-Triangle-Three-Buckets）在每个桶中保留与前后点构成最大三角形的点，
+# 视觉上保留峰谷形状；最小/最大值包络保证每个像素列内的极值不丢失。桶统计用 NumPy 向量化计算，
+# 输出点数只取决于图表宽度，与历史数据长度无关。
+
+import logging
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _bucket_edges(n: int, buckets: int) -> np.ndarray:
+    """把下标 [1, n-1) 均分为 buckets 个桶（首尾两点单独保留），返回 buckets + 1 个边界"""
+    return np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """返回 LTTB 选中的点下标（升序，包含首尾两点）；点数不超过 threshold 时返回全部下标。
+    各桶的均值用 np.add.reduceat 一次算出，逐桶选点时桶内面积计算是向量化的"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = threshold - 2
+    edges = _bucket_edges(n, buckets)
+    starts, ends = edges[:-1], edges[1:]
+    counts = np.maximum(ends - starts, 1)
+    # 各桶的均值点：第 i 个桶选点时以第 i+1 个桶的均值作为第三个顶点，最后一个桶以末点作为第三个顶点
+    mean_x = np.append(np.add.reduceat(x[:n - 1], starts) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:n - 1], starts) / counts, y[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(buckets):
+        start, end = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        cx, cy = mean_x[i + 1], mean_y[i + 1]
+        # 三角形面积的两倍（省略常数因子不影响 argmax）
+        areas = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_envelope(y: np.ndarray, buckets: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """把序列均分为 buckets 个桶，返回 (各桶起始下标, 最小值, 最大值)；点数不超过桶数时每点一个桶"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n == 0:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty
+    buckets = max(1, min(buckets, n))
+    starts = np.unique(np.linspace(0, n, buckets + 1).astype(np.int64)[:-1])
+    return starts, np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+
+
+def downsample_series(x: np.ndarray, y: np.ndarray, width: int) -> np.ndarray:
+    """对单个序列做 LTTB 降采样，忽略非有限值（缺失的指标），返回选中点在原序列中的下标"""
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(y)
+    if finite.all():
+        return lttb_indices(x, y, width)
+    index = np.flatnonzero(finite)
+    return index[lttb_indices(np.asarray(x)[index], y[index], width)]
+
+
+def downsample_chart(x: np.ndarray, series: Dict[str, np.ndarray], width: int,
+                     envelope: bool = True) -> Dict[str, Any]:
+    """对多个共享横轴的序列分别做 LTTB，取各序列选中下标的并集作为公共横轴（点数不超过 序列数 × width），
+    并为每个序列计算 width 个桶的最小/最大值包络"""
+    n = len(x)
+    if n <= width:
+        return {'indices': np.arange(n), 'envelopes': {}}
+    selected = [downsample_series(x, values, width) for values in series.values()]
+    indices = np.unique(np.concatenate(selected)) if selected else np.arange(0)
+    envelopes: Dict[str, Any] = {}
+    if envelope:
+        for name, values in series.items():
+            values = np.asarray(values, dtype=np.float64)
+            finite = np.isfinite(values)
+            if finite.all():
+                # 无缺失值时直接在原数组（可能是内存映射）上计算，不复制
+                starts, lows, highs = minmax_envelope(values, width)
+                envelopes[name] = {'indices': starts, 'min': lows, 'max': highs}
+                continue
+            finite = np.flatnonzero(finite)
+            starts, lows, highs = minmax_envelope(values[finite], width)
+            envelopes[name] = {'indices': finite[starts] if len(finite) else starts, 'min': lows, 'max': highs}
+    return {'indices': indices, 'envelopes': envelopes}
+
+
+class StreamingDownsampler:
+    """单遍流式降采样，内存只取决于 width 和序列数：数据按行号均分到不超过 width 个桶，
+    每个桶为每个序列保留最小值点和最大值点（整行：横轴值及所有序列的值）；桶数超过 width 时相邻两桶合并、桶宽加倍。
+    结束时对保留的候选点再做 LTTB，并由各桶的极值得到最小/最大值包络"""
+
+    def __init__(self, series: Sequence[str], width: int):
+        self.series = tuple(series)
+        self.width = max(int(width), 3)
+        count = len(self.series)
+        self.bucket_rows = 1
+        self.rows = 0
+        self.first: Optional[Tuple[int, float, Any, np.ndarray]] = None
+        self.last: Optional[Tuple[int, float, Any, np.ndarray]] = None
+        # 各桶的状态：桶起点的横轴标签，以及每个序列的极值、所在行号、该行的横轴值/标签/各序列值
+        self.start_label = np.empty(0, dtype=object)
+        self.extremes = {kind: {'value': np.empty((0, count)), 'row': np.empty((0, count), dtype=np.int64),
+                                'point': np.empty((0, count, count + 1)),
+                                'label': np.empty((0, count), dtype=object)}
+                         for kind in ('min', 'max')}
+
+    def _combine(self, left: Dict[str, np.ndarray], right: Dict[str, np.ndarray], kind: str) -> Dict[str, np.ndarray]:
+        """逐序列合并两组桶的极值，right 更极端时取 right"""
+        take = right['value'] < left['value'] if kind == 'min' else right['value'] > left['value']
+        return {'value': np.where(take, right['value'], left['value']),
+                'row': np.where(take, right['row'], left['row']),
+                'point': np.where(take[..., None], right['point'], left['point']),
+                'label': np.where(take, right['label'], left['label'])}
+
+    def _merge_pairs(self) -> None:
+        """相邻两桶合并，桶宽加倍（桶边界按行号对齐，合并后仍然对齐）"""
+        for kind, state in self.extremes.items():
+            left = {key: values[0::2] for key, values in state.items()}
+            right = {key: values[1::2] for key, values in state.items()}
+            if len(left['value']) > len(right['value']):
+                right = {key: np.concatenate([values, left[key][-1:]]) for key, values in right.items()}
+            self.extremes[kind] = self._combine(left, right, kind)
+        self.start_label = self.start_label[0::2]
+        self.bucket_rows *= 2
+
+    def update(self, x: np.ndarray, columns: Dict[str, np.ndarray], labels: Optional[Sequence[Any]] = None) -> None:
+        """合并一批数据；x 为数值横轴，labels 为输出用的原始横轴值（默认与 x 相同）"""
+        x = np.asarray(x, dtype=np.float64)
+        size = len(x)
+        if size == 0:
+            return
+        labels = np.asarray(x if labels is None else labels, dtype=object)
+        values = np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in self.series])
+        points = np.column_stack([x, values])
+        rows = self.rows + np.arange(size)
+        if self.first is None:
+            self.first = (0, x[0], labels[0], values[0].copy())
+        self.last = (self.rows + size - 1, x[-1], labels[-1], values[-1].copy())
+        while -(-(self.rows + size) // self.bucket_rows) > self.width:
+            self._merge_pairs()
+        bucket = rows // self.bucket_rows
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+        counts = np.diff(np.append(starts, size))
+        positions = np.arange(size)[:, None]
+        batch = {}
+        for kind, fill, reduce in (('min', np.inf, np.minimum), ('max', -np.inf, np.maximum)):
+            filled = np.where(np.isnan(values), fill, values)
+            extreme = reduce.reduceat(filled, starts, axis=0)
+            # 每个桶内第一个取到极值的位置
+            at = np.minimum.reduceat(np.where(filled == np.repeat(extreme, counts, axis=0), positions, size),
+                                     starts, axis=0)
+            batch[kind] = {'value': extreme, 'row': rows[at], 'point': points[at], 'label': labels[at]}
+        batch_start_label = labels[starts]
+        if self.rows % self.bucket_rows and len(self.start_label):
+            # 批次的第一个桶延续上一批次的最后一个桶
+            for kind in batch:
+                head = self._combine({key: values[-1:] for key, values in self.extremes[kind].items()},
+                                     {key: values[:1] for key, values in batch[kind].items()}, kind)
+                self.extremes[kind] = {key: np.concatenate([values[:-1], head[key], batch[kind][key][1:]])
+                                       for key, values in self.extremes[kind].items()}
+            batch_start_label = batch_start_label[1:]
+        else:
+            for kind in batch:
+                self.extremes[kind] = {key: np.concatenate([values, batch[kind][key]])
+                                       for key, values in self.extremes[kind].items()}
+        self.start_label = np.concatenate([self.start_label, batch_start_label])
+        self.rows += size
+
+    def result(self, envelope: bool = True) -> Dict[str, Any]:
+        """返回 {'x': 横轴标签, 'y': {序列名: 值}, 'envelopes': {序列名: {'x', 'min', 'max'}}, 'source_points': 行数}"""
+        if self.first is None:
+            return {'x': [], 'y': {name: np.empty(0) for name in self.series}, 'envelopes': {}, 'source_points': 0}
+        rows, xs, labels, values = [], [], [], []
+        for row, x, label, row_values in (self.first, self.last):
+            rows.append(np.array([row]))
+            xs.append(np.array([x]))
+            labels.append(np.array([label], dtype=object))
+            values.append(row_values[None, :])
+        for state in self.extremes.values():
+            valid = np.isfinite(state['value'])
+            rows.append(state['row'][valid])
+            xs.append(state['point'][..., 0][valid])
+            labels.append(state['label'][valid])
+            values.append(state['point'][..., 1:][valid])
+        unique_rows, first_index = np.unique(np.concatenate(rows), return_index=True)
+        x = np.concatenate(xs)[first_index]
+        label = np.concatenate(labels)[first_index]
+        candidates = np.concatenate(values)[first_index]
+        series = {name: candidates[:, i] for i, name in enumerate(self.series)}
+        indices = downsample_chart(x, series, self.width, envelope=False)['indices']
+        envelopes: Dict[str, Any] = {}
+        if envelope and self.rows > self.width:
+            lows, highs = self.extremes['min']['value'], self.extremes['max']['value']
+            for i, name in enumerate(self.series):
+                envelopes[name] = {'x': self.start_label.tolist(),
+                                   'min': np.where(np.isfinite(lows[:, i]), lows[:, i], np.nan),
+                                   'max': np.where(np.isfinite(highs[:, i]), highs[:, i], np.nan)}
+        return {'x': label[indices].tolist(), 'y': {name: values[indices] for name, values in series.items()},
+                'envelopes': envelopes, 'source_points': self.rows}
@@ -0,0 +1,203 @@
+# 刀 AI 数据库扩展技术 - 时间序列压缩编码
+# 本脚本实现 Gorilla 风格的时间序列压缩：整数序列使用差值的差值（delta-of-delta）编码，浮点序列使用 XOR 编码。
+# 时间戳按 float64 的位模式视为 int64 后再做差值编码：同一指数区间内位模式与数值线性相关，因此压缩无损。
+# 编解码用 NumPy 按整块计算差值、位宽和比特拼接，只有逐条确定码字位置（XOR 的窗口复用状态）的循环在 Python 中执行。
+# 压缩收益主要来自时间戳和取值平稳的列：等间隔时间戳每个只占 1 位，而带噪声的浮点指标 XOR 后有效位很多，
+# 压缩率通常只有 1.1 倍左右，可以忽略不计。
+
+import numpy as np
+
+_ONE = np.uint64(1)
+_ZERO = np.uint64(0)
+_WORD = np.uint64(64)
+# 差值的差值分级：(前缀, 数据位数)，zigzag 值落入对应位数时使用该级
+_DOD_TIERS = (('10', 7), ('110', 9), ('1110', 12), ('11110', 20))
+_DOD_FALLBACK = '11111'
+# 按前缀中连续 1 的个数（0~5）索引的前缀位数和数据位数
+_DOD_PREFIX_BITS = np.array([1] + [len(prefix) for prefix, _ in _DOD_TIERS] + [len(_DOD_FALLBACK)], dtype=np.int64)
+_DOD_PAYLOAD_BITS = np.array([0] + [width for _, width in _DOD_TIERS] + [64], dtype=np.int64)
+_DOD_CODE_BITS = (_DOD_PREFIX_BITS + _DOD_PAYLOAD_BITS).tolist()
+# 5 位前缀窗口 -> 开头连续 1 的个数
+_LEADING_ONES = [next((j for j in range(5) if not (peek >> (4 - j)) & 1), 5) for peek in range(32)]
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """逐元素计算 uint64 的有效位数"""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= (_ONE << np.uint64(shift))
+        length[mask] += shift
+        values[mask] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+def _pack_fields(values: np.ndarray, lengths: np.ndarray) -> bytes:
+    """把若干个位宽不超过 64 的字段按顺序拼接成比特流（高位在前），末尾补零到整字节；
+    按 64 位字写入，跨字的字段拆成两部分"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    keep = lengths > 0
+    values, lengths = np.asarray(values, dtype=np.uint64)[keep], lengths[keep]
+    if not len(lengths):
+        return b''
+    ends = np.cumsum(lengths)
+    total = int(ends[-1])
+    offsets = ends - lengths
+    index = offsets >> 6
+    spill = lengths - (64 - (offsets & 63))  # 大于 0 时为写入下一个字的位数
+    words = np.zeros(total // 64 + 2, dtype=np.uint64)
+    np.bitwise_or.at(words, index, np.where(spill > 0, values >> np.maximum(spill, 0).astype(np.uint64),
+                                            values << np.maximum(-spill, 0).astype(np.uint64)))
+    crossing = spill > 0
+    np.bitwise_or.at(words, index[crossing] + 1, values[crossing] << (64 - spill[crossing]).astype(np.uint64))
+    return words.astype('>u8').tobytes()[:(total + 7) // 8]
+
+
+def _unpack_words(data: bytes) -> np.ndarray:
+    """把比特流按大端 64 位字读取，末尾补零字保证读取跨字字段时不越界"""
+    padded = data + b'\0' * (-len(data) % 8 + 16)
+    return np.frombuffer(padded, dtype='>u8').astype(np.uint64)
+
+
+def _read_fields(words: np.ndarray, positions: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """按比特位置和位宽（0~64）读取字段，返回 uint64 数组"""
+    positions = np.asarray(positions, dtype=np.int64)
+    index = positions >> 6
+    shift = (positions & 63).astype(np.uint64)
+    window = (words[index] << shift) | (words[index + 1] >> (_WORD - shift))
+    return window >> (64 - np.asarray(widths, dtype=np.int64)).astype(np.uint64)
+
+
+def encode_ints(values: np.ndarray) -> bytes:
+    """使用差值的差值编码 int64 序列（按 2^64 取模运算，任意 int64 均可无损还原）"""
+    items = np.ascontiguousarray(values, dtype=np.int64).view(np.uint64)
+    if not len(items):
+        return b''
+    if len(items) == 1:
+        return _pack_fields(items, [64])
+    deltas = np.diff(items)
+    dod = np.diff(deltas)
+    zigzag = (dod << _ONE) ^ (dod.view(np.int64) >> 63).view(np.uint64)
+    # 每个差值的差值对应两个字段：前缀（连同小数据位）和回退时的 64 位原值
+    tier = np.full(len(dod), len(_DOD_TIERS) + 1, dtype=np.int64)
+    for level in range(len(_DOD_TIERS), 0, -1):
+        tier[zigzag < (_ONE << np.uint64(_DOD_PAYLOAD_BITS[level]))] = level
+    tier[dod == 0] = 0
+    prefixes = np.array([0] + [int(prefix, 2) for prefix, _ in _DOD_TIERS] + [int(_DOD_FALLBACK, 2)], dtype=np.uint64)
+    small = tier <= len(_DOD_TIERS)
+    head = prefixes[tier] << np.where(small, _DOD_PAYLOAD_BITS[tier], 0).astype(np.uint64)
+    head |= np.where(small & (tier > 0), zigzag, _ZERO)
+    head_bits = _DOD_PREFIX_BITS[tier] + np.where(small, _DOD_PAYLOAD_BITS[tier], 0)
+    fields = np.empty((len(dod) + 1, 2), dtype=np.uint64)
+    lengths = np.empty((len(dod) + 1, 2), dtype=np.int64)
+    fields[0], lengths[0] = (items[0], deltas[0]), (64, 64)
+    fields[1:, 0], lengths[1:, 0] = head, head_bits
+    fields[1:, 1], lengths[1:, 1] = dod, np.where(small, 0, 64)
+    return _pack_fields(fields.ravel(), lengths.ravel())
+
+
+def decode_ints(data: bytes, count: int) -> np.ndarray:
+    """解码差值的差值编码的 int64 序列"""
+    out = np.empty(count, dtype=np.uint64)
+    if count == 0:
+        return out.view(np.int64)
+    words = _unpack_words(data)
+    first, delta = _read_fields(words, [0, 64], [64, 64])
+    out[0] = first
+    if count == 1:
+        return out.view(np.int64)
+    # 逐条只读取 5 位前缀确定码字长度，数据位在循环外整体读取
+    word_list = words.tolist()
+    starts, tiers = [], []
+    pos = 128
+    for _ in range(count - 2):
+        word = pos >> 6
+        tier = _LEADING_ONES[((word_list[word] << 64 | word_list[word + 1]) >> (123 - (pos & 63))) & 31]
+        starts.append(pos)
+        tiers.append(tier)
+        pos += _DOD_CODE_BITS[tier]
+    tier = np.array(tiers, dtype=np.int64)
+    payload = _read_fields(words, np.array(starts, dtype=np.int64) + _DOD_PREFIX_BITS[tier], _DOD_PAYLOAD_BITS[tier])
+    unzigzag = (payload >> _ONE) ^ (_ZERO - (payload & _ONE))
+    dod = np.where(tier == len(_DOD_TIERS) + 1, payload, unzigzag)
+    deltas = np.concatenate([[delta], dod]).cumsum(dtype=np.uint64)
+    out[1:] = first + deltas.cumsum(dtype=np.uint64)
+    return out.view(np.int64)
+
+
+def encode_floats(values: np.ndarray) -> bytes:
+    """使用 XOR 编码 float64 序列：与前值相同记 1 位，否则只记录有效位窗口"""
+    items = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    if not len(items):
+        return b''
+    xor = items[1:] ^ items[:-1]
+    leads = np.minimum(64 - _bit_length(xor), 31)
+    trails = _bit_length(xor & (_ZERO - xor)) - 1
+    # 窗口复用取决于上一个新窗口，逐条确定每个值使用的窗口
+    used_lead, used_trail = leads.copy(), trails.copy()
+    reuse = np.zeros(len(xor), dtype=bool)
+    prev_lead = prev_trail = -1
+    lead_list, trail_list = leads.tolist(), trails.tolist()
+    for i in np.flatnonzero(xor).tolist():
+        lead, trail = lead_list[i], trail_list[i]
+        if prev_lead >= 0 and lead >= prev_lead and trail >= prev_trail:
+            reuse[i] = True
+            used_lead[i], used_trail[i] = prev_lead, prev_trail
+        else:
+            prev_lead, prev_trail = lead, trail
+    width = 64 - used_lead - used_trail
+    nonzero = xor != 0
+    fields = np.empty((len(xor) + 1, 2), dtype=np.uint64)
+    lengths = np.empty((len(xor) + 1, 2), dtype=np.int64)
+    fields[0], lengths[0] = (items[0], 0), (64, 0)
+    control = (np.uint64(0b11 << 11) | (used_lead.astype(np.uint64) << np.uint64(6))
+               | (width & 63).astype(np.uint64))
+    fields[1:, 0] = np.where(reuse, np.uint64(0b10), np.where(nonzero, control, _ZERO))
+    lengths[1:, 0] = np.where(reuse, 2, np.where(nonzero, 13, 1))
+    fields[1:, 1] = np.where(nonzero, xor >> np.where(nonzero, used_trail, 0).astype(np.uint64), _ZERO)
+    lengths[1:, 1] = np.where(nonzero, width, 0)
+    return _pack_fields(fields.ravel(), lengths.ravel())
+
+
+def decode_floats(data: bytes, count: int) -> np.ndarray:
+    """解码 XOR 编码的 float64 序列"""
+    if count == 0:
+        return np.empty(0, dtype=np.float64)
+    words = _unpack_words(data)
+    # 窗口状态逐条传递：循环中只读取 13 位控制字段确定有效位的位置，有效位在循环外整体读取
+    word_list = words.tolist()
+    rows, positions, widths, shifts = [], [], [], []
+    pos = 64
+    lead = trail = 0
+    for row in range(1, count):
+        word = pos >> 6
+        control = ((word_list[word] << 64 | word_list[word + 1]) >> (115 - (pos & 63))) & 0x1FFF
+        if not control >> 12:
+            pos += 1  # 与前值相同
+            continue
+        if control >> 11 == 0b11:
+            lead = (control >> 6) & 31
+            trail = 64 - lead - ((control & 63) or 64)
+            pos += 13
+        else:
+            pos += 2
+        width = 64 - lead - trail
+        rows.append(row)
+        positions.append(pos)
+        widths.append(width)
+        shifts.append(trail)
+        pos += width
+    values = np.zeros(count, dtype=np.uint64)
+    values[0] = _read_fields(words, [0], [64])[0]
+    if rows:
+        values[rows] = _read_fields(words, positions, widths) << np.array(shifts, dtype=np.uint64)
+    return np.bitwise_xor.accumulate(values).view(np.float64)
+
+
+def encode_timestamps(values: np.ndarray) -> bytes:
+    """把 float64 时间戳按位模式解释为 int64 后做差值的差值编码（无损）"""
+    return encode_ints(np.ascontiguousarray(values, dtype=np.float64).view(np.int64))
+
+
+def decode_timestamps(data: bytes, count: int) -> np.ndarray:
+    return decode_ints(data, count).view(np.float64)
@@ -0,0 +1,312 @@
+# 刀 AI 数据库扩展技术 - 异步 HTTP 服务器
+# 本脚本基于 asyncio 实现精简的 HTTP/1.1 服务器：支持长连接（keep-alive）、有上限的请求流水线、
+# 最大连接数限制以及关闭时的优雅排空，供 API 接口对外提供服务；
+# 流式响应对 HTTP/1.1 客户端使用分块传输编码，对 HTTP/1.0 客户端直接写出数据并以关闭连接标记结束。
+
+import asyncio
+import time
+import logging
+from email.utils import formatdate
+from http import HTTPStatus
+from typing import Dict, AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_MAX_HEADER_BYTES = 16384
+
+
+class HTTPError(Exception):
+    """请求解析失败时返回给客户端的错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPRequest:
+    """解析后的 HTTP 请求"""
+
+    __slots__ = ('method', 'target', 'path', 'query', 'version', 'headers', 'body')
+
+    def __init__(self, method: str, target: str, version: str, headers: Dict[str, str], body: bytes = b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        parts = urlsplit(target)
+        self.path = parts.path or '/'
+        self.query: Dict[str, str] = dict(parse_qsl(parts.query))
+
+    @property
+    def keep_alive(self) -> bool:
+        """HTTP/1.1 默认保持连接，HTTP/1.0 需显式声明"""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+class HTTPResponse:
+    """HTTP 响应；提供 stream（异步字节迭代器）时以分块传输编码流式写出"""
+
+    __slots__ = ('status', 'body', 'headers', 'stream')
+
+    def __init__(self, status: int = 200, body: bytes = b'', headers: Optional[Dict[str, str]] = None,
+                 content_type: str = 'application/json; charset=utf-8',
+                 stream: Optional[AsyncIterator[bytes]] = None):
+        self.status = status
+        self.body = body
+        self.stream = stream
+        self.headers = {'Content-Type': content_type}
+        if headers:
+            self.headers.update(headers)
+
+
+class _DateCache:
+    """Date 头按秒缓存，避免每个响应都格式化时间"""
+
+    def __init__(self):
+        self._second = 0
+        self._value = ''
+
+    def get(self) -> str:
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._value = formatdate(now, usegmt=True)
+        return self._value
+
+
+class _ConnectionState:
+    """连接状态：正在等待下一个请求且没有未写出的响应时视为空闲"""
+
+    __slots__ = ('outstanding', 'reading')
+
+    def __init__(self):
+        self.outstanding = 0  # 已读取但响应尚未写出的请求数
+        self.reading = False
+
+    @property
+    def idle(self) -> bool:
+        return self.reading and not self.outstanding
+
+
+def _reason(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return 'Unknown'
+
+
+class AsyncHTTPServer:
+    """asyncio HTTP/1.1 服务器：每个连接内的流水线请求并发处理、按序返回"""
+
+    def __init__(self, handler: Callable[[HTTPRequest], Awaitable[HTTPResponse]], host: str = '127.0.0.1',
+                 port: int = 8080, max_connections: int = 1000, keepalive_timeout: float = 15.0,
+                 max_pipelined_requests: int = 16, max_body_bytes: int = 1048576, drain_timeout: float = 10.0):
+        """max_pipelined_requests 为单个连接上已读取但尚未返回响应的请求上限，达到后暂停读取形成背压"""
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.max_pipelined_requests = max_pipelined_requests
+        self.max_body_bytes = max_body_bytes
+        self.drain_timeout = drain_timeout
+        self.requests_served = 0
+        self.rejected_connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, _ConnectionState] = {}
+        self._draining = False
+        self._dates = _DateCache()
+
+    @property
+    def active_connections(self) -> int:
+        return len(self._connections)
+
+    async def start(self) -> None:
+        """绑定端口并开始接受连接；port 为 0 时由系统分配，实际端口写回 self.port"""
+        self._server = await asyncio.start_server(self._on_connection, self.host, self.port,
+                                                  limit=_MAX_HEADER_BYTES, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP 服务已启动: %s:%d，最大连接数: %d", self.host, self.port, self.max_connections)
+
+    async def shutdown(self) -> None:
+        """优雅关闭：停止接受新连接，关闭空闲连接，等待进行中的请求在 drain_timeout 内完成"""
+        if self._server is None:
+            return
+        self._draining = True
+        self._server.close()
+        await self._server.wait_closed()
+        for task, state in list(self._connections.items()):
+            if state.idle:
+                task.cancel()
+        pending = set(self._connections)
+        if pending:
+            _, still_running = await asyncio.wait(pending, timeout=self.drain_timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.wait(still_running)
+                logger.warning("排空超时，强制关闭连接数: %d", len(still_running))
+        self._server = None
+        logger.info("HTTP 服务已关闭，累计处理请求: %d", self.requests_served)
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self._draining or len(self._connections) >= self.max_connections:
+            self.rejected_connections += 1
+            writer.write(self._serialize(HTTPResponse(503, b'{"error": "Too many connections"}'), False))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+        task = asyncio.current_task()
+        state = self._connections[task] = _ConnectionState()
+        try:
+            await self._serve_connection(reader, writer, state)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HTTPRequest]:
+        """读取并解析一个请求；连接在请求之间关闭时返回 None"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise HTTPError(400, "Incomplete request")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "Request header fields too large")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        if version not in ('HTTP/1.1', 'HTTP/1.0'):
+            raise HTTPError(505, "HTTP version not supported")
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HTTPError(400, "Malformed header")
+            headers[name.strip().lower()] = value.strip()
+        if 'transfer-encoding' in headers:
+            raise HTTPError(501, "Chunked request bodies are not supported")
+        body = b''
+        length = headers.get('content-length')
+        if length:
+            if not length.isdigit():
+                raise HTTPError(400, "Invalid Content-Length")
+            if int(length) > self.max_body_bytes:
+                raise HTTPError(413, "Request body too large")
+            body = await reader.readexactly(int(length))
+        return HTTPRequest(method.upper(), target, version, headers, body)
+
+    async def _dispatch(self, request: HTTPRequest) -> HTTPResponse:
+        try:
+            return await self.handler(request)
+        except Exception:
+            logger.exception("处理请求失败: %s %s", request.method, request.path)
+            return HTTPResponse(500, b'{"error": "Internal server error"}')
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                state: _ConnectionState) -> None:
+        """读取协程把请求交给处理协程并放入有界队列，写出循环按请求顺序写回响应"""
+        inflight: "asyncio.Queue" = asyncio.Queue(maxsize=self.max_pipelined_requests)
+
+        def completed(response: HTTPResponse) -> "asyncio.Future":
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(response)
+            return future
+
+        async def read_requests() -> None:
+            while True:
+                state.reading = True
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    request = None
+                except HTTPError as e:
+                    state.outstanding += 1
+                    error = HTTPResponse(e.status, ('{"error": "%s"}' % e).encode('utf-8'))
+                    await inflight.put((completed(error), False, True))
+                    return
+                finally:
+                    state.reading = False
+                if request is None:
+                    await inflight.put(None)
+                    return
+                keep_alive = request.keep_alive and not self._draining
+                state.outstanding += 1
+                # HTTP/1.0 客户端不支持分块传输编码
+                chunked = request.version != 'HTTP/1.0'
+                await inflight.put((asyncio.ensure_future(self._dispatch(request)), keep_alive, chunked))
+                if not keep_alive:
+                    return
+
+        reader_task = asyncio.ensure_future(read_requests())
+        try:
+            while True:
+                item = await inflight.get()
+                if item is None:
+                    break
+                handler_task, keep_alive, chunked = item
+                response = await handler_task
+                # 不分块的流式响应以关闭连接标记结束
+                keep_alive = keep_alive and not self._draining and (chunked or response.stream is None)
+                writer.write(self._serialize(response, keep_alive, chunked))
+                if response.stream is not None:
+                    await self._write_stream(writer, response.stream, chunked)
+                state.outstanding -= 1
+                self.requests_served += 1
+                if inflight.empty() or not keep_alive:
+                    await writer.drain()
+                if not keep_alive or (response.stream is not None and self._draining):
+                    break
+        finally:
+            reader_task.cancel()
+            while not inflight.empty():
+                item = inflight.get_nowait()
+                if item is not None:
+                    item[0].cancel()
+
+    @staticmethod
+    async def _write_stream(writer: asyncio.StreamWriter, stream: AsyncIterator[bytes], chunked: bool = True) -> None:
+        """逐块写出流式响应，每块写出后等待发送缓冲区排空，慢速客户端的背压传回数据源；
+        chunked 为假时（HTTP/1.0 客户端）直接写出数据，由调用方关闭连接标记响应结束"""
+        try:
+            async for chunk in stream:
+                if chunk:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    def _serialize(self, response: HTTPResponse, keep_alive: bool, chunked: bool = True) -> bytes:
+        """序列化响应头；流式响应在 chunked 为假时不带长度头，以关闭连接标记响应结束"""
+        lines = [f"HTTP/1.1 {response.status} {_reason(response.status)}",
+                 f"Date: {self._dates.get()}"]
+        if response.stream is None:
+            lines.append(f"Content-Length: {len(response.body)}")
+        elif chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        lines.extend(f"{name}: {value}" for name, value in response.headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + response.body
@@ -2,26 +2,61 @@
 # 本脚本模拟知识库的功能，存储历史数据、模型和优化结果以支持持续学习。
 # 注意：此代码仅用于演示目的，不执行实际的数据存储或检索。
 
+import os
+import json
 import time
 import random
+from collections import deque
+import threading
 import yaml
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Sequence, Union
 from datetime import datetime
 
+import numpy as np
+
+from model_registry import ModelRegistry
+from optimization_stats import OptimizationAnalytics
+from rollups import RollupStore
+from segment_store import SegmentStore
+from sqlite_backend import SQLiteBackend, SQLiteHistoryStore
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 优化结果日志中检查点记录的键：检查点保存聚合统计快照和最近的结果，重启时只需重放检查点之后追加的记录
+CHECKPOINT_KEY = '_checkpoint'
+
 class KnowledgeBase:
     """知识库类，模拟存储和检索历史数据、模型和优化结果"""
     
     def __init__(self, config_path: str):
         """初始化知识库，加载配置文件"""
         self.config = self._load_config(config_path)
-        self.historical_data: List[Dict] = []
-        self.models: Dict[str, Dict] = {}
-        self.optimization_results: List[Dict] = []
+        kb_config = self.config.get('knowledge_base', {}) or {}
+        self.storage_dir: Optional[str] = kb_config.get('storage_dir')
+        self.backend: Optional[SQLiteBackend] = self._init_backend()
+        self.history = self._init_history()
+        self.rollups = RollupStore(kb_config.get('rollups'))
+        registry_config = kb_config.get('model_registry', {}) or {}
+        self.model_registry = ModelRegistry(self.storage_dir, keep_versions=registry_config.get('keep_versions'),
+                                            blob_cache_size=registry_config.get('blob_cache_size', 8),
+                                            backend=self.backend)
+        # 只保留最近的优化结果，按操作/表/列的聚合统计在写入时增量维护
+        self.optimization_results: deque = deque(maxlen=kb_config.get('max_optimization_results', 1000))
+        self.optimization_analytics = OptimizationAnalytics(kb_config.get('optimization_half_life_seconds', 7 * 86400))
+        self._logs: Dict[str, Any] = {}
+        self._log_records = 0  # 上次检查点之后追加到优化结果日志的记录数
+        self._results_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._compaction_thread: Optional[threading.Thread] = None
+        if self.backend is not None:
+            self._restore_from_backend()
+        elif self.storage_dir:
+            self._restore_from_disk()
+            self._start_compaction(kb_config.get('compaction_interval', 3600),
+                                   kb_config.get('compaction_span_seconds', 86400))
         logger.info("知识库已初始化，配置文件: %s", config_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -35,6 +70,143 @@ class KnowledgeBase:
             logger.error("加载配置文件失败: %s", str(e))
             return {}
     
+    def _init_backend(self) -> Optional[SQLiteBackend]:
+        """knowledge_base.backend 为 sqlite 时创建 SQLite 存储引擎"""
+        kb_config = self.config.get('knowledge_base', {}) or {}
+        if kb_config.get('backend', 'segments') != 'sqlite':
+            return None
+        sqlite_config = kb_config.get('sqlite', {}) or {}
+        path = sqlite_config.get('path')
+        if not path:
+            if self.storage_dir:
+                os.makedirs(self.storage_dir, exist_ok=True)
+            path = os.path.join(self.storage_dir or '.', 'knowledge_base.db')
+        return SQLiteBackend(path, group_commit_ms=sqlite_config.get('group_commit_ms', 5),
+                             max_batch=sqlite_config.get('max_batch', 5000),
+                             queue_size=sqlite_config.get('queue_size', 100000),
+                             synchronous=sqlite_config.get('synchronous', 'NORMAL'))
+    
+    def _init_history(self) -> Union[SegmentStore, SQLiteHistoryStore]:
+        """根据配置创建历史数据存储：默认按时间分段，使用 SQLite 引擎时存入其历史数据表"""
+        retention_days = self.config.get('monitoring', {}).get('data_retention_days', 7)
+        kb_config = self.config.get('knowledge_base', {}) or {}
+        if self.backend is not None:
+            return SQLiteHistoryStore(self.backend, retention_days * 86400,
+                                      segment_seconds=kb_config.get('segment_seconds', 3600),
+                                      seal_delay_seconds=kb_config.get('seal_delay_seconds', 300))
+        data_dir = os.path.join(self.storage_dir, 'history') if self.storage_dir else None
+        return SegmentStore(kb_config.get('segment_seconds', 3600), retention_days * 86400,
+                            data_dir=data_dir, seal_delay_seconds=kb_config.get('seal_delay_seconds', 300),
+                            compression=kb_config.get('compression'),
+                            block_rows=kb_config.get('compression_block_rows', 1024),
+                            precision=kb_config.get('compression_precision'))
+    
+    def _restore_from_disk(self) -> None:
+        """从只追加日志（检查点加其后追加的记录）恢复优化结果，并打开日志以继续追加（模型由注册表自行恢复）"""
+        for name in ('optimization_results',):
+            path = os.path.join(self.storage_dir, f"{name}.jsonl")
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            break  # 崩溃时未写完的最后一行
+                        if CHECKPOINT_KEY in record:
+                            checkpoint = record[CHECKPOINT_KEY]
+                            self.optimization_analytics.load_dict(checkpoint['analytics'])
+                            self.optimization_results.extend(checkpoint['recent'])
+                            continue
+                        self.optimization_results.append(record)
+                        self.optimization_analytics.add(record)
+                        self._log_records += 1
+            self._logs[name] = open(path, 'a', encoding='utf-8')
+        self._restore_rollups()
+        logger.info("知识库已从磁盘恢复，模型: %d，优化结果: %d，历史数据: %d",
+                    len(self.model_registry), len(self.optimization_results), len(self.history))
+    
+    def _restore_from_backend(self) -> None:
+        """从 SQLite 存储引擎恢复优化结果统计和汇总"""
+        for record in self.backend.iter_optimization_results():
+            self.optimization_results.append(record)
+            self.optimization_analytics.add(record)
+        self._restore_rollups()
+        logger.info("知识库已从 SQLite 恢复，模型: %d，优化结果: %d，历史数据: %d",
+                    len(self.model_registry), len(self.optimization_results), len(self.history))
+    
+    def _restore_rollups(self) -> None:
+        """加载汇总快照，再补上快照之后写入的记录"""
+        if self.backend is not None:
+            snapshot = self.backend.get_meta('rollups')
+            if snapshot:
+                self.rollups.load_dict(json.loads(snapshot))
+        else:
+            path = os.path.join(self.storage_dir, 'rollups.json')
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.rollups.load_dict(json.load(f))
+        for record in self.history.records_after(self.rollups.watermark):
+            self.rollups.add(record['timestamp'], record.get('metrics', {}))
+    
+    def _save_rollups(self) -> None:
+        """原子写入汇总快照"""
+        if self.backend is not None:
+            self.backend.put_meta('rollups', json.dumps(self.rollups.to_dict()))
+            return
+        path = os.path.join(self.storage_dir, 'rollups.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.rollups.to_dict(), f)
+        os.replace(path + '.tmp', path)
+    
+    def _append_log(self, name: str, record: Dict) -> None:
+        """持久化模式下把记录追加到对应日志，使用 SQLite 引擎时写入对应的表"""
+        if self.backend is not None:
+            if name == 'optimization_results':
+                self.backend.insert_optimization_result(record)
+            return
+        log = self._logs.get(name)
+        if log is not None:
+            log.write(json.dumps(record, ensure_ascii=False) + '\n')
+            log.flush()
+            self._log_records += 1
+    
+    def _checkpoint_log(self) -> None:
+        """把优化结果日志原子地改写为一条检查点（聚合统计快照和最近 max_optimization_results 条结果），
+        日志大小和重启时的重放量因此不随历史总量增长"""
+        with self._results_lock:
+            log = self._logs.get('optimization_results')
+            if log is None or not self._log_records:
+                return
+            checkpoint = {CHECKPOINT_KEY: {'analytics': self.optimization_analytics.to_dict(),
+                                           'recent': list(self.optimization_results)}}
+            path = log.name
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(json.dumps(checkpoint, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            log.close()
+            os.replace(path + '.tmp', path)
+            self._logs['optimization_results'] = open(path, 'a', encoding='utf-8')
+            self._log_records = 0
+    
+    def _start_compaction(self, interval: float, span_seconds: float) -> None:
+        """启动后台线程，周期性合并已封存的历史数据段并为优化结果日志写入检查点"""
+        def compaction_loop():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.history.compact(span_seconds)
+                    self._checkpoint_log()
+                except OSError as e:
+                    logger.error("历史数据段压缩失败: %s", str(e))
+        
+        self._compaction_thread = threading.Thread(target=compaction_loop, name='kb_compaction', daemon=True)
+        self._compaction_thread.start()
+    
+    @property
+    def historical_data(self) -> List[Dict]:
+        """按时间段顺序返回全部历史数据（兼容旧接口，需要复制全部记录引用）"""
+        return [record for segment in self.history.iter_segments() for record in segment.records]
+    
     def store_historical_data(self, data: Dict) -> bool:
         """模拟存储历史数据"""
         logger.info("模拟存储历史数据: %s", data)
@@ -45,87 +217,135 @@ class KnowledgeBase:
             'metrics': data.get('metrics', {}),
             'data_id': random.randint(1000, 9999)
         }
-        self.historical_data.append(validated_data)
+        self.history.append(validated_data)
+        self.rollups.add(validated_data['timestamp'], validated_data['metrics'])
         
-        retention_days = self.config.get('monitoring', {}).get('data_retention_days', 7)
-        # 模拟数据清理
-        cutoff_time = time.time() - retention_days * 86400
-        self.historical_data = [d for d in self.historical_data if d['timestamp'] >= cutoff_time]
+        # 封存已结束的时间段，并整段删除超出保留期的时间段，无需扫描全部记录
+        now = time.time()
+        if self.history.seal(now):
+            # 封存后的记录不再留在预写日志中，同步保存汇总快照以便重启恢复
+            self._save_rollups()
+        self.history.expire(now)
+        self.rollups.expire(now)
         
         logger.info("历史数据存储成功，数据ID: %d，当前存储量: %d", 
-                    validated_data['data_id'], len(self.historical_data))
+                    validated_data['data_id'], len(self.history))
         return True
     
-    def retrieve_historical_data(self, start_time: float, end_time: float) -> List[Dict]:
-        """模拟检索历史数据"""
+    def retrieve_historical_data(self, start_time: float, end_time: float,
+                                 columnar: bool = False) -> Union[Sequence[Dict], Dict[str, np.ndarray]]:
+        """检索历史数据：返回按时间排序的只读视图，columnar=True 时返回列式 NumPy 数组"""
         logger.info("模拟检索历史数据，时间范围: %s - %s", 
                     datetime.fromtimestamp(start_time).isoformat(),
                     datetime.fromtimestamp(end_time).isoformat())
         
-        # 模拟数据过滤
-        filtered_data = [
-            data for data in self.historical_data 
-            if start_time <= data['timestamp'] <= end_time
-        ]
+        # 二分查找时间段边界和段内时间戳，结果为不复制记录的视图
+        filtered_data = self.history.range(start_time, end_time)
         
         logger.info("检索到 %d 条历史数据", len(filtered_data))
-        return filtered_data
+        return filtered_data.to_columns() if columnar else filtered_data
     
-    def store_model(self, model_name: str, model_metadata: Dict) -> bool:
-        """模拟存储机器学习模型"""
+    def retrieve_aggregated_data(self, start_time: float, end_time: float, max_points: int = 1000,
+                                 metrics: Optional[List[str]] = None) -> Dict[str, Any]:
+        """按点数预算检索汇总数据：原始样本不超过预算时直接返回样本，否则使用满足预算的最细汇总粒度"""
+        metric_names = metrics or self.rollups.metric_names()
+        raw_count = self.history.count(start_time, end_time)
+        if raw_count <= max_points:
+            raw = self.history.range(start_time, end_time)
+            columns = raw.to_columns(metric_names)
+            timestamps = columns['timestamp'].tolist()
+            series = {}
+            for name in metric_names:
+                # 缺失的指标记为 None，JSON 输出中不能出现 NaN
+                values = [None if v != v else v for v in columns[name].tolist()]
+                series[name] = {'timestamp': timestamps, 'min': values, 'max': values, 'avg': values,
+                                'count': [0 if v is None else 1 for v in values],
+                                'p50': values, 'p95': values, 'p99': values}
+            logger.info("汇总检索使用原始数据，点数: %d", len(raw))
+            return {'resolution': 0, 'series': series}
+        
+        resolution = self.rollups.choose_resolution(start_time, end_time, max_points)
+        series = {name: self.rollups.query(name, start_time, end_time, resolution, max_points)
+                  for name in metric_names}
+        logger.info("汇总检索使用 %d 秒粒度，指标数: %d", resolution, len(series))
+        return {'resolution': resolution, 'series': series}
+    
+    def store_model(self, model_name: str, model_metadata: Dict, model_blob: Optional[bytes] = None) -> bool:
+        """存储机器学习模型，版本号按模型名单调递增；model_blob 为序列化后的模型数据，独立存放"""
         logger.info("模拟存储模型: %s，元数据: %s", model_name, model_metadata)
         
-        # 模拟模型版本控制
-        model_version = f"v{random.randint(1, 10)}.{random.randint(0, 9)}"
-        model_record = {
-            'name': model_name,
-            'version': model_version,
-            'metadata': model_metadata,
-            'stored_at': time.time()
-        }
-        self.models[f"{model_name}_{model_version}"] = model_record
+        model_record = self.model_registry.register(model_name, model_metadata, model_blob)
         
-        logger.info("模型存储成功: %s，版本: %s", model_name, model_version)
+        logger.info("模型存储成功: %s，版本: %d", model_name, model_record['version'])
         return True
     
-    def retrieve_model(self, model_name: str, version: Optional[str] = None) -> Optional[Dict]:
-        """模拟检索机器学习模型"""
-        logger.info("模拟检索模型: %s，版本: %s", model_name, version or "最新")
-        
-        # 模拟模型查找
-        if version:
-            model_key = f"{model_name}_{version}"
-            model = self.models.get(model_key)
-        else:
-            # 模拟返回最新版本
-            matching_models = [m for k, m in self.models.items() if k.startswith(model_name)]
-            model = max(matching_models, key=lambda x: x['stored_at'], default=None)
+    def retrieve_model(self, model_name: str, version: Optional[Union[int, str]] = None) -> Optional[Dict]:
+        """检索机器学习模型元数据，未指定版本时返回最新版本（按名称索引，常数时间）"""
+        model = self.model_registry.get(model_name, version)
         
         if model:
-            logger.info("模型检索成功: %s，版本: %s", model['name'], model['version'])
+            logger.debug("模型检索成功: %s，版本: %d", model['name'], model['version'])
         else:
-            logger.warning("未找到模型: %s", model_name)
+            logger.warning("未找到模型: %s，版本: %s", model_name, version or "最新")
         
         return model
     
+    def retrieve_model_blob(self, model_name: str, version: Optional[Union[int, str]] = None) -> Optional[bytes]:
+        """按需加载模型数据"""
+        return self.model_registry.load_blob(model_name, version)
+    
     def store_optimization_result(self, result: Dict) -> bool:
         """模拟存储优化结果"""
         logger.info("模拟存储优化结果: %s", result)
         
         # 模拟结果验证和存储
+        parameters = result.get('parameters', {}) or {}
         validated_result = {
             'timestamp': result.get('timestamp', time.time()),
             'action': result.get('action', 'unknown'),
+            'table': result.get('table', parameters.get('target_table')),
+            'column': result.get('column', parameters.get('column')),
             'success': result.get('success', False),
             'impact': result.get('impact', {}),
+            'execution_time': result.get('execution_time'),
             'result_id': random.randint(1000, 9999)
         }
-        self.optimization_results.append(validated_result)
+        with self._results_lock:
+            self.optimization_results.append(validated_result)
+            self.optimization_analytics.add(validated_result)
+            self._append_log('optimization_results', validated_result)
         
         logger.info("优化结果存储成功，结果ID: %d，当前存储量: %d", 
                     validated_result['result_id'], len(self.optimization_results))
         return True
     
+    def get_optimization_stats(self, action: str, table: Optional[str] = None,
+                               column: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """返回某优化操作（可细化到表、列）的成功率、影响均值/方差、执行时间分位数和近期加权成功率"""
+        return self.optimization_analytics.get(action, table, column)
+    
+    def summarize_optimizations(self, table: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """按操作汇总优化结果统计，指定 table 时只统计该表"""
+        return self.optimization_analytics.summary(table)
+    
+    def close(self) -> None:
+        """停止后台压缩并关闭所有持久化文件"""
+        self._stop_event.set()
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+        if self.backend is not None or self.storage_dir:
+            self._save_rollups()
+        self._checkpoint_log()
+        for log in self._logs.values():
+            log.close()
+        self._logs.clear()
+        self.model_registry.close()
+        self.history.close()
+        if self.backend is not None:
+            self.backend.close()
+        logger.info("知识库已关闭")
+    
     def run(self) -> None:
         """运行知识库，模拟周期性数据管理"""
         while True:
@@ -167,4 +387,5 @@ if __name__ == "__main__":
     try:
         kb.run()
     except KeyboardInterrupt:
+        kb.close()
         logger.info("知识库已停止")
\ No newline at end of file
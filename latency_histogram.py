@@ -0,0 +1,59 @@
+# 刀 AI 数据库扩展技术 - 延迟直方图
+# 本脚本实现固定桶的延迟直方图：记录 O(log 桶数)，内存不随样本数增长，分位数按桶上界估算。
+# 查询统计（database_connector）和 API 请求统计（request_limits）共用同一组桶，两边的分位数可以直接比较。
+
+import bisect
+import logging
+from typing import Dict, Any
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 延迟直方图桶上界（秒），按约 2.5 倍对数间隔划分
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+_BUCKET_LABELS = [str(b) for b in LATENCY_BUCKETS] + ['+Inf']
+
+
+class LatencyHistogram:
+    """延迟直方图：样本数、总耗时、最大耗时和各桶计数"""
+
+    __slots__ = ('count', 'total_time', 'max_time', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed: float) -> None:
+        """记录一个耗时样本（秒）"""
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def percentile(self, q: float) -> float:
+        """根据直方图估算延迟分位数（返回所在桶的上界）"""
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= threshold:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max_time
+        return self.max_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'histogram': dict(zip(_BUCKET_LABELS, self.buckets))
+        }
@@ -0,0 +1,134 @@
+# 刀 AI 数据库扩展技术 - API 压力测试工具
+# 本脚本对本机 API 服务发起大量并发长连接请求，统计吞吐量和延迟分位数。
+# 默认在子进程中启动 API 服务（与压测客户端不共享 CPU），也可通过 --port 指向已运行的服务。
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _serve(config_path: str, port: int, rate_limit: bool = False) -> None:
+    """子进程入口：在指定端口启动 API 服务；压测客户端共用一个密钥，默认关闭按密钥限流"""
+    from api_interface import APIInterface
+    logging.getLogger().setLevel(logging.WARNING)
+    api = APIInterface(config_path)
+    if not rate_limit:
+        api.rate_limiter = None
+    api.config.setdefault('api', {})['port'] = port
+    api.run()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    """读取一个响应，返回状态码"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    length = 0
+    for line in lines[1:]:
+        if line.lower().startswith('content-length:'):
+            length = int(line.split(':', 1)[1])
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def _client(host: str, port: int, request: bytes, deadline: float, pipeline: int,
+                  latencies: List[float], counters: Dict[str, int]) -> None:
+    """单个长连接客户端：每轮发送 pipeline 个请求再依次读取响应，直到截止时间"""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        counters['connect_errors'] += 1
+        return
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request * pipeline)
+            for _ in range(pipeline):
+                status = await _read_response(reader)
+                counters['ok' if status == 200 else 'rate_limited' if status == 429 else 'errors'] += 1
+            latencies.append((time.perf_counter() - start) / pipeline)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        counters['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def run_load_test(host: str, port: int, path: str, api_key: str, connections: int,
+                        duration: float, pipeline: int = 1) -> Dict[str, float]:
+    """以 connections 个并发长连接压测 path，返回吞吐量和延迟分位数（毫秒）"""
+    request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\nX-API-Key: {api_key}\r\n\r\n").encode('latin-1')
+    latencies: List[float] = []
+    counters = {'ok': 0, 'rate_limited': 0, 'errors': 0, 'connect_errors': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_client(host, port, request, deadline, pipeline, latencies, counters)
+                           for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    samples = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'connections': connections,
+        'requests': counters['ok'],
+        'rate_limited': counters['rate_limited'],
+        'errors': counters['errors'],
+        'connect_errors': counters['connect_errors'],
+        'requests_per_second': counters['ok'] / elapsed,
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99))
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, float]:
+    parser = argparse.ArgumentParser(description="刀 AI API 压力测试")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--port', type=int, default=None, help="压测已运行的服务；不指定时在子进程中启动服务")
+    parser.add_argument('--path', default='/system_status')
+    parser.add_argument('--api-key', default='demo_api_key_123456')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--pipeline', type=int, default=1, help="每个连接每轮流水线发送的请求数")
+    parser.add_argument('--rate-limit', action='store_true', help="子进程启动的服务保留按密钥限流（429 单独计数）")
+    args = parser.parse_args(argv)
+
+    server = None
+    port = args.port
+    if port is None:
+        port = _free_port()
+        server = multiprocessing.Process(target=_serve, args=(args.config, port, args.rate_limit), daemon=True)
+        server.start()
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+    try:
+        result = asyncio.run(run_load_test('127.0.0.1', port, args.path, args.api_key, args.connections,
+                                           args.duration, args.pipeline))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+    logger.info("压测结果: %s", result)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -105,6 +105,8 @@ class DaoAIApplication:
                 component.disconnect()
             elif name == 'management_console':
                 component.stop_console()
+            elif name == 'security_module':
+                component.close()
             logger.info("组件已停止: %s", name)
         
         logger.info("所有组件已停止")
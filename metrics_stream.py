@@ -0,0 +1,198 @@
+# 刀 AI 数据库扩展技术 - 指标推送广播
+# 本脚本实现指标和异常事件的推送广播：监控管道发布的每个事件只编码一次，再分发给所有订阅者；
+# 每个订阅者有有界队列，消费过慢时合并（丢弃积压的指标点、保留异常事件）或断开，并支持按游标续传。
+
+import asyncio
+import json
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Any, AsyncIterator, Deque, Optional, Set
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = ('sse', 'ndjson')
+# 积压时可以合并丢弃的事件类型，其余类型（如异常）只要队列还有空间就保留
+_COALESCIBLE_TYPES = {'metrics'}
+
+
+class StreamEvent:
+    """带单调递增序号的推送事件，各输出格式的编码结果只计算一次并在订阅者之间共享"""
+
+    __slots__ = ('seq', 'type', 'data', 'timestamp', '_encoded')
+
+    def __init__(self, seq: int, event_type: str, data: Dict[str, Any], timestamp: Optional[float] = None):
+        self.seq = seq
+        self.type = event_type
+        self.data = data
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self._encoded: Dict[str, bytes] = {}
+
+    def encode(self, fmt: str) -> bytes:
+        encoded = self._encoded.get(fmt)
+        if encoded is None:
+            payload = json.dumps({'seq': self.seq, 'type': self.type, 'timestamp': self.timestamp,
+                                  'data': self.data}, ensure_ascii=False)
+            if fmt == 'sse':
+                # 序号为 0 的控制事件（如 lag）不带 id，避免覆盖客户端的 Last-Event-ID
+                id_line = f"id: {self.seq}\n" if self.seq else ''
+                encoded = f"{id_line}event: {self.type}\ndata: {payload}\n\n".encode('utf-8')
+            else:
+                encoded = (payload + '\n').encode('utf-8')
+            self._encoded[fmt] = encoded
+        return encoded
+
+
+class Subscriber:
+    """单个订阅者：有界事件队列及其积压统计"""
+
+    def __init__(self, queue_size: int, types: Optional[Set[str]] = None):
+        self.queue_size = queue_size
+        self.types = types
+        self.events: Deque[StreamEvent] = deque()
+        self.wakeup = asyncio.Event()
+        self.last_seq = 0  # 已入队的最大序号，用于续传与实时分发之间去重
+        self.dropped = 0
+        self.pending_lag: Optional[int] = None  # 被合并丢弃的第一个事件序号，下一次输出时通知客户端
+        self.closed = False
+
+    def wants(self, event: StreamEvent) -> bool:
+        return event.seq > self.last_seq and (self.types is None or event.type in self.types)
+
+
+class MetricsBroadcaster:
+    """指标推送广播：发布一次、扇出到所有订阅者，发布方可以在任意线程调用 publish"""
+
+    def __init__(self, queue_size: int = 256, history_size: int = 10000, overflow: str = 'coalesce'):
+        """queue_size 为每个订阅者的队列上限；history_size 为供续传使用的最近事件数；
+        overflow 为 coalesce（丢弃积压的指标点并通知客户端）或 disconnect（断开，由客户端按游标续传）"""
+        if overflow not in ('coalesce', 'disconnect'):
+            raise ValueError(f"不支持的积压处理策略: {overflow}")
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.history: Deque[StreamEvent] = deque(maxlen=history_size)
+        self.subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self.disconnected = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定负责扇出的事件循环（HTTP 服务所在的循环）"""
+        self._loop = loop
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> int:
+        """发布事件并返回其序号；事件先进入续传缓冲区，再由事件循环扇出给订阅者"""
+        with self._lock:
+            self._seq += 1
+            event = StreamEvent(self._seq, event_type, data)
+            self.history.append(event)
+            self.published += 1
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                self._fanout(event)
+            else:
+                loop.call_soon_threadsafe(self._fanout, event)
+        return event.seq
+
+    def _fanout(self, event: StreamEvent) -> None:
+        for subscriber in list(self.subscribers):
+            if subscriber.wants(event):
+                self._offer(subscriber, event)
+
+    def _offer(self, subscriber: Subscriber, event: StreamEvent) -> None:
+        """把事件放入订阅者队列；队列满时按策略合并或断开"""
+        events = subscriber.events
+        if len(events) >= subscriber.queue_size:
+            if self.overflow == 'coalesce':
+                kept = deque(e for e in events if e.type not in _COALESCIBLE_TYPES)
+                dropped = len(events) - len(kept)
+                if dropped:
+                    first = next(e.seq for e in events if e.type in _COALESCIBLE_TYPES)
+                    subscriber.pending_lag = first if subscriber.pending_lag is None else subscriber.pending_lag
+                    subscriber.dropped += dropped
+                    subscriber.events = events = kept
+            if len(events) >= subscriber.queue_size:
+                self._disconnect(subscriber)
+                return
+        events.append(event)
+        subscriber.last_seq = event.seq
+        subscriber.wakeup.set()
+
+    def _disconnect(self, subscriber: Subscriber) -> None:
+        subscriber.closed = True
+        subscriber.wakeup.set()
+        self.subscribers.discard(subscriber)
+        self.disconnected += 1
+        logger.warning("推送订阅者消费过慢，已断开，最后送达序号: %d", subscriber.last_seq)
+
+    def subscribe(self, cursor: Optional[int] = None, types: Optional[Set[str]] = None) -> Subscriber:
+        """订阅事件，须在事件循环线程中调用；提供 cursor 时先补发序号大于 cursor 的缓冲事件"""
+        subscriber = Subscriber(self.queue_size, types)
+        with self._lock:
+            backlog = [event for event in self.history if cursor is not None and event.seq > cursor]
+            oldest = self.history[0].seq if self.history else self._seq + 1
+            subscriber.last_seq = self._seq if cursor is None else cursor
+        if cursor is not None:
+            if cursor + 1 < oldest:
+                # 游标早于缓冲区，缺失的事件无法补发
+                subscriber.pending_lag = cursor + 1
+            for event in backlog:
+                if subscriber.wants(event):
+                    self._offer(subscriber, event)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscriber.closed = True
+        subscriber.wakeup.set()
+        self.subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: Subscriber, fmt: str = 'sse',
+                     heartbeat_seconds: float = 15.0) -> AsyncIterator[bytes]:
+        """按指定格式产出订阅者的事件；空闲时发送心跳，订阅关闭或被断开时结束"""
+        heartbeat = b": heartbeat\n\n" if fmt == 'sse' else b'{"type": "heartbeat"}\n'
+        try:
+            while True:
+                if not subscriber.events and subscriber.pending_lag is None:
+                    if subscriber.closed:
+                        return
+                    subscriber.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(subscriber.wakeup.wait(), heartbeat_seconds)
+                    except asyncio.TimeoutError:
+                        yield heartbeat
+                    continue
+                chunks: List[bytes] = []
+                if subscriber.pending_lag is not None:
+                    lag = StreamEvent(0, 'lag', {'dropped': subscriber.dropped, 'resume_from': subscriber.pending_lag})
+                    chunks.append(lag.encode(fmt))
+                    subscriber.pending_lag = None
+                # 一次取走队列中已有的全部事件，合并为一个数据块写出
+                while subscriber.events:
+                    chunks.append(subscriber.events.popleft().encode(fmt))
+                yield b''.join(chunks)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self) -> None:
+        """结束所有订阅（服务关闭时调用），各订阅者发送完已排队的事件后结束"""
+        for subscriber in list(self.subscribers):
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'subscribers': len(self.subscribers),
+            'published': self.published,
+            'disconnected': self.disconnected,
+            'last_seq': self._seq
+        }
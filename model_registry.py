@@ -0,0 +1,227 @@
+# 刀 AI 数据库扩展技术 - 模型注册表
+# 本脚本实现带索引的版本化模型注册表：每个模型名的版本号单调递增，按名称索引可在 O(1) 时间取得最新版本，
+# 大体积模型数据独立存放、按需加载，并支持回收旧版本。
+
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from urllib.parse import quote
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Union
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 墓碑记录超过有效记录数时重写日志
+_LOG_COMPACT_RATIO = 1.0
+
+
+def _parse_version(version: Union[int, str]) -> Optional[int]:
+    """解析版本号，兼容 'v3' 形式"""
+    try:
+        return int(str(version).lstrip('vV'))
+    except ValueError:
+        return None
+
+
+class ModelRegistry:
+    """版本化模型注册表：元数据常驻内存索引，模型数据（blob）独立存放并延迟加载"""
+
+    def __init__(self, storage_dir: Optional[str] = None, keep_versions: Optional[int] = None,
+                 blob_cache_size: int = 8, backend: Any = None):
+        """storage_dir 为空时仅在内存中保存；keep_versions 为每个模型保留的最近版本数（None 表示不回收）；
+        提供 backend（如 SQLiteBackend）时记录和模型数据都保存在其中，不使用 storage_dir"""
+        self.storage_dir = None if backend is not None else storage_dir
+        self.backend = backend
+        self.keep_versions = keep_versions
+        # 模型名 -> {版本号: 记录}，按版本升序插入，首项即最旧版本
+        self._versions: Dict[str, Dict[int, Dict]] = {}
+        self._latest: Dict[str, Dict] = {}
+        self._next_version: Dict[str, int] = {}
+        self._blobs: Dict[tuple, bytes] = {}
+        self._blob_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._blob_cache_size = blob_cache_size
+        self._tombstones = 0
+        self._lock = threading.Lock()
+        self._log = None
+        if backend is not None:
+            self._replay(backend.load_models())
+        elif storage_dir:
+            os.makedirs(os.path.join(storage_dir, 'model_blobs'), exist_ok=True)
+            self._replay(self._read_log())
+            self._log = open(self._log_path(), 'a', encoding='utf-8')
+
+    def _log_path(self) -> str:
+        return os.path.join(self.storage_dir, 'models.jsonl')
+
+    def _blob_path(self, name: str, version: int) -> str:
+        return os.path.join(self.storage_dir, 'model_blobs', f"{quote(name, safe='')}.v{version}.bin")
+
+    def _read_log(self) -> Iterator[Dict]:
+        path = self._log_path()
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break  # 崩溃时未写完的最后一行
+
+    def _replay(self, records: Iterable[Dict]) -> None:
+        """按写入顺序重放记录恢复索引；旧格式的非整数版本号按出现顺序重新编号"""
+        for record in records:
+            name = record['name']
+            if record.get('deleted'):
+                self._versions.get(name, {}).pop(record['version'], None)
+                self._tombstones += 1
+                continue
+            version = record['version']
+            if not isinstance(version, int):
+                record['legacy_version'] = version
+                record['version'] = version = self._next_version.get(name, 1)
+            self._index(record)
+        for name, versions in self._versions.items():
+            if versions:
+                self._latest[name] = versions[max(versions)]
+
+    def _index(self, record: Dict) -> None:
+        name, version = record['name'], record['version']
+        self._versions.setdefault(name, {})[version] = record
+        self._latest[name] = record
+        self._next_version[name] = max(self._next_version.get(name, 1), version + 1)
+
+    def _write_log(self, record: Dict) -> None:
+        if self.backend is not None:
+            if record.get('deleted'):
+                self.backend.delete_model(record['name'], record['version'])
+            else:
+                self.backend.insert_model(record)
+        elif self._log is not None:
+            self._log.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._log.flush()
+
+    def register(self, name: str, metadata: Dict, blob: Optional[bytes] = None) -> Dict:
+        """注册新版本并返回其记录；blob 不进入内存索引，持久化模式下写入独立文件或存储引擎的单独表"""
+        with self._lock:
+            version = self._next_version.get(name, 1)
+            record = {
+                'name': name,
+                'version': version,
+                'metadata': metadata,
+                'stored_at': time.time(),
+                'blob_size': len(blob) if blob is not None else 0
+            }
+            if blob is not None:
+                if self.backend is not None:
+                    self.backend.put_model_blob(name, version, bytes(blob))
+                elif self.storage_dir:
+                    path = self._blob_path(name, version)
+                    with open(path + '.tmp', 'wb') as f:
+                        f.write(blob)
+                    os.replace(path + '.tmp', path)
+                else:
+                    self._blobs[(name, version)] = bytes(blob)
+            self._write_log(record)
+            self._index(record)
+            if self.keep_versions:
+                self._collect(name, self.keep_versions)
+        return record
+
+    def get(self, name: str, version: Optional[Union[int, str]] = None) -> Optional[Dict]:
+        """按名称和版本查找模型记录，未指定版本时返回最新版本，均为 O(1)"""
+        if version is None:
+            return self._latest.get(name)
+        parsed = _parse_version(version)
+        return self._versions.get(name, {}).get(parsed) if parsed is not None else None
+
+    def versions(self, name: str) -> List[int]:
+        """返回模型现存的版本号（升序）"""
+        return list(self._versions.get(name, {}))
+
+    def load_blob(self, name: str, version: Optional[Union[int, str]] = None) -> Optional[bytes]:
+        """按需加载模型数据，最近使用的若干个保存在缓存中"""
+        record = self.get(name, version)
+        if record is None or not record['blob_size']:
+            return None
+        key = (name, record['version'])
+        if not self.storage_dir and self.backend is None:
+            return self._blobs.get(key)
+        with self._lock:
+            blob = self._blob_cache.get(key)
+            if blob is not None:
+                self._blob_cache.move_to_end(key)
+                return blob
+        if self.backend is not None:
+            blob = self.backend.load_model_blob(*key)
+            if blob is None:
+                return None  # 加载期间该版本已被回收
+        else:
+            try:
+                with open(self._blob_path(*key), 'rb') as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                return None  # 加载期间该版本已被回收
+        with self._lock:
+            self._blob_cache[key] = blob
+            while len(self._blob_cache) > self._blob_cache_size:
+                self._blob_cache.popitem(last=False)
+        return blob
+
+    def _collect(self, name: str, keep: int) -> int:
+        """删除模型最旧的版本直到只剩 keep 个（最新版本始终保留），调用方需持有锁"""
+        versions = self._versions.get(name, {})
+        removed = 0
+        while len(versions) > max(keep, 1):
+            version = next(iter(versions))
+            record = versions.pop(version)
+            self._blobs.pop((name, version), None)
+            self._blob_cache.pop((name, version), None)
+            if self.storage_dir and record['blob_size']:
+                try:
+                    os.remove(self._blob_path(name, version))
+                except FileNotFoundError:
+                    pass
+            self._write_log({'name': name, 'version': version, 'deleted': True})
+            self._tombstones += 1
+            removed += 1
+        if self._log is not None and self._tombstones > _LOG_COMPACT_RATIO * len(self):
+            self._rewrite_log()
+        return removed
+
+    def gc(self, keep_versions: Optional[int] = None) -> int:
+        """回收所有模型的旧版本，返回删除的版本数"""
+        keep = keep_versions or self.keep_versions
+        if not keep:
+            return 0
+        with self._lock:
+            removed = sum(self._collect(name, keep) for name in list(self._versions))
+        if removed:
+            logger.info("模型旧版本回收完成，删除版本数: %d", removed)
+        return removed
+
+    def _rewrite_log(self) -> None:
+        """只保留现存版本重写日志，去掉墓碑记录"""
+        path = self._log_path()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            for versions in self._versions.values():
+                for record in versions.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._log.close()
+        os.replace(path + '.tmp', path)
+        self._log = open(path, 'a', encoding='utf-8')
+        self._tombstones = 0
+
+    def __len__(self) -> int:
+        return sum(len(versions) for versions in self._versions.values())
+
+    def close(self) -> None:
+        """关闭日志文件"""
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self._blob_cache.clear()
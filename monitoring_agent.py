@@ -6,7 +6,7 @@ import time
 import random
 import yaml
 import logging
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,6 +19,7 @@ class MonitoringAgent:
         """初始化监控代理，加载配置文件"""
         self.config = self._load_config(config_path)
         self.metrics: List[Dict] = []
+        self.listeners: List[Callable[[str, Dict], None]] = []
         logger.info("监控代理已初始化，配置文件: %s", config_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -48,6 +49,22 @@ class MonitoringAgent:
         
         self.metrics.append(metric)
         logger.info("收集到指标: %s", metric)
+        self._notify('metrics', metric)
+        thresholds = self.config.get('monitoring', {}).get('anomaly_thresholds', {}) or {}
+        exceeded = {name: metric[name] for name, limit in thresholds.items() if metric.get(name, 0) > limit}
+        if exceeded:
+            self._notify('anomaly', {'timestamp': metric['timestamp'], 'exceeded': exceeded})
+    
+    def add_listener(self, listener: Callable[[str, Dict], None]) -> None:
+        """注册事件监听器，新指标（metrics）和超阈值异常（anomaly）产生时回调"""
+        self.listeners.append(listener)
+    
+    def _notify(self, event_type: str, data: Dict) -> None:
+        for listener in self.listeners:
+            try:
+                listener(event_type, data)
+            except Exception as e:
+                logger.error("指标监听器执行失败: %s", str(e))
     
     def preprocess_data(self) -> List[Dict]:
         """模拟数据预处理和特征提取"""
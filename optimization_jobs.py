@@ -0,0 +1,157 @@
+# 刀 AI 数据库扩展技术 - 异步优化任务
+# 本脚本实现优化操作的异步任务模型：提交后立即返回任务编号，任务在有界线程池中执行并上报进度；
+# 相同幂等键的重复提交合并为同一个任务，调用方可以轮询状态或长轮询等待完成。
+
+import asyncio
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+_FINISHED = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class JobQueueFull(Exception):
+    """排队任务数达到上限"""
+
+
+class OptimizationJob:
+    """单个优化任务的状态"""
+
+    def __init__(self, action: str, parameters: Dict[str, Any], owner: str, idempotency_key: Optional[str]):
+        self.job_id = uuid.uuid4().hex
+        self.action = action
+        self.parameters = parameters
+        self.owner = owner
+        self.idempotency_key = idempotency_key
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.future: Optional[Future] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _FINISHED
+
+    def report_progress(self, progress: float) -> None:
+        """由执行函数调用以上报进度（0~1）"""
+        self.progress = min(max(progress, 0.0), 1.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'action': self.action,
+            'parameters': self.parameters,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    """有界的优化任务管理器：固定工作线程数、排队上限、按幂等键去重，只保留最近的已完成任务"""
+
+    def __init__(self, runner: Callable[[OptimizationJob], Dict], max_workers: int = 4, max_queued: int = 100,
+                 max_jobs: int = 1000):
+        """runner 在工作线程中执行优化并返回结果字典，可调用 job.report_progress 上报进度"""
+        self.runner = runner
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, OptimizationJob]" = OrderedDict()
+        self._idempotency: Dict[Tuple[str, str], str] = {}
+        self._active = 0  # 排队中和执行中的任务数
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='optimization_job')
+
+    def submit(self, action: str, parameters: Optional[Dict[str, Any]] = None, owner: str = '',
+               idempotency_key: Optional[str] = None) -> Tuple[OptimizationJob, bool]:
+        """提交任务，返回 (任务, 是否新建)；同一调用方的相同幂等键返回已有任务，排队已满时抛出 JobQueueFull"""
+        with self._lock:
+            if idempotency_key is not None:
+                existing = self._idempotency.get((owner, idempotency_key))
+                if existing is not None and existing in self.jobs:
+                    return self.jobs[existing], False
+            if self._active >= self.max_queued:
+                raise JobQueueFull(f"排队任务数已达上限: {self.max_queued}")
+            job = OptimizationJob(action, dict(parameters or {}), owner, idempotency_key)
+            self.jobs[job.job_id] = job
+            if idempotency_key is not None:
+                self._idempotency[(owner, idempotency_key)] = job.job_id
+            self._active += 1
+            self._evict()
+        job.future = self._executor.submit(self._run, job)
+        logger.info("优化任务已提交: %s，动作: %s", job.job_id, action)
+        return job, True
+
+    def _evict(self) -> None:
+        """超出保留上限时按提交顺序删除已完成的任务，调用方需持有锁"""
+        if len(self.jobs) <= self.max_jobs:
+            return
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            job = self.jobs[job_id]
+            if job.finished:
+                del self.jobs[job_id]
+                if job.idempotency_key is not None:
+                    self._idempotency.pop((job.owner, job.idempotency_key), None)
+
+    def _run(self, job: OptimizationJob) -> OptimizationJob:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = self.runner(job)
+            job.status = JOB_SUCCEEDED if job.result.get('success', True) else JOB_FAILED
+        except Exception as e:
+            logger.error("优化任务执行失败: %s，错误: %s", job.job_id, str(e))
+            job.error = str(e)
+            job.status = JOB_FAILED
+        job.progress = 1.0
+        job.finished_at = time.time()
+        with self._lock:
+            self._active -= 1
+        logger.info("优化任务完成: %s，状态: %s", job.job_id, job.status)
+        return job
+
+    def get(self, job_id: str) -> Optional[OptimizationJob]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, owner: Optional[str] = None, limit: int = 100) -> List[OptimizationJob]:
+        """按提交时间倒序返回最近的任务"""
+        jobs = [job for job in reversed(self.jobs.values()) if owner is None or job.owner == owner]
+        return jobs[:limit]
+
+    async def wait(self, job: OptimizationJob, timeout: float) -> OptimizationJob:
+        """长轮询：在事件循环中等待任务完成，最多等待 timeout 秒，不占用工作线程"""
+        if not job.finished and timeout > 0 and job.future is not None:
+            await asyncio.wait([asyncio.wrap_future(job.future)], timeout=timeout)
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING) + _FINISHED}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+            return {'active': self._active, **counts}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
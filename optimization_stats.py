@@ -0,0 +1,187 @@
+# 刀 AI 数据库扩展技术 - 优化结果统计
+# 本脚本按 (操作, 表, 列) 增量维护优化结果的聚合统计：成功率、影响指标的均值与方差（Welford 算法）、
+# 执行时间分位数以及按指数衰减加权的近期成功率，每次写入 O(1) 更新，查询无需扫描历史结果。
+
+import math
+import time
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+from rollups import QuantileSketch
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 聚合键中表示“任意”的占位符
+ANY = '*'
+
+
+class RunningMoments:
+    """Welford 在线均值/方差"""
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {'count': self.count, 'mean': self.mean, 'variance': self.variance,
+                'stddev': math.sqrt(self.variance)}
+
+    def to_state(self) -> List[float]:
+        return [self.count, self.mean, self.m2]
+
+    @classmethod
+    def from_state(cls, state: List[float]) -> 'RunningMoments':
+        moments = cls()
+        moments.count, moments.mean, moments.m2 = state
+        return moments
+
+
+class OutcomeStats:
+    """单个聚合键的优化结果统计"""
+
+    __slots__ = ('total', 'successes', 'impact', 'execution_time', 'decayed_total', 'decayed_successes',
+                 'last_timestamp')
+
+    def __init__(self):
+        self.total = 0
+        self.successes = 0
+        self.impact: Dict[str, RunningMoments] = {}
+        self.execution_time = QuantileSketch()
+        self.decayed_total = 0.0
+        self.decayed_successes = 0.0
+        self.last_timestamp: Optional[float] = None
+
+    def _decay_factor(self, timestamp: float, decay_rate: float) -> float:
+        if self.last_timestamp is None:
+            return 1.0
+        return math.exp(-decay_rate * max(timestamp - self.last_timestamp, 0.0))
+
+    def add(self, result: Dict, decay_rate: float) -> None:
+        """累加一条优化结果；乱序到达的旧结果按其时间差折算权重"""
+        success = bool(result.get('success'))
+        timestamp = result['timestamp']
+        self.total += 1
+        self.successes += success
+        for name, value in (result.get('impact') or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                moments = self.impact.get(name)
+                if moments is None:
+                    moments = self.impact[name] = RunningMoments()
+                moments.add(value)
+        execution_time = result.get('execution_time')
+        if execution_time is not None:
+            self.execution_time.add(execution_time)
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            factor = self._decay_factor(timestamp, decay_rate)
+            self.decayed_total = self.decayed_total * factor + 1.0
+            self.decayed_successes = self.decayed_successes * factor + success
+            self.last_timestamp = timestamp
+        else:
+            weight = math.exp(-decay_rate * (self.last_timestamp - timestamp))
+            self.decayed_total += weight
+            self.decayed_successes += weight * success
+
+    def to_dict(self, now: float, decay_rate: float) -> Dict[str, Any]:
+        factor = self._decay_factor(now, decay_rate)
+        decayed_total = self.decayed_total * factor
+        sketch = self.execution_time
+        return {
+            'total': self.total,
+            'successes': self.successes,
+            'success_rate': self.successes / self.total if self.total else 0.0,
+            'decayed_weight': decayed_total,
+            'decayed_success_rate': self.decayed_successes / self.decayed_total if self.decayed_total else 0.0,
+            'impact': {name: moments.to_dict() for name, moments in self.impact.items()},
+            'execution_time': {
+                'count': sketch.count,
+                'p50': sketch.quantile(0.5),
+                'p95': sketch.quantile(0.95),
+                'p99': sketch.quantile(0.99)
+            },
+            'last_timestamp': self.last_timestamp
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        """可序列化的内部状态，用于持久化快照"""
+        return {'total': self.total, 'successes': self.successes,
+                'impact': {name: moments.to_state() for name, moments in self.impact.items()},
+                'execution_time': self.execution_time.to_dict(), 'decayed_total': self.decayed_total,
+                'decayed_successes': self.decayed_successes, 'last_timestamp': self.last_timestamp}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> 'OutcomeStats':
+        stats = cls()
+        stats.total = state['total']
+        stats.successes = state['successes']
+        stats.impact = {name: RunningMoments.from_state(moments) for name, moments in state['impact'].items()}
+        stats.execution_time = QuantileSketch.from_dict(state['execution_time'])
+        stats.decayed_total = state['decayed_total']
+        stats.decayed_successes = state['decayed_successes']
+        stats.last_timestamp = state['last_timestamp']
+        return stats
+
+
+class OptimizationAnalytics:
+    """按 (操作, 表, 列) 及其上卷键 (操作, 表, *)、(操作, *, *) 维护优化结果统计"""
+
+    def __init__(self, half_life_seconds: float = 7 * 86400):
+        """half_life_seconds 为近期加权的半衰期"""
+        self.decay_rate = math.log(2) / half_life_seconds
+        self.stats: Dict[Tuple[str, str, str], OutcomeStats] = {}
+
+    @staticmethod
+    def result_keys(result: Dict) -> List[Tuple[str, str, str]]:
+        action = result.get('action') or 'unknown'
+        table = result.get('table') or ANY
+        column = result.get('column') or ANY
+        keys = [(action, ANY, ANY)]
+        if table != ANY:
+            keys.append((action, table, ANY))
+            if column != ANY:
+                keys.append((action, table, column))
+        return keys
+
+    def add(self, result: Dict) -> None:
+        """累加一条优化结果，更新至多三个聚合键"""
+        for key in self.result_keys(result):
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = OutcomeStats()
+            stats.add(result, self.decay_rate)
+
+    def get(self, action: str, table: Optional[str] = None, column: Optional[str] = None,
+            now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """返回指定键的统计；未指定表/列时返回上卷后的统计"""
+        stats = self.stats.get((action, table or ANY, column or ANY))
+        if stats is None:
+            return None
+        return stats.to_dict(now if now is not None else time.time(), self.decay_rate)
+
+    def summary(self, table: Optional[str] = None, now: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """按操作列出统计，指定 table 时只看该表"""
+        now = now if now is not None else time.time()
+        return {key[0]: stats.to_dict(now, self.decay_rate)
+                for key, stats in self.stats.items()
+                if key[1] == (table or ANY) and key[2] == ANY}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """全部聚合键的统计快照，重启时用 load_dict 恢复而无需重放历史结果"""
+        return {'stats': [[list(key), stats.to_state()] for key, stats in self.stats.items()]}
+
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        self.stats = {tuple(key): OutcomeStats.from_state(state) for key, state in data.get('stats', [])}
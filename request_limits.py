@@ -0,0 +1,122 @@
+# 刀 AI 数据库扩展技术 - API 请求统计与限流
+# 本脚本实现 API 的请求统计和限流：每个接口只保留固定大小的计数器和延迟直方图（内存不随请求数增长），
+# 并按 API 密钥使用令牌桶限流（O(1) 检查、按需补充令牌），过载时快速返回 429。
+
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from latency_histogram import LatencyHistogram
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 未注册的路径统一计入该接口名下，避免任意路径撑大统计表
+OTHER_ENDPOINT = 'other'
+# 缺失或无效的 API 密钥共用的限流键，避免随机密钥各占一个令牌桶
+UNAUTHENTICATED_KEY = '<unauthenticated>'
+
+
+class EndpointStats(LatencyHistogram):
+    """单个接口的聚合统计：请求数、按状态码类别的计数、被限流次数和延迟直方图"""
+
+    __slots__ = ('status_classes', 'rate_limited')
+
+    def __init__(self):
+        super().__init__()
+        self.status_classes = [0] * 5  # 1xx ~ 5xx
+        self.rate_limited = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        summary = super().to_dict()
+        summary.update({'status': {f'{i + 1}xx': n for i, n in enumerate(self.status_classes) if n},
+                        'rate_limited': self.rate_limited})
+        return summary
+
+
+class RequestAccounting:
+    """按接口聚合请求统计，接口集合在创建时确定，未知路径计入 OTHER_ENDPOINT"""
+
+    def __init__(self, endpoints: Iterable[str]):
+        self.stats: Dict[str, EndpointStats] = {endpoint: EndpointStats() for endpoint in endpoints}
+        self.stats.setdefault(OTHER_ENDPOINT, EndpointStats())
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, status: int, elapsed: float) -> None:
+        """记录一次请求的状态码和处理耗时"""
+        with self._lock:
+            stats = self.stats.get(endpoint) or self.stats[OTHER_ENDPOINT]
+            stats.add(elapsed)
+            if 100 <= status < 600:
+                stats.status_classes[status // 100 - 1] += 1
+            if status == 429:
+                stats.rate_limited += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回各接口的统计快照（只包含有请求的接口）"""
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self.stats.items() if stats.count}
+
+    def total(self) -> int:
+        return sum(stats.count for stats in self.stats.values())
+
+
+class TokenBucket:
+    """令牌桶：每次检查时按流逝时间补充令牌，不需要后台定时器"""
+
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+
+
+class RateLimiter:
+    """按 API 密钥限流的令牌桶集合；令牌桶数量有上限，超出时淘汰最久未使用的桶
+    （被淘汰的桶本就处于空闲状态，重建后视为满桶，与其补满后的状态一致）"""
+
+    def __init__(self, rate: float = 100.0, burst: Optional[float] = None, max_keys: int = 10000):
+        """rate 为每秒补充的令牌数（稳态请求速率），burst 为桶容量（允许的突发请求数），默认等于 rate"""
+        if rate <= 0:
+            raise ValueError(f"限流速率必须为正数: {rate}")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """尝试为 key 消耗 cost 个令牌，返回 (是否放行, 建议重试等待秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.burst, now)
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+                bucket.updated_at = now
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                self.allowed += 1
+                return True, 0.0
+            self.rejected += 1
+            return False, (cost - bucket.tokens) / self.rate
+
+    @staticmethod
+    def retry_after(wait: float) -> str:
+        """Retry-After 头只接受整数秒，向上取整且至少为 1"""
+        return str(max(1, math.ceil(wait)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'keys': len(self.buckets), 'allowed': self.allowed, 'rejected': self.rejected,
+                'rate': self.rate, 'burst': self.burst}
@@ -0,0 +1,310 @@
+# 刀 AI 数据库扩展技术 - API 响应缓存
+# 本脚本实现 API 响应层：按接口和参数缓存序列化后的响应体（短 TTL），生成 ETag/Last-Modified 以支持条件请求（304），
+# 并按客户端声明协商 gzip 压缩以及紧凑的二进制编码（MessagePack 格式，纯 Python 实现，无额外依赖）。
+
+import gzip
+import hashlib
+import json
+import struct
+import threading
+import time
+import logging
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Any, Callable, Hashable, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+def pack(value: Any) -> bytes:
+    """把 JSON 兼容的值编码为 MessagePack 字节串"""
+    out = bytearray()
+    _pack(value, out)
+    return bytes(out)
+
+
+def _pack(value: Any, out: bytearray) -> None:
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xff)
+        elif 0 <= value <= 0xff:
+            out += struct.pack('>BB', 0xcc, value)
+        elif 0 <= value <= 0xffff:
+            out += struct.pack('>BH', 0xcd, value)
+        elif 0 <= value <= 0xffffffff:
+            out += struct.pack('>BI', 0xce, value)
+        elif 0 <= value < 1 << 64:
+            out += struct.pack('>BQ', 0xcf, value)
+        elif -(1 << 63) <= value < 0:
+            out += struct.pack('>Bq', 0xd3, value)
+        else:
+            raise ValueError(f"整数超出 MessagePack 范围: {value}")
+    elif isinstance(value, float):
+        out += struct.pack('>Bd', 0xcb, value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 1 << 8:
+            out += struct.pack('>BB', 0xd9, size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xda, size)
+        else:
+            out += struct.pack('>BI', 0xdb, size)
+        out += data
+    elif isinstance(value, (bytes, bytearray)):
+        size = len(value)
+        if size < 1 << 8:
+            out += struct.pack('>BB', 0xc4, size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xc5, size)
+        else:
+            out += struct.pack('>BI', 0xc6, size)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 16:
+            out.append(0x90 | size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xdc, size)
+        else:
+            out += struct.pack('>BI', 0xdd, size)
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        size = len(value)
+        if size < 16:
+            out.append(0x80 | size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xde, size)
+        else:
+            out += struct.pack('>BI', 0xdf, size)
+        for key, item in value.items():
+            _pack(str(key), out)
+            _pack(item, out)
+    else:
+        _pack(str(value), out)
+
+
+def unpack(data: bytes) -> Any:
+    """解码 pack 生成的 MessagePack 字节串"""
+    value, offset = _unpack(memoryview(data), 0)
+    if offset != len(data):
+        raise ValueError("MessagePack 数据末尾有多余字节")
+    return value
+
+
+_FIXED_FORMATS = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d'
+}
+
+
+def _unpack(data: memoryview, offset: int) -> Tuple[Any, int]:
+    tag = data[offset]
+    offset += 1
+    if tag < 0x80:
+        return tag, offset
+    if tag >= 0xe0:
+        return tag - 0x100, offset
+    if tag in _FIXED_FORMATS:
+        fmt = _FIXED_FORMATS[tag]
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+    if tag == 0xc0:
+        return None, offset
+    if tag in (0xc2, 0xc3):
+        return tag == 0xc3, offset
+    if 0xa0 <= tag <= 0xbf or tag in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6):
+        if 0xa0 <= tag <= 0xbf:
+            size = tag & 0x1f
+        else:
+            fmt = {0xd9: '>B', 0xda: '>H', 0xdb: '>I', 0xc4: '>B', 0xc5: '>H', 0xc6: '>I'}[tag]
+            size = struct.unpack_from(fmt, data, offset)[0]
+            offset += struct.calcsize(fmt)
+        raw = bytes(data[offset:offset + size])
+        return (raw if tag in (0xc4, 0xc5, 0xc6) else raw.decode('utf-8')), offset + size
+    if 0x90 <= tag <= 0x9f or tag in (0xdc, 0xdd):
+        size, offset = _container_size(data, offset, tag, 0x90)
+        items = []
+        for _ in range(size):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return items, offset
+    if 0x80 <= tag <= 0x8f or tag in (0xde, 0xdf):
+        size, offset = _container_size(data, offset, tag, 0x80)
+        result = {}
+        for _ in range(size):
+            key, offset = _unpack(data, offset)
+            result[key], offset = _unpack(data, offset)
+        return result, offset
+    raise ValueError(f"不支持的 MessagePack 类型标记: 0x{tag:02x}")
+
+
+def _container_size(data: memoryview, offset: int, tag: int, fix_base: int) -> Tuple[int, int]:
+    if fix_base <= tag <= fix_base + 0x0f:
+        return tag & 0x0f, offset
+    if tag in (0xdc, 0xde):
+        return struct.unpack_from('>H', data, offset)[0], offset + 2
+    return struct.unpack_from('>I', data, offset)[0], offset + 4
+
+
+def _accepts(header: str, *tokens: str) -> bool:
+    """判断 Accept/Accept-Encoding 头是否接受任一给定取值（忽略 q=0 的项）"""
+    for part in header.lower().split(','):
+        value, _, params = part.strip().partition(';')
+        if value.strip() in tokens:
+            q = params.replace(' ', '')
+            try:
+                if not q.startswith('q=') or float(q[2:]) > 0:
+                    return True
+            except ValueError:
+                return True
+    return False
+
+
+class CachedResponse:
+    """一份缓存的响应：JSON 响应体在生成时编码，二进制和 gzip 表示在首次被请求时生成并复用"""
+
+    def __init__(self, payload: Dict[str, Any], ttl: float, last_modified: Optional[float] = None,
+                 gzip_min_bytes: int = 1024, gzip_level: int = 6):
+        self.payload = payload
+        self.body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.digest = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+        self.created_at = time.time()
+        self.expires_at = time.monotonic() + ttl
+        self.ttl = ttl
+        self.last_modified = int(last_modified if last_modified is not None else self.created_at)
+        self.gzip_min_bytes = gzip_min_bytes
+        self.gzip_level = gzip_level
+        self._variants: Dict[Tuple[bool, bool], bytes] = {(False, False): self.body}
+        self._lock = threading.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def etag(self, binary: bool, gzipped: bool) -> str:
+        """每种表示（编码格式 × 压缩）有各自的强 ETag"""
+        suffix = ('-msgpack' if binary else '') + ('-gzip' if gzipped else '')
+        return f'"{self.digest}{suffix}"'
+
+    def variant(self, binary: bool, gzipped: bool) -> bytes:
+        key = (binary, gzipped)
+        body = self._variants.get(key)
+        if body is None:
+            with self._lock:
+                body = self._variants.get(key)
+                if body is None:
+                    body = pack(self.payload) if binary else self.body
+                    if gzipped:
+                        # mtime 固定为 0，相同内容的压缩结果逐字节一致
+                        body = gzip.compress(body, self.gzip_level, mtime=0)
+                    self._variants[key] = body
+        return body
+
+    def not_modified(self, headers: Dict[str, str], etag: str) -> bool:
+        """按 If-None-Match（优先）或 If-Modified-Since 判断客户端缓存是否仍然有效"""
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def render(self, headers: Dict[str, str]) -> Tuple[int, bytes, Dict[str, str]]:
+        """按请求头协商表示，返回 (状态码, 响应体, 响应头)；条件请求命中时返回 304 和空响应体"""
+        binary = _accepts(headers.get('accept', ''), MSGPACK_CONTENT_TYPE, 'application/x-msgpack')
+        gzipped = (len(self.body) >= self.gzip_min_bytes
+                   and _accepts(headers.get('accept-encoding', ''), 'gzip'))
+        etag = self.etag(binary, gzipped)
+        response_headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(self.last_modified, usegmt=True),
+            'Cache-Control': f'private, max-age={int(self.ttl)}',
+            'Vary': 'Accept, Accept-Encoding',
+            'Content-Type': MSGPACK_CONTENT_TYPE if binary else JSON_CONTENT_TYPE
+        }
+        if self.not_modified(headers, etag):
+            return 304, b'', response_headers
+        if gzipped:
+            response_headers['Content-Encoding'] = 'gzip'
+        return 200, self.variant(binary, gzipped), response_headers
+
+
+class ResponseCache:
+    """按 (接口, 参数) 缓存响应的 LRU 缓存；过期后重建的内容与旧内容相同时沿用原 Last-Modified，
+    轮询的客户端可以持续得到 304"""
+
+    def __init__(self, max_entries: int = 1024, gzip_min_bytes: int = 1024, gzip_level: int = 6):
+        self.max_entries = max_entries
+        self.gzip_min_bytes = gzip_min_bytes
+        self.gzip_level = gzip_level
+        self.entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        """返回未过期的缓存项"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.fresh:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def get_or_build(self, key: Hashable, ttl: float,
+                     build: Callable[[], Dict[str, Any]]) -> Tuple[Optional[CachedResponse], Dict[str, Any]]:
+        """取得缓存项，未命中或已过期时调用 build 重新生成；build 返回非 200 结果时不缓存，
+        返回 (缓存项或 None, build 的原始结果或空字典)"""
+        entry = self.get(key)
+        if entry is not None:
+            return entry, {}
+        result = build()
+        if result.get('status_code', 200) != 200:
+            return None, result
+        payload = {k: v for k, v in result.items() if k != 'status_code'}
+        entry = CachedResponse(payload, ttl, gzip_min_bytes=self.gzip_min_bytes, gzip_level=self.gzip_level)
+        with self._lock:
+            previous = self.entries.get(key)
+            if previous is not None and previous.digest == entry.digest:
+                entry.last_modified = previous.last_modified
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry, result
+
+    def invalidate(self, prefix: Optional[str] = None) -> int:
+        """删除缓存项；提供 prefix 时只删除键的首元素（接口路径）等于 prefix 的项"""
+        with self._lock:
+            keys = [key for key in self.entries
+                    if prefix is None or (isinstance(key, tuple) and key and key[0] == prefix)]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,259 @@
+# 刀 AI 数据库扩展技术 - 物化汇总
+# 本脚本在写入时增量维护 1 分钟、1 小时和 1 天粒度的指标汇总（最小值、最大值、总和、计数和分位数草图），
+# 长时间范围查询按点数预算选择合适的粒度，查询成本取决于输出点数而不是原始样本数。
+
+import math
+import bisect
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 默认汇总粒度（秒）及保留天数
+DEFAULT_RESOLUTIONS = {60: 7, 3600: 90, 86400: 730}
+# 分位数草图的相对误差
+SKETCH_RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_INV_LOG_GAMMA = 1.0 / math.log(_GAMMA)
+
+
+def _bin_value(index: int) -> float:
+    """对数桶的代表值"""
+    return 2.0 * _GAMMA ** index / (_GAMMA + 1)
+
+
+class QuantileSketch:
+    """相对误差有界的对数分桶分位数草图（DDSketch 思路），可合并"""
+    
+    __slots__ = ('positive', 'negative', 'zero_count', 'count')
+    
+    def __init__(self):
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+    
+    def add(self, value: float) -> None:
+        """加入一个值；NaN 和 ±inf 没有对应的对数桶，直接忽略"""
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        if value > 0:
+            index = math.ceil(math.log(value) * _INV_LOG_GAMMA)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < 0:
+            index = math.ceil(math.log(-value) * _INV_LOG_GAMMA)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+    
+    def merge(self, other: 'QuantileSketch') -> None:
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+    
+    def quantile(self, q: float) -> float:
+        """估算分位数，相对误差不超过 SKETCH_RELATIVE_ACCURACY"""
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -_bin_value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return _bin_value(index)
+        return _bin_value(max(self.positive)) if self.positive else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {'p': self.positive, 'n': self.negative, 'z': self.zero_count}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'QuantileSketch':
+        sketch = cls()
+        sketch.positive = {int(k): v for k, v in data['p'].items()}
+        sketch.negative = {int(k): v for k, v in data['n'].items()}
+        sketch.zero_count = data['z']
+        sketch.count = sum(sketch.positive.values()) + sum(sketch.negative.values()) + sketch.zero_count
+        return sketch
+
+
+class RollupBucket:
+    """单个汇总桶的聚合值"""
+    
+    __slots__ = ('min', 'max', 'sum', 'count', 'sketch')
+    
+    def __init__(self):
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.count = 0
+        self.sketch = QuantileSketch()
+    
+    def add(self, value: float) -> None:
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.sum += value
+        self.count += 1
+        self.sketch.add(value)
+    
+    def merge(self, other: 'RollupBucket') -> None:
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+        self.count += other.count
+        self.sketch.merge(other.sketch)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {'min': self.min, 'max': self.max, 'sum': self.sum, 'count': self.count,
+                'sketch': self.sketch.to_dict()}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RollupBucket':
+        bucket = cls()
+        bucket.min, bucket.max, bucket.sum, bucket.count = data['min'], data['max'], data['sum'], data['count']
+        bucket.sketch = QuantileSketch.from_dict(data['sketch'])
+        return bucket
+
+
+class RollupSeries:
+    """单个指标在单个粒度上的汇总序列，桶起点有序排列"""
+    
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self.buckets: Dict[int, RollupBucket] = {}
+        self.starts: List[int] = []
+    
+    def add(self, timestamp: float, value: float) -> None:
+        start = int(timestamp // self.resolution) * self.resolution
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = RollupBucket()
+            if not self.starts or start > self.starts[-1]:
+                self.starts.append(start)
+            else:
+                bisect.insort(self.starts, start)
+        bucket.add(value)
+    
+    def range(self, start_time: float, end_time: float) -> List[Tuple[int, RollupBucket]]:
+        """返回与时间范围相交的桶，复杂度 O(log n + k)"""
+        lo = bisect.bisect_right(self.starts, start_time - self.resolution)
+        hi = bisect.bisect_right(self.starts, end_time)
+        return [(start, self.buckets[start]) for start in self.starts[lo:hi]]
+    
+    def expire(self, cutoff: float) -> int:
+        """删除结束时间早于 cutoff 的桶"""
+        index = bisect.bisect_right(self.starts, cutoff - self.resolution)
+        for start in self.starts[:index]:
+            del self.buckets[start]
+        del self.starts[:index]
+        return index
+
+
+class RollupStore:
+    """多粒度物化汇总：写入时增量更新，查询时按点数预算选择粒度"""
+    
+    def __init__(self, resolutions: Optional[Dict[int, float]] = None):
+        """resolutions 为 {粒度秒数: 保留天数}"""
+        self.retention_days = dict(sorted((resolutions or DEFAULT_RESOLUTIONS).items()))
+        self.resolutions: List[int] = list(self.retention_days)
+        self.series: Dict[int, Dict[str, RollupSeries]] = {res: {} for res in self.resolutions}
+        self.watermark = -math.inf
+    
+    def add(self, timestamp: float, metrics: Dict[str, Any]) -> None:
+        """把一条记录的数值指标累加到各粒度的桶中，忽略 NaN 和 ±inf"""
+        for name, value in metrics.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+                continue
+            for resolution in self.resolutions:
+                series = self.series[resolution].get(name)
+                if series is None:
+                    series = self.series[resolution][name] = RollupSeries(resolution)
+                series.add(timestamp, value)
+        if timestamp > self.watermark:
+            self.watermark = timestamp
+    
+    def expire(self, now: float) -> int:
+        """按各粒度的保留期删除过期桶"""
+        removed = 0
+        for resolution, days in self.retention_days.items():
+            for series in self.series[resolution].values():
+                removed += series.expire(now - days * 86400)
+        return removed
+    
+    def metric_names(self) -> List[str]:
+        return sorted(self.series[self.resolutions[0]]) if self.resolutions else []
+    
+    def choose_resolution(self, start_time: float, end_time: float, max_points: int) -> int:
+        """选择输出点数不超过预算、且保留期覆盖查询起点的最细粒度；都不满足时返回最粗粒度"""
+        span = max(end_time - start_time, 0)
+        for resolution in self.resolutions:
+            retained_from = self.watermark - self.retention_days[resolution] * 86400
+            if span / resolution + 1 <= max_points and start_time >= retained_from:
+                return resolution
+        return self.resolutions[-1]
+    
+    def query(self, metric: str, start_time: float, end_time: float, resolution: int,
+              max_points: Optional[int] = None) -> Dict[str, List]:
+        """返回指定粒度的汇总序列；点数仍超预算时把相邻桶合并"""
+        series = self.series.get(resolution, {}).get(metric)
+        buckets = series.range(start_time, end_time) if series is not None else []
+        if max_points and len(buckets) > max_points:
+            group = math.ceil(len(buckets) / max_points)
+            merged = []
+            for i in range(0, len(buckets), group):
+                combined = RollupBucket()
+                for _, bucket in buckets[i:i + group]:
+                    combined.merge(bucket)
+                merged.append((buckets[i][0], combined))
+            buckets = merged
+        return {
+            'timestamp': [start for start, _ in buckets],
+            'min': [b.min for _, b in buckets],
+            'max': [b.max for _, b in buckets],
+            'avg': [b.sum / b.count for _, b in buckets],
+            'count': [b.count for _, b in buckets],
+            'p50': [b.sketch.quantile(0.5) for _, b in buckets],
+            'p95': [b.sketch.quantile(0.95) for _, b in buckets],
+            'p99': [b.sketch.quantile(0.99) for _, b in buckets]
+        }
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为可写入 JSON 的快照"""
+        return {
+            'watermark': self.watermark if self.watermark != -math.inf else None,
+            'series': {
+                str(resolution): {
+                    name: {str(start): series.buckets[start].to_dict() for start in series.starts}
+                    for name, series in by_metric.items()
+                }
+                for resolution, by_metric in self.series.items()
+            }
+        }
+    
+    def load_dict(self, data: Dict[str, Any]) -> None:
+        """从快照恢复汇总状态"""
+        if data.get('watermark') is not None:
+            self.watermark = data['watermark']
+        for resolution_key, by_metric in data.get('series', {}).items():
+            resolution = int(resolution_key)
+            if resolution not in self.series:
+                continue
+            for name, buckets in by_metric.items():
+                series = self.series[resolution][name] = RollupSeries(resolution)
+                for start_key, bucket in sorted(buckets.items(), key=lambda item: int(item[0])):
+                    series.buckets[int(start_key)] = RollupBucket.from_dict(bucket)
+                    series.starts.append(int(start_key))
@@ -6,10 +6,18 @@ import time
 import random
 import yaml
 import logging
+import base64
 import hashlib
-from typing import Dict, List, Any, Optional
+import os
+import secrets
+from typing import Dict, List, Any, BinaryIO, Iterable, Iterator, Optional, Sequence, Union
 from datetime import datetime
 
+from access_control import DecisionAuditor, PermissionRegistry, SessionCache
+from anonymizer import BatchAnonymizer, anonymize_batches
+from audit_log import AuditLogWriter
+from stream_crypto import StreamCipher
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -20,8 +28,23 @@ class SecurityModule:
     def __init__(self, config_path: str):
         """初始化安全模块，加载配置文件"""
         self.config = self._load_config(config_path)
-        self.audit_log: List[Dict] = []
-        self.access_control_list: Dict[str, List[str]] = {}
+        self.audit_log = self._init_audit_log()
+        access_config = self.config.get('security', {}).get('access_control', {}) or {}
+        self.permissions = PermissionRegistry(roles=access_config.get('roles') or {
+            'admin': ['read', 'write', 'optimize', 'admin'],
+            'operator': ['read', 'write', 'optimize'],
+            'viewer': ['read']
+        })
+        self.anonymizer = self._init_anonymizer()
+        self.cipher = self._init_cipher()
+        self.default_roles: List[str] = access_config.get('default_roles', ['operator'])
+        # 用户名 -> 编译后的权限位掩码
+        self.access_control_list: Dict[str, int] = {}
+        self.sessions = SessionCache(ttl_seconds=access_config.get('session_ttl_seconds', 3600),
+                                     max_sessions=access_config.get('max_sessions', 10000))
+        self.access_auditor = DecisionAuditor(self._log_audit_event, mode=access_config.get('audit_mode', 'all'),
+                                              sample_rate=access_config.get('audit_sample_rate', 0.01),
+                                              aggregate_interval=access_config.get('audit_aggregate_seconds', 60))
         logger.info("安全模块已初始化，配置文件: %s", config_path)
     
     def _load_config(self, config_path: str) -> Dict:
@@ -35,27 +58,72 @@ class SecurityModule:
             logger.error("加载配置文件失败: %s", str(e))
             return {}
     
+    def _init_audit_log(self) -> AuditLogWriter:
+        """根据 security.audit 配置创建审计日志写入器，未配置目录时只在内存中保留最近的事件"""
+        audit_config = self.config.get('security', {}).get('audit', {}) or {}
+        return AuditLogWriter(directory=audit_config.get('directory'),
+                              queue_size=audit_config.get('queue_size', 10000),
+                              flush_interval=audit_config.get('flush_interval_ms', 50) / 1000.0,
+                              max_file_bytes=audit_config.get('max_file_mb', 16) * 1024 * 1024,
+                              max_files=audit_config.get('max_files'),
+                              overflow=audit_config.get('overflow', 'block'),
+                              fsync=audit_config.get('fsync', True),
+                              memory_events=audit_config.get('memory_events', 10000))
+    
+    def _init_anonymizer(self) -> BatchAnonymizer:
+        """根据 security.anonymizer 配置创建匿名化器；HMAC 密钥从 key_env 指定的环境变量读取，
+        未设置时使用随机密钥（假名只在本进程内稳定）"""
+        anonymizer_config = self.config.get('security', {}).get('anonymizer', {}) or {}
+        key = os.environ.get(anonymizer_config.get('key_env', 'DAO_AI_ANONYMIZATION_KEY'), '').encode('utf-8')
+        if not key:
+            logger.warning("未配置匿名化密钥，使用随机密钥，假名在重启后会变化")
+            key = secrets.token_bytes(32)
+        return BatchAnonymizer(key, rules=anonymizer_config.get('rules'),
+                               memo_size=anonymizer_config.get('memo_size', 100000))
+    
+    def _init_cipher(self) -> StreamCipher:
+        """根据 security.stream_encryption 配置创建分块 AES-GCM 加密器；密钥材料从 key_env 指定的环境变量读取，
+        经 SHA-256 派生为 256 位密钥，未设置时使用随机密钥（密文只能在本进程内解密）"""
+        crypto_config = self.config.get('security', {}).get('stream_encryption', {}) or {}
+        secret = os.environ.get(crypto_config.get('key_env', 'DAO_AI_ENCRYPTION_KEY'), '')
+        if secret:
+            key = hashlib.sha256(secret.encode('utf-8')).digest()
+        else:
+            logger.warning("未配置加密密钥，使用随机密钥，重启后无法解密已有密文")
+            key = secrets.token_bytes(32)
+        return StreamCipher(key, chunk_size=crypto_config.get('chunk_kb', 64) * 1024)
+    
     def encrypt_data(self, data: str) -> str:
-        """模拟数据加密"""
+        """加密字符串，返回 URL 安全的 Base64 密文"""
         encryption_algorithm = self.config.get('security', {}).get('encryption', 'aes-256')
-        logger.info("模拟加密数据，使用算法: %s", encryption_algorithm)
+        logger.info("加密数据，使用算法: %s-gcm（分块）", encryption_algorithm)
         
-        # 模拟加密过程（仅生成哈希作为占位符）
-        encrypted_data = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        encrypted_data = base64.urlsafe_b64encode(self.cipher.encrypt(data.encode('utf-8'))).decode('ascii')
         logger.info("数据加密完成，加密结果长度: %d", len(encrypted_data))
         return encrypted_data
     
     def decrypt_data(self, encrypted_data: str) -> str:
-        """模拟数据解密"""
-        logger.info("模拟解密数据，加密数据长度: %d", len(encrypted_data))
+        """解密 encrypt_data 生成的密文；认证失败时抛出 DecryptionError"""
+        logger.info("解密数据，加密数据长度: %d", len(encrypted_data))
         
-        # 模拟解密过程（返回伪解密数据）
-        decrypted_data = f"decrypted_{encrypted_data[:10]}"  # 占位符解密结果
+        decrypted_data = self.cipher.decrypt(base64.urlsafe_b64decode(encrypted_data.encode('ascii'))).decode('utf-8')
         logger.info("数据解密完成")
         return decrypted_data
     
-    def authenticate_user(self, username: str, password: str) -> bool:
-        """模拟用户认证"""
+    def encrypt_stream(self, src: Union[bytes, bytearray, memoryview, BinaryIO], dst: BinaryIO) -> int:
+        """流式加密大体积数据（如导出文件、模型数据）写入 dst，内存占用与数据大小无关，返回写出的字节数"""
+        return self.cipher.encrypt_stream(src, dst)
+    
+    def decrypt_stream(self, src: Union[bytes, bytearray, memoryview, BinaryIO], dst: BinaryIO) -> int:
+        """流式解密 encrypt_stream 的输出写入 dst，返回明文字节数"""
+        return self.cipher.decrypt_stream(src, dst)
+    
+    def decrypt_range(self, src: Union[bytes, bytearray, memoryview, BinaryIO], offset: int, length: int) -> bytes:
+        """随机读取密文中明文 [offset, offset + length) 的部分，只解密涉及的块"""
+        return self.cipher.read_range(src, offset, length)
+    
+    def authenticate_user(self, username: str, password: str, roles: Optional[List[str]] = None) -> bool:
+        """模拟用户认证；成功时按角色（默认 default_roles）编译并保存用户的权限位掩码"""
         logger.info("模拟认证用户: %s", username)
         
         # 模拟认证逻辑
@@ -64,7 +132,7 @@ class SecurityModule:
         
         if success:
             logger.info("用户认证成功: %s", username)
-            self.access_control_list[username] = ['read', 'write', 'optimize']  # 模拟权限分配
+            self.grant_roles(username, roles if roles is not None else self.default_roles)
         else:
             logger.warning("用户认证失败: %s", username)
         
@@ -72,46 +140,88 @@ class SecurityModule:
         self._log_audit_event('authentication', {'username': username, 'success': success})
         return success
     
+    def login(self, username: str, password: str, roles: Optional[List[str]] = None) -> Optional[str]:
+        """认证用户并签发会话令牌，之后的请求凭令牌授权，不再重复认证；认证失败返回 None"""
+        if not self.authenticate_user(username, password, roles):
+            return None
+        return self.sessions.create(username, self.access_control_list[username]).token
+    
+    def logout(self, token: str) -> bool:
+        """撤销会话令牌"""
+        revoked = self.sessions.revoke(token)
+        if revoked:
+            self._log_audit_event('session_revoked', {'token_prefix': token[:8]})
+        return revoked
+    
+    def grant_roles(self, username: str, roles: List[str]) -> int:
+        """设置用户角色，返回编译后的权限位掩码；用户现有会话的权限同步更新"""
+        mask = self.permissions.role_mask(roles)
+        self.access_control_list[username] = mask
+        self.sessions.update_mask(username, mask)
+        return mask
+    
+    def revoke_user(self, username: str) -> int:
+        """撤销用户的全部权限和会话，返回撤销的会话数"""
+        self.access_control_list.pop(username, None)
+        revoked = self.sessions.revoke_user(username)
+        self._log_audit_event('session_revoked', {'username': username, 'sessions': revoked})
+        return revoked
+    
     def check_access(self, username: str, action: str) -> bool:
-        """模拟检查用户访问权限"""
-        logger.info("检查用户权限: %s，操作: %s", username, action)
-        
-        permissions = self.access_control_list.get(username, [])
-        allowed = action in permissions
-        logger.info("权限检查结果: %s", "允许" if allowed else "拒绝")
-        
-        # 记录审计日志
-        self._log_audit_event('access_check', {'username': username, 'action': action, 'allowed': allowed})
+        """检查用户访问权限：一次字典查找加一次按位与"""
+        allowed = self.permissions.allows(self.access_control_list.get(username, 0), action)
+        logger.debug("权限检查: %s，操作: %s，结果: %s", username, action, allowed)
+        self.access_auditor.record(username, action, allowed)
         return allowed
     
-    def _log_audit_event(self, event_type: str, details: Dict) -> None:
-        """模拟记录审计日志"""
+    def authorize(self, token: str, action: str) -> bool:
+        """按会话令牌检查权限；令牌无效或已过期时拒绝"""
+        session = self.sessions.get(token)
+        if session is None:
+            self.access_auditor.record('<invalid_session>', action, False)
+            return False
+        allowed = self.permissions.allows(session.mask, action)
+        self.access_auditor.record(session.username, action, allowed)
+        return allowed
+    
+    def _log_audit_event(self, event_type: str, details: Dict) -> int:
+        """记录审计日志：只入队并返回单调递增的事件编号，由后台线程批量写入"""
         if not self.config.get('security', {}).get('audit_log_enabled', True):
-            return
+            return -1
         
-        audit_entry = {
-            'timestamp': time.time(),
-            'event_type': event_type,
-            'details': details,
-            'event_id': random.randint(1000, 9999)
-        }
-        self.audit_log.append(audit_entry)
-        logger.info("记录审计日志: %s，事件ID: %d", event_type, audit_entry['event_id'])
+        event_id = self.audit_log.append(event_type, details)
+        logger.debug("记录审计日志: %s，事件ID: %d", event_type, event_id)
+        return event_id
+    
+    def query_audit_log(self, start_time: float, end_time: float, event_type: Optional[str] = None,
+                        limit: Optional[int] = None) -> List[Dict]:
+        """按时间范围查询审计日志，先等待已入队的事件写入"""
+        self.audit_log.flush()
+        return self.audit_log.query(start_time, end_time, event_type, limit)
+    
+    def close(self) -> None:
+        """输出未汇总的访问决策，写完剩余的审计事件并关闭日志文件"""
+        self.access_auditor.flush()
+        self.audit_log.close()
     
     def anonymize_data(self, data: Dict) -> Dict:
-        """模拟数据匿名化"""
-        logger.info("模拟匿名化数据")
-        
-        # 模拟匿名化过程
-        anonymized_data = {}
-        for key, value in data.items():
-            if isinstance(value, str) and 'user' in key.lower():
-                anonymized_data[key] = f"anon_{hashlib.md5(value.encode('utf-8')).hexdigest()[:8]}"
-            else:
-                anonymized_data[key] = value
-        
-        logger.info("数据匿名化完成")
-        return anonymized_data
+        """匿名化单条记录（按 security.anonymizer.rules，默认把列名含 user 的字符串字段替换为假名）"""
+        return self.anonymizer.anonymize_record(data)
+    
+    def anonymize_batch(self, batch: Dict[str, Sequence[Any]]) -> Dict[str, Sequence[Any]]:
+        """匿名化列式批次 {列名: 值序列}"""
+        return self.anonymizer.anonymize_batch(batch)
+    
+    def anonymize_batches(self, batches: Iterable[Dict[str, Sequence[Any]]],
+                          workers: Optional[int] = None) -> Iterator[Dict[str, Sequence[Any]]]:
+        """用进程池并行匿名化大批量导出，按输入顺序产出；workers 为 1 时在当前进程中处理"""
+        anonymizer_config = self.config.get('security', {}).get('anonymizer', {}) or {}
+        workers = workers or anonymizer_config.get('workers', 4)
+        if workers <= 1:
+            return (self.anonymizer.anonymize_batch(batch) for batch in batches)
+        return anonymize_batches(batches, self.anonymizer.key, self.anonymizer.rules, workers=workers,
+                                 memo_size=self.anonymizer.memo_size,
+                                 chunk_rows=anonymizer_config.get('chunk_rows', 50000))
     
     def run(self) -> None:
         """运行安全模块，模拟持续安全操作"""
@@ -0,0 +1,815 @@
+# 刀 AI 数据库扩展技术 - 时间分段存储
+# 本脚本实现知识库历史数据的按时间分段存储：写入只追加到对应时间段，保留策略按整段淘汰。
+# 配置数据目录后，活跃段写入预写日志，过期的活跃段封存为只追加的列式文件并通过内存映射读取。
+# 带噪声的浮点指标无损 XOR 压缩几乎没有收益；配置 precision 后按小数位数量化为整数再做差值的差值编码，
+# 以有损为代价换取数倍的压缩率。
+
+import os
+import json
+import mmap
+import bisect
+import struct
+import threading
+import weakref
+import logging
+from collections import abc, OrderedDict
+from typing import Dict, List, Any, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+import gorilla_codec
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 列式段文件格式：8 字节魔数 + 8 字节头长度 + JSON 文件头 + 按 8 字节对齐的列数据
+SEGMENT_MAGIC = b'KBSEG001'
+SEGMENT_SUFFIX = '.kbs'
+WAL_FILE = 'active.wal'
+# 量化编码中表示缺失值（NaN）的整数
+_QUANT_NAN = -2 ** 63
+_HEADER_PREFIX = struct.Struct('<8sQ')
+
+
+def _align(offset: int) -> int:
+    """按 8 字节对齐偏移量"""
+    return (offset + 7) & ~7
+
+
+def _is_numeric(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _as_float(value: Any) -> float:
+    return float(value) if _is_numeric(value) else np.nan
+
+
+class TimeSegment:
+    """单个时间段，覆盖 [start, end) 范围内的历史记录，段内记录按时间戳有序"""
+    
+    sealed = False
+    
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+        self.records: List[Dict] = []
+        self.timestamps: List[float] = []
+    
+    def append(self, record: Dict) -> None:
+        """追加一条记录；时间戳乱序时有序插入以维持段内索引"""
+        timestamp = record['timestamp']
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            self.timestamps.append(timestamp)
+            self.records.append(record)
+        else:
+            index = bisect.bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(index, timestamp)
+            self.records.insert(index, record)
+    
+    def bounds(self, start_time: float, end_time: float) -> Tuple[int, int]:
+        """二分查找 [start_time, end_time] 在段内对应的下标区间"""
+        lo = 0 if start_time <= self.start else bisect.bisect_left(self.timestamps, start_time)
+        hi = len(self.timestamps) if end_time >= self.end else bisect.bisect_right(self.timestamps, end_time)
+        return lo, hi
+    
+    def timestamp_range(self, lo: int, hi: int) -> np.ndarray:
+        return np.asarray(self.timestamps[lo:hi], dtype=np.float64)
+    
+    def metric_names(self, lo: int, hi: int) -> List[str]:
+        """返回区间内出现过的指标名"""
+        names = set()
+        for record in self.records[lo:hi]:
+            names.update(record.get('metrics', {}))
+        return sorted(names)
+    
+    def columns(self, lo: int, hi: int, names: List[str]) -> Dict[str, np.ndarray]:
+        """将区间内的记录转换为列式数组"""
+        records = self.records[lo:hi]
+        columns = {'timestamp': np.asarray(self.timestamps[lo:hi], dtype=np.float64)}
+        for name in names:
+            columns[name] = np.fromiter(
+                (_as_float(record.get('metrics', {}).get(name)) for record in records),
+                dtype=np.float64, count=len(records))
+        return columns
+    
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class _SealedRecords(abc.Sequence):
+    """封存段的记录序列，按下标从列数据即时还原记录字典"""
+    
+    def __init__(self, segment: 'SealedSegment'):
+        self._segment = segment
+    
+    def __len__(self) -> int:
+        return self._segment.count
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._segment.record(index)
+
+
+class SealedSegment:
+    """已封存的不可变列式段，通过内存映射读取；未压缩列直接映射为数组视图，
+    压缩列按块解码，范围读取只解码涉及的块"""
+    
+    sealed = True
+    
+    def __init__(self, path: str, block_cache_size: int = 64):
+        """打开段文件并解析文件头，列数据在首次访问时才映射或解码"""
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, header_length = _HEADER_PREFIX.unpack(f.read(_HEADER_PREFIX.size))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"无效的段文件: {path}")
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        self.start: float = self.header['start']
+        self.end: float = self.header['end']
+        self.count: int = self.header['count']
+        self.extras: Dict[int, Dict] = {int(k): v for k, v in self.header.get('extras', {}).items()}
+        # 压缩合并产生的段记录被合并的段文件名，恢复时据此跳过崩溃遗留的旧段
+        self.replaces: List[str] = self.header.get('replaces', [])
+        self.block_rows: int = self.header.get('block_rows', 0)
+        self._block_first_ts: List[float] = self.header.get('block_first_ts', [])
+        self._block_last_ts: List[float] = self.header.get('block_last_ts', [])
+        self._data_start = _align(_HEADER_PREFIX.size + header_length)
+        self._column_specs = {column['name']: column for column in self.header['columns']}
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._blocks: "OrderedDict[Tuple[str, int], np.ndarray]" = OrderedDict()
+        self._block_cache_size = block_cache_size
+        self._mmap: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+        self._refs = 0  # 引用该段的检索视图数
+        self._retired = False
+        self.records = _SealedRecords(self)
+    
+    @property
+    def compressed(self) -> bool:
+        return self.block_rows > 0
+    
+    def _buffer(self) -> mmap.mmap:
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+    
+    def _block(self, name: str, block: int) -> np.ndarray:
+        """解码单个压缩块，最近使用的块缓存在内存中"""
+        key = (name, block)
+        with self._lock:
+            cached = self._blocks.get(key)
+            if cached is not None:
+                self._blocks.move_to_end(key)
+                return cached
+            spec = self._column_specs[name]
+            block_spec = spec['blocks'][block]
+            rows = min(self.block_rows, self.count - block * self.block_rows)
+            offset = self._data_start + block_spec['offset']
+            data = self._buffer()[offset:offset + block_spec['length']]
+            decoded = _decode_block(block_spec['codec'], data, rows, spec['dtype'])
+            self._blocks[key] = decoded
+            if len(self._blocks) > self._block_cache_size:
+                self._blocks.popitem(last=False)
+        return decoded
+    
+    def read(self, name: str, lo: int, hi: int) -> np.ndarray:
+        """读取列的 [lo, hi) 区间：未压缩列返回映射视图，压缩列只解码涉及的块"""
+        spec = self._column_specs.get(name)
+        if spec is None:
+            return np.full(max(hi - lo, 0), np.nan)
+        if not self.compressed:
+            return self.column(name)[lo:hi]
+        if hi <= lo:
+            return np.empty(0, dtype=spec['dtype'])
+        first, last = lo // self.block_rows, (hi - 1) // self.block_rows
+        parts = [self._block(name, block) for block in range(first, last + 1)]
+        merged = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        base = first * self.block_rows
+        return merged[lo - base:hi - base]
+    
+    def column(self, name: str) -> np.ndarray:
+        """返回整列数组，段内不存在的指标返回全 NaN 列"""
+        if self.compressed:
+            return self.read(name, 0, self.count)
+        array = self._arrays.get(name)
+        if array is None:
+            spec = self._column_specs.get(name)
+            if spec is None:
+                return np.full(self.count, np.nan)
+            with self._lock:
+                array = np.frombuffer(self._buffer(), dtype=spec['dtype'], count=self.count,
+                                      offset=spec['offset'])
+                self._arrays[name] = array
+        return array
+    
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.column('timestamp')
+    
+    def timestamp_range(self, lo: int, hi: int) -> np.ndarray:
+        return self.read('timestamp', lo, hi)
+    
+    @property
+    def metric_columns(self) -> List[str]:
+        return [name for name in self._column_specs if name not in ('timestamp', 'data_id')]
+    
+    def _search(self, timestamp: float, side: str) -> int:
+        """在时间戳列上二分查找；压缩段先用块索引定位块，只解码一个块"""
+        if not self.compressed:
+            return int(np.searchsorted(self.timestamps, timestamp, side))
+        if side == 'left':
+            block = bisect.bisect_left(self._block_last_ts, timestamp)
+        else:
+            block = bisect.bisect_right(self._block_first_ts, timestamp) - 1
+            if block < 0:
+                return 0
+            if timestamp >= self._block_last_ts[block]:
+                return min((block + 1) * self.block_rows, self.count)
+        if block >= len(self._block_last_ts):
+            return self.count
+        values = self._block('timestamp', block)
+        return block * self.block_rows + int(np.searchsorted(values, timestamp, side))
+    
+    def bounds(self, start_time: float, end_time: float) -> Tuple[int, int]:
+        """二分查找 [start_time, end_time] 在段内对应的下标区间"""
+        lo = 0 if start_time <= self.start else self._search(start_time, 'left')
+        hi = self.count if end_time >= self.end else self._search(end_time, 'right')
+        return lo, hi
+    
+    def metric_names(self, lo: int, hi: int) -> List[str]:
+        names = set(self.metric_columns)
+        for row, values in self.extras.items():
+            if lo <= row < hi:
+                names.update(values)
+        return sorted(names)
+    
+    def columns(self, lo: int, hi: int, names: List[str]) -> Dict[str, np.ndarray]:
+        """返回区间内的列数据（未压缩时不复制数据）"""
+        columns = {'timestamp': self.read('timestamp', lo, hi)}
+        for name in names:
+            columns[name] = self.read(name, lo, hi)
+        return columns
+    
+    def record(self, index: int) -> Dict:
+        """还原单条记录"""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("segment index out of range")
+        metrics = {}
+        for name in self.metric_columns:
+            value = self.read(name, index, index + 1)[0]
+            if not np.isnan(value):
+                metrics[name] = float(value)
+        metrics.update(self.extras.get(index, {}))
+        return {
+            'timestamp': float(self.read('timestamp', index, index + 1)[0]),
+            'metrics': metrics,
+            'data_id': int(self.read('data_id', index, index + 1)[0])
+        }
+    
+    def stored_bytes(self) -> int:
+        """返回段文件大小（字节）"""
+        return os.path.getsize(self.path)
+    
+    def close(self) -> None:
+        """释放内存映射；仍被外部数组引用时交由垃圾回收释放"""
+        with self._lock:
+            self._arrays.clear()
+            self._blocks.clear()
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    pass
+                self._mmap = None
+    
+    def acquire(self) -> None:
+        """检索视图引用该段"""
+        with self._lock:
+            self._refs += 1
+    
+    def release(self) -> None:
+        """检索视图释放该段；段已被移出存储且没有其他视图引用时关闭内存映射"""
+        with self._lock:
+            self._refs -= 1
+            done = self._retired and not self._refs
+        if done:
+            self.close()
+    
+    def retire(self) -> None:
+        """段被合并、解封或过期移出存储后删除段文件；仍有视图引用时先建立内存映射并推迟到最后一个视图释放时关闭，
+        已删除文件的映射仍然有效，视图可以继续读取"""
+        with self._lock:
+            self._retired = True
+            in_use = self._refs > 0
+            if in_use:
+                self._buffer()
+        if not in_use:
+            self.close()
+        os.remove(self.path)
+    
+    def __len__(self) -> int:
+        return self.count
+
+
+def _quantize(values: np.ndarray, decimals: int) -> Optional[np.ndarray]:
+    """把浮点块按小数位数量化为整数（NaN 记为 _QUANT_NAN）；含无穷值或超出 float64 精确整数范围时返回 None"""
+    scaled = np.round(values * 10.0 ** decimals)
+    missing = np.isnan(scaled)
+    present = scaled[~missing]
+    if not np.all(np.abs(present) < 2.0 ** 53):
+        return None
+    ints = np.where(missing, 0, scaled).astype(np.int64)
+    ints[missing] = _QUANT_NAN
+    return ints
+
+
+def _encode_block(name: str, values: np.ndarray, precision: Optional[int] = None) -> Tuple[str, bytes]:
+    """为单个块选择编码：时间戳用差值的差值，整数列用差值的差值，浮点列用 XOR；
+    配置 precision 时浮点指标按小数位数量化后用差值的差值（有损），压缩无收益时保留原始字节"""
+    quantized = _quantize(values, precision) if precision is not None and values.dtype.kind == 'f' else None
+    if name == 'timestamp':
+        codec, data = 'ts', gorilla_codec.encode_timestamps(values)
+    elif values.dtype.kind == 'i':
+        codec, data = 'dod', gorilla_codec.encode_ints(values)
+    elif quantized is not None:
+        codec, data = f'q{precision}', gorilla_codec.encode_ints(quantized)
+    else:
+        codec, data = 'xor', gorilla_codec.encode_floats(values)
+    raw = np.ascontiguousarray(values).tobytes()
+    return ('raw', raw) if len(data) >= len(raw) else (codec, data)
+
+
+def _decode_block(codec: str, data: bytes, rows: int, dtype: str) -> np.ndarray:
+    if codec == 'ts':
+        return gorilla_codec.decode_timestamps(data, rows)
+    if codec == 'dod':
+        return gorilla_codec.decode_ints(data, rows)
+    if codec == 'xor':
+        return gorilla_codec.decode_floats(data, rows)
+    if codec.startswith('q'):
+        ints = gorilla_codec.decode_ints(data, rows)
+        values = ints / 10.0 ** int(codec[1:])
+        values[ints == _QUANT_NAN] = np.nan
+        return values
+    return np.frombuffer(data, dtype=dtype, count=rows)
+
+
+def _write_compressed(f, header: Dict, specs: List[Dict], columns: Dict[str, np.ndarray], block_rows: int,
+                      precision: Optional[int] = None) -> None:
+    """按块压缩写入各列，块偏移相对于数据区起点，便于在写入数据前确定文件头"""
+    count = header['count']
+    timestamps = np.asarray(columns['timestamp'], dtype=np.float64)
+    starts = range(0, count, block_rows)
+    header['block_rows'] = block_rows
+    header['block_first_ts'] = [float(timestamps[i]) for i in starts]
+    header['block_last_ts'] = [float(timestamps[min(i + block_rows, count) - 1]) for i in starts]
+    payload = []
+    offset = 0
+    for spec in specs:
+        values = np.ascontiguousarray(columns[spec['name']], dtype=spec['dtype'])
+        spec['blocks'] = []
+        for i in starts:
+            codec, data = _encode_block(spec['name'], values[i:i + block_rows], precision)
+            spec['blocks'].append({'codec': codec, 'offset': offset, 'length': len(data)})
+            payload.append(data)
+            offset += len(data)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    f.write(_HEADER_PREFIX.pack(SEGMENT_MAGIC, len(header_bytes)))
+    f.write(header_bytes)
+    f.write(b'\0' * (_align(f.tell()) - f.tell()))
+    for data in payload:
+        f.write(data)
+
+
+def write_segment(path: str, start: float, end: float, columns: Dict[str, np.ndarray],
+                  extras: Optional[Dict[int, Dict]] = None, compression: Optional[str] = None,
+                  block_rows: int = 1024, replaces: Optional[List[str]] = None,
+                  precision: Optional[int] = None) -> None:
+    """将列数据写入段文件：先写临时文件再原子替换，保证段文件不可变且完整；
+    compression 为 gorilla 时各列按块压缩（precision 为浮点指标保留的小数位数），replaces 为本段合并替换的段文件名"""
+    count = len(columns['timestamp'])
+    names = ['timestamp', 'data_id'] + sorted(name for name in columns if name not in ('timestamp', 'data_id'))
+    specs = [{'name': name, 'dtype': '<i8' if name == 'data_id' else '<f8', 'offset': 0} for name in names]
+    header = {'start': start, 'end': end, 'count': count, 'columns': specs,
+              'extras': {str(k): v for k, v in (extras or {}).items()}}
+    if replaces:
+        header['replaces'] = replaces
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        if compression == 'gorilla' and count:
+            _write_compressed(f, header, specs, columns, block_rows, precision)
+        else:
+            # 文件头中包含各列偏移：为偏移数字预留空间后计算数据起点，再回填实际偏移
+            header_size = len(json.dumps(header, ensure_ascii=False).encode('utf-8')) + 20 * len(specs)
+            offset = _align(_HEADER_PREFIX.size + header_size)
+            for spec in specs:
+                spec['offset'] = offset
+                offset = _align(offset + count * 8)
+            header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            f.write(_HEADER_PREFIX.pack(SEGMENT_MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for spec in specs:
+                f.write(b'\0' * (spec['offset'] - f.tell()))
+                f.write(np.ascontiguousarray(columns[spec['name']], dtype=spec['dtype']).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _segment_to_columns(segment: TimeSegment) -> Tuple[Dict[str, np.ndarray], Dict[int, Dict]]:
+    """把内存段转换为列数据，非数值指标放入 extras"""
+    names = set()
+    extras: Dict[int, Dict] = {}
+    for row, record in enumerate(segment.records):
+        for name, value in record.get('metrics', {}).items():
+            if _is_numeric(value):
+                names.add(name)
+            else:
+                extras.setdefault(row, {})[name] = value
+    columns = segment.columns(0, len(segment), sorted(names))
+    columns['data_id'] = np.fromiter((record.get('data_id', 0) for record in segment.records),
+                                     dtype=np.int64, count=len(segment))
+    return columns, extras
+
+
+def _release_segments(segments: List[SealedSegment]) -> None:
+    for segment in segments:
+        segment.release()
+
+
+class HistoryView(abc.Sequence):
+    """时间范围检索结果的只读视图，由各时间段的下标区间组成，不复制记录；
+    视图存在期间引用的封存段不会被关闭，视图被回收或调用 close() 时释放"""
+    
+    def __init__(self, slices: List[Tuple[Any, int, int]]):
+        self._slices = slices
+        sealed = [segment for segment, _, _ in slices if segment.sealed]
+        for segment in sealed:
+            segment.acquire()
+        self._release = weakref.finalize(self, _release_segments, sealed)
+        self._offsets: List[int] = []
+        total = 0
+        for _, lo, hi in slices:
+            self._offsets.append(total)
+            total += hi - lo
+        self._length = total
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("HistoryView index out of range")
+        slot = bisect.bisect_right(self._offsets, index) - 1
+        segment, lo, _ = self._slices[slot]
+        return segment.records[lo + index - self._offsets[slot]]
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for segment, lo, hi in self._slices:
+            records = segment.records
+            for i in range(lo, hi):
+                yield records[i]
+    
+    def timestamps(self) -> np.ndarray:
+        """以 NumPy 数组返回区间内的时间戳"""
+        if not self._slices:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate([segment.timestamp_range(lo, hi) for segment, lo, hi in self._slices])
+    
+    def to_columns(self, metric_names: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """转换为列式结果：timestamp 列加各指标列，缺失值为 NaN"""
+        if metric_names is None:
+            names = set()
+            for segment, lo, hi in self._slices:
+                names.update(segment.metric_names(lo, hi))
+            metric_names = sorted(names)
+        parts = [segment.columns(lo, hi, metric_names) for segment, lo, hi in self._slices]
+        if len(parts) == 1:
+            return parts[0]
+        columns = {'timestamp': self.timestamps()}
+        for name in metric_names:
+            columns[name] = (np.concatenate([part[name] for part in parts]) if parts
+                             else np.empty(0, dtype=np.float64))
+        return columns
+    
+    def close(self) -> None:
+        """提前释放引用的封存段"""
+        self._release()
+    
+    def __enter__(self) -> 'HistoryView':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class SegmentStore:
+    """按固定时长（默认 1 小时）划分的分段存储，写入 O(1)，过期数据按整段删除；
+    配置 data_dir 时活跃段写入预写日志，过了封存延迟的段封存为内存映射的列式文件"""
+    
+    def __init__(self, segment_seconds: int = 3600, retention_seconds: float = 7 * 86400,
+                 data_dir: Optional[str] = None, seal_delay_seconds: float = 300,
+                 compression: Optional[str] = None, block_rows: int = 1024, precision: Optional[int] = None):
+        """初始化分段存储，data_dir 存在时从磁盘恢复已封存段和预写日志；
+        compression 为 gorilla 时封存段按块压缩，precision 不为 None 时浮点指标量化到该小数位数后压缩（有损）"""
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.data_dir = data_dir
+        self.seal_delay_seconds = seal_delay_seconds
+        self.compression = compression
+        self.block_rows = block_rows
+        self.precision = precision
+        self.segments: Dict[int, Union[TimeSegment, SealedSegment]] = {}
+        self._segment_ids: List[int] = []  # 升序排列的时间段编号
+        self._active_ids: set = set()
+        self._watermark = float('-inf')  # 已写入记录的最大时间戳
+        self._count = 0
+        self._lock = threading.RLock()
+        self._wal = None
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            self._recover()
+    
+    def _recover(self) -> None:
+        """加载已封存段的文件头并重放预写日志中的活跃记录"""
+        loaded: List[SealedSegment] = []
+        for name in sorted(os.listdir(self.data_dir)):
+            if name.endswith(SEGMENT_SUFFIX + '.tmp'):
+                os.remove(os.path.join(self.data_dir, name))
+            elif name.endswith(SEGMENT_SUFFIX):
+                loaded.append(SealedSegment(os.path.join(self.data_dir, name)))
+        replaced = {name for segment in loaded for name in segment.replaces}
+        sealed = 0
+        for segment in loaded:
+            if os.path.basename(segment.path) in replaced:
+                # 合并段写入后、旧段删除前崩溃遗留的旧段，数据已在合并段中
+                segment.close()
+                os.remove(segment.path)
+                logger.info("删除已被合并段替换的旧段: %s", segment.path)
+                continue
+            self._add_segment(int(segment.start // self.segment_seconds), segment)
+            self._count += segment.count
+            sealed += 1
+        wal_path = os.path.join(self.data_dir, WAL_FILE)
+        replayed = 0
+        if os.path.exists(wal_path):
+            with open(wal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # 崩溃时未写完的最后一行
+                    covering = self._covering_segment(record['timestamp'])
+                    if covering is not None and covering.sealed:
+                        continue  # 封存完成但日志尚未重写，记录已在段文件中
+                    self._append_in_memory(record)
+                    replayed += 1
+        self._wal = open(wal_path, 'a', encoding='utf-8')
+        logger.info("历史数据已从磁盘恢复，封存段: %d，重放活跃记录: %d", sealed, replayed)
+    
+    def _add_segment(self, segment_id: int, segment: Union[TimeSegment, SealedSegment]) -> None:
+        self.segments[segment_id] = segment
+        if not self._segment_ids or segment_id > self._segment_ids[-1]:
+            self._segment_ids.append(segment_id)
+        else:
+            # 乱序到达的旧数据才需要有序插入
+            bisect.insort(self._segment_ids, segment_id)
+    
+    def _covering_segment(self, timestamp: float) -> Optional[Union[TimeSegment, SealedSegment]]:
+        """返回覆盖时间戳的段（压缩合并后的封存段可能覆盖多个时间段编号）"""
+        segment = self.segments.get(int(timestamp // self.segment_seconds))
+        if segment is None:
+            index = bisect.bisect_right(self._segment_ids, int(timestamp // self.segment_seconds)) - 1
+            if index >= 0 and self.segments[self._segment_ids[index]].end > timestamp:
+                segment = self.segments[self._segment_ids[index]]
+        return segment
+    
+    def _segment_for(self, timestamp: float) -> TimeSegment:
+        """返回时间戳所属的内存段，不存在时创建；落入已封存段时将其解封回内存"""
+        segment = self._covering_segment(timestamp)
+        if segment is None:
+            segment_id = int(timestamp // self.segment_seconds)
+            start = segment_id * self.segment_seconds
+            segment = TimeSegment(start, start + self.segment_seconds)
+            self._add_segment(segment_id, segment)
+            self._active_ids.add(segment_id)
+        elif segment.sealed:
+            segment = self._unseal(segment)
+        return segment
+    
+    def _unseal(self, sealed: SealedSegment) -> TimeSegment:
+        """迟到数据写入已封存段时，把该段还原为内存段，下次封存时重写文件"""
+        segment_id = int(sealed.start // self.segment_seconds)
+        segment = TimeSegment(sealed.start, sealed.end)
+        for record in sealed.records:
+            segment.append(record)
+            self._write_wal(record)
+        self.segments[segment_id] = segment
+        self._active_ids.add(segment_id)
+        sealed.retire()
+        logger.info("迟到数据写入已封存段，段已解封: %s", sealed.path)
+        return segment
+    
+    def _append_in_memory(self, record: Dict) -> None:
+        self._segment_for(record['timestamp']).append(record)
+        self._count += 1
+        if record['timestamp'] > self._watermark:
+            self._watermark = record['timestamp']
+    
+    def _write_wal(self, record: Dict) -> None:
+        if self._wal is not None:
+            self._wal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._wal.flush()
+    
+    def append(self, record: Dict) -> None:
+        """追加一条带 timestamp 字段的记录"""
+        with self._lock:
+            self._append_in_memory(record)
+            self._write_wal(record)
+    
+    def _segment_file_name(self, start: float, end: float) -> str:
+        first, last = int(start // self.segment_seconds), int(end // self.segment_seconds)
+        return f"seg_{first:012d}_{last:012d}{SEGMENT_SUFFIX}"
+    
+    def seal(self, now: float) -> int:
+        """把结束时间早于 now - seal_delay_seconds 的活跃段封存为列式文件，返回封存段数；
+        截止时间同时受已写入数据的最大时间戳限制，回填历史数据时不会反复封存又解封同一段"""
+        if not self.data_dir:
+            return 0
+        cutoff = min(now, self._watermark) - self.seal_delay_seconds
+        with self._lock:
+            ready = sorted(sid for sid in self._active_ids if self.segments[sid].end <= cutoff)
+            if not ready:
+                return 0
+            for segment_id in ready:
+                segment = self.segments[segment_id]
+                path = os.path.join(self.data_dir, self._segment_file_name(segment.start, segment.end))
+                columns, extras = _segment_to_columns(segment)
+                write_segment(path, segment.start, segment.end, columns, extras,
+                              compression=self.compression, block_rows=self.block_rows,
+                              precision=self.precision)
+                self.segments[segment_id] = SealedSegment(path)
+                self._active_ids.discard(segment_id)
+            self._rewrite_wal()
+        logger.info("封存历史数据段: %d", len(ready))
+        return len(ready)
+    
+    def _rewrite_wal(self) -> None:
+        """只保留仍处于活跃段中的记录，使预写日志大小与活跃数据量成正比"""
+        wal_path = os.path.join(self.data_dir, WAL_FILE)
+        tmp_path = wal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for segment_id in sorted(self._active_ids):
+                for record in self.segments[segment_id].records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._wal is not None:
+            self._wal.close()
+        os.replace(tmp_path, wal_path)
+        self._wal = open(wal_path, 'a', encoding='utf-8')
+    
+    def compact(self, max_span_seconds: float = 86400) -> int:
+        """把同一对齐窗口（默认 1 天）内首尾相接的封存段合并为一个文件，返回合并掉的段数"""
+        if not self.data_dir:
+            return 0
+        with self._lock:
+            groups: List[List[int]] = []
+            for segment_id in self._segment_ids:
+                segment = self.segments[segment_id]
+                if not segment.sealed:
+                    continue
+                previous = self.segments[groups[-1][-1]] if groups else None
+                if (previous is not None and previous.sealed and previous.end == segment.start
+                        and int(previous.start // max_span_seconds) == int(segment.start // max_span_seconds)):
+                    groups[-1].append(segment_id)
+                else:
+                    groups.append([segment_id])
+            candidates = [(group, [self.segments[sid] for sid in group]) for group in groups if len(group) > 1]
+        
+        merged = 0
+        for group, parts in candidates:
+            # 合并在锁外完成：封存段不可变，读取方不受影响
+            names = sorted({name for part in parts for name in part.metric_columns})
+            columns = {
+                'timestamp': np.concatenate([part.timestamps for part in parts]),
+                'data_id': np.concatenate([part.column('data_id') for part in parts])
+            }
+            for name in names:
+                columns[name] = np.concatenate([part.column(name) for part in parts])
+            extras: Dict[int, Dict] = {}
+            offset = 0
+            for part in parts:
+                for row, values in part.extras.items():
+                    extras[offset + row] = values
+                offset += part.count
+            path = os.path.join(self.data_dir, self._segment_file_name(parts[0].start, parts[-1].end))
+            write_segment(path, parts[0].start, parts[-1].end, columns, extras,
+                          compression=self.compression, block_rows=self.block_rows, precision=self.precision,
+                          replaces=[os.path.basename(part.path) for part in parts])
+            with self._lock:
+                if any(self.segments.get(sid) is not part for sid, part in zip(group, parts)):
+                    # 合并期间有段被解封或删除，放弃本次合并
+                    os.remove(path)
+                    continue
+                self.segments[group[0]] = SealedSegment(path)
+                for sid in group[1:]:
+                    del self.segments[sid]
+                    self._segment_ids.remove(sid)
+            for part in parts:
+                part.retire()
+            merged += len(group) - 1
+        if merged:
+            logger.info("压缩历史数据段，合并段数: %d", merged)
+        return merged
+    
+    def expire(self, now: float) -> int:
+        """删除结束时间早于保留窗口的整段数据，返回删除的记录数"""
+        cutoff = now - self.retention_seconds
+        removed = 0
+        with self._lock:
+            dropped_active = False
+            while self._segment_ids and self.segments[self._segment_ids[0]].end <= cutoff:
+                segment_id = self._segment_ids.pop(0)
+                segment = self.segments.pop(segment_id)
+                removed += len(segment)
+                if segment.sealed:
+                    segment.retire()
+                elif segment_id in self._active_ids:
+                    self._active_ids.discard(segment_id)
+                    dropped_active = True
+            if dropped_active and self._wal is not None:
+                self._rewrite_wal()
+            self._count -= removed
+        if removed:
+            logger.info("删除过期历史数据段，记录数: %d", removed)
+        return removed
+    
+    def range(self, start_time: float, end_time: float) -> HistoryView:
+        """二分定位与 [start_time, end_time] 相交的时间段及段内区间，复杂度 O(log n + k)"""
+        slices: List[Tuple[Any, int, int]] = []
+        if end_time < start_time:
+            return HistoryView(slices)
+        with self._lock:
+            first = bisect.bisect_right(self._segment_ids, int(start_time // self.segment_seconds)) - 1
+            for segment_id in self._segment_ids[max(first, 0):]:
+                segment = self.segments[segment_id]
+                if segment.start > end_time:
+                    break
+                if segment.end <= start_time:
+                    continue
+                lo, hi = segment.bounds(start_time, end_time)
+                if hi > lo:
+                    slices.append((segment, lo, hi))
+            # 在锁内创建视图，引用的封存段在视图释放前不会被合并或过期关闭
+            return HistoryView(slices)
+    
+    def count(self, start_time: float, end_time: float) -> int:
+        """返回 [start_time, end_time] 内的记录数"""
+        return len(self.range(start_time, end_time))
+    
+    def records_after(self, timestamp: float) -> Iterator[Dict]:
+        """返回活跃段中时间戳大于 timestamp 的记录（封存段已由快照覆盖，不再读取）"""
+        for segment in self.iter_segments():
+            if not segment.sealed:
+                for record in segment.records:
+                    if record['timestamp'] > timestamp:
+                        yield record
+    
+    def storage_stats(self) -> Dict[str, int]:
+        """返回封存段的记录数与磁盘占用"""
+        with self._lock:
+            sealed = [segment for segment in self.segments.values() if segment.sealed]
+        return {
+            'sealed_segments': len(sealed),
+            'sealed_records': sum(segment.count for segment in sealed),
+            'sealed_bytes': sum(segment.stored_bytes() for segment in sealed)
+        }
+    
+    def iter_segments(self) -> Iterator[Union[TimeSegment, SealedSegment]]:
+        """按时间顺序遍历所有时间段"""
+        for segment_id in list(self._segment_ids):
+            yield self.segments[segment_id]
+    
+    def close(self) -> None:
+        """关闭预写日志和所有内存映射"""
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+            for segment in self.segments.values():
+                if segment.sealed:
+                    segment.close()
+    
+    def __len__(self) -> int:
+        return self._count
@@ -0,0 +1,308 @@
+# 刀 AI 数据库扩展技术 - 分片查询路由器
+# 本脚本实现分片感知的查询路由层，支持哈希/范围分片映射、跨分片并行查询和读写分离。
+# 注意：演示版以本地 SQLite 文件作为分片，便于在单机上验证路由逻辑。
+
+import re
+import bisect
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 读查询的首关键字，可路由到只读副本
+_READ_KEYWORDS = {'SELECT', 'WITH', 'EXPLAIN', 'PRAGMA'}
+# 没有分片键时可以广播到全部分片的 DDL 语句首关键字
+_DDL_KEYWORDS = {'CREATE', 'DROP', 'ALTER'}
+# WITH 语句中的数据修改关键字（WITH ... INSERT/UPDATE/DELETE 是写语句）
+_DML_PATTERN = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+# 每个分片向合并队列推送的批大小
+_STREAM_BATCH_SIZE = 256
+_END_OF_SHARD = object()
+
+
+class Shard:
+    """单个分片：一个主库和若干只读副本"""
+    
+    def __init__(self, name: str, primary: str, replicas: Optional[List[str]] = None):
+        """初始化分片，primary/replicas 为 SQLite 数据库文件路径"""
+        self.name = name
+        self.primary = primary
+        self.replicas: List[str] = list(replicas or [])
+        self._next_replica = 0
+        self._lock = threading.Lock()
+    
+    def pick_target(self, is_read: bool) -> str:
+        """选择执行目标：读查询轮询副本，写查询或无副本时使用主库"""
+        if not is_read or not self.replicas:
+            return self.primary
+        with self._lock:
+            target = self.replicas[self._next_replica % len(self.replicas)]
+            self._next_replica += 1
+        return target
+
+
+class HashShardMap:
+    """哈希分片映射：使用稳定的 CRC32 将分片键映射到分片"""
+    
+    def __init__(self, shard_names: List[str]):
+        self.shard_names = list(shard_names)
+    
+    def locate(self, key: Any) -> str:
+        """返回分片键所在的分片名称"""
+        digest = zlib.crc32(str(key).encode('utf-8'))
+        return self.shard_names[digest % len(self.shard_names)]
+
+
+class RangeShardMap:
+    """范围分片映射：按上界（不含）升序划分键空间，最后一个分片无上界"""
+    
+    def __init__(self, ranges: List[Tuple[Any, str]], last_shard: str):
+        """ranges 为 (upper_bound, shard_name) 列表"""
+        ordered = sorted(ranges, key=lambda item: item[0])
+        self.upper_bounds = [bound for bound, _ in ordered]
+        self.shard_names = [name for _, name in ordered] + [last_shard]
+    
+    def locate(self, key: Any) -> str:
+        """二分查找分片键所在的范围"""
+        return self.shard_names[bisect.bisect_right(self.upper_bounds, key)]
+
+
+class ShardStats:
+    """分片延迟统计：调用次数、错误数、平均/指数滑动平均/最大延迟"""
+    
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.ewma = 0.0
+        self.max_time = 0.0
+    
+    def record(self, elapsed: float, success: bool) -> None:
+        """记录一次分片调用"""
+        self.count += 1
+        self.total_time += elapsed
+        self.ewma = elapsed if self.count == 1 else self.alpha * elapsed + (1 - self.alpha) * self.ewma
+        self.max_time = max(self.max_time, elapsed)
+        if not success:
+            self.errors += 1
+    
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_latency': self.total_time / self.count if self.count else 0.0,
+            'ewma_latency': self.ewma,
+            'max_latency': self.max_time
+        }
+
+
+class ShardRouter:
+    """分片查询路由器：单键查询路由到单个分片，跨分片查询并行分发并流式合并结果"""
+    
+    def __init__(self, shards: List[Shard], shard_map: Any, key_column: Optional[str] = None,
+                 max_workers: Optional[int] = None):
+        """初始化路由器，key_column 指定从查询参数中提取分片键的字段名"""
+        self.shards: Dict[str, Shard] = {shard.name: shard for shard in shards}
+        self.shard_map = shard_map
+        self.key_column = key_column
+        self.shard_stats: Dict[str, ShardStats] = {name: ShardStats() for name in self.shards}
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(len(shards), 1) * 2,
+                                            thread_name_prefix='shard_router')
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        logger.info("分片路由器已初始化，分片数: %d", len(self.shards))
+    
+    @classmethod
+    def from_config(cls, sharding_config: Dict) -> 'ShardRouter':
+        """根据 database.sharding 配置创建路由器"""
+        shard_configs = sharding_config.get('shards', [])
+        if not shard_configs:
+            raise ValueError("分片配置为空")
+        shards = [Shard(s['name'], s['path'], s.get('replicas', [])) for s in shard_configs]
+        strategy = sharding_config.get('strategy', 'hash')
+        if strategy == 'hash':
+            shard_map = HashShardMap([s.name for s in shards])
+        elif strategy == 'range':
+            ranges = [(s['upper_bound'], s['name']) for s in shard_configs[:-1]]
+            shard_map = RangeShardMap(ranges, shard_configs[-1]['name'])
+        else:
+            raise ValueError(f"不支持的分片策略: {strategy}")
+        return cls(shards, shard_map, key_column=sharding_config.get('key_column'),
+                   max_workers=sharding_config.get('max_workers'))
+    
+    def _connection(self, target: str) -> sqlite3.Connection:
+        """获取当前线程到目标数据库的连接（线程内复用）"""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        conn = connections.get(target)
+        if conn is None:
+            conn = sqlite3.connect(target, check_same_thread=False)
+            connections[target] = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def _record(self, shard_name: str, elapsed: float, success: bool) -> None:
+        with self._stats_lock:
+            self.shard_stats[shard_name].record(elapsed, success)
+    
+    def resolve_shard_key(self, params: Optional[Any], shard_key: Any = None) -> Any:
+        """确定分片键：优先使用显式传入的键，其次从参数字典的 key_column 字段提取"""
+        if shard_key is not None:
+            return shard_key
+        if self.key_column and isinstance(params, dict):
+            return params.get(self.key_column)
+        return None
+    
+    def route(self, query: str, params: Optional[Any] = None, shard_key: Any = None) -> List[str]:
+        """返回查询需要访问的分片名称列表；有多个分片且没有分片键时只有读查询和 DDL 广播到全部分片，
+        其他写语句抛出 ValueError，避免同一行被写入每个分片"""
+        key = self.resolve_shard_key(params, shard_key)
+        if key is not None:
+            return [self.shard_map.locate(key)]
+        parts = query.lstrip().split(None, 1)
+        if len(self.shards) == 1 or self._is_read(query) or (parts and parts[0].upper() in _DDL_KEYWORDS):
+            return list(self.shards)
+        raise ValueError(f"写语句缺少分片键，无法路由: {query}")
+    
+    @staticmethod
+    def _is_read(query: str) -> bool:
+        parts = query.lstrip().split(None, 1)
+        if not parts or parts[0].upper() not in _READ_KEYWORDS:
+            return False
+        return parts[0].upper() != 'WITH' or not _DML_PATTERN.search(query)
+    
+    @staticmethod
+    def _offer(sink: "queue.Queue", item: Tuple, cancelled: threading.Event) -> bool:
+        """向合并队列推送数据，队列满时等待；消费方取消后放弃推送"""
+        while not cancelled.is_set():
+            try:
+                sink.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run_on_shard(self, shard_name: str, query: str, params: Optional[Any], is_read: bool,
+                      sink: Optional["queue.Queue"] = None,
+                      cancelled: Optional[threading.Event] = None) -> Dict:
+        """在单个分片上执行查询；提供 sink 时按批推送结果行"""
+        shard = self.shards[shard_name]
+        target = shard.pick_target(is_read)
+        start = time.perf_counter()
+        rows: List[Dict] = []
+        rows_affected = 0
+        success, error = False, None
+        try:
+            conn = self._connection(target)
+            cursor = conn.execute(query, params if params is not None else ())
+            if cursor.description is not None:
+                columns = [col[0] for col in cursor.description]
+                while True:
+                    batch = cursor.fetchmany(_STREAM_BATCH_SIZE)
+                    if not batch:
+                        break
+                    dict_rows = [dict(zip(columns, row)) for row in batch]
+                    rows_affected += len(dict_rows)
+                    if sink is not None:
+                        if not self._offer(sink, (shard_name, dict_rows), cancelled):
+                            break
+                    else:
+                        rows.extend(dict_rows)
+            else:
+                rows_affected = max(cursor.rowcount, 0)
+            if not is_read:
+                conn.commit()
+            success, error = True, None
+        except Exception as e:
+            logger.error("分片 %s 查询失败: %s", shard_name, str(e))
+            error = str(e)
+        finally:
+            # 无论成功与否都推送结束标记，否则合并方会一直等待该分片
+            if sink is not None:
+                self._offer(sink, (shard_name, _END_OF_SHARD), cancelled)
+        elapsed = time.perf_counter() - start
+        self._record(shard_name, elapsed, success)
+        return {'shard': shard_name, 'success': success, 'error': error, 'execution_time': elapsed,
+                'rows_affected': rows_affected, 'data': rows}
+    
+    def stream_query(self, query: str, params: Optional[Any] = None, shard_key: Any = None,
+                     max_buffered_batches: int = 64) -> Iterator[Dict]:
+        """并行查询目标分片，按到达顺序流式产出结果行（每行附带 _shard 字段）"""
+        shard_names = self.route(query, params, shard_key)
+        is_read = self._is_read(query)
+        sink: "queue.Queue" = queue.Queue(maxsize=max_buffered_batches)
+        cancelled = threading.Event()
+        futures = [self._executor.submit(self._run_on_shard, name, query, params, is_read, sink, cancelled)
+                   for name in shard_names]
+        pending = len(futures)
+        try:
+            while pending:
+                shard_name, batch = sink.get()
+                if batch is _END_OF_SHARD:
+                    pending -= 1
+                    continue
+                for row in batch:
+                    row['_shard'] = shard_name
+                    yield row
+        finally:
+            # 消费方提前停止迭代时通知各分片停止推送，避免工作线程阻塞在满队列上
+            cancelled.set()
+        for future in futures:
+            shard_result = future.result()
+            if not shard_result['success']:
+                raise RuntimeError(f"分片 {shard_result['shard']} 查询失败: {shard_result['error']}")
+    
+    def execute(self, query: str, params: Optional[Any] = None, shard_key: Any = None) -> Dict:
+        """执行查询并返回与 DatabaseConnector.execute_query 相同结构的结果"""
+        shard_names = self.route(query, params, shard_key)
+        is_read = self._is_read(query)
+        start = time.perf_counter()
+        if len(shard_names) == 1:
+            shard_results = [self._run_on_shard(shard_names[0], query, params, is_read)]
+        else:
+            futures = [self._executor.submit(self._run_on_shard, name, query, params, is_read)
+                       for name in shard_names]
+            shard_results = [future.result() for future in futures]
+        
+        data: List[Dict] = []
+        for shard_result in shard_results:
+            data.extend(shard_result['data'])
+        errors = {r['shard']: r['error'] for r in shard_results if not r['success']}
+        result = {
+            'success': not errors,
+            'execution_time': time.perf_counter() - start,
+            'rows_affected': sum(r['rows_affected'] for r in shard_results),
+            'data': data,
+            'shards': shard_names
+        }
+        if errors:
+            result['errors'] = errors
+        logger.debug("分片查询完成，分片: %s，行数: %d", shard_names, result['rows_affected'])
+        return result
+    
+    def get_shard_stats(self) -> Dict[str, Dict[str, float]]:
+        """返回各分片的延迟统计"""
+        with self._stats_lock:
+            return {name: stats.to_dict() for name, stats in self.shard_stats.items()}
+    
+    def close(self) -> None:
+        """关闭线程池和所有分片连接"""
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        logger.info("分片路由器已关闭")
@@ -0,0 +1,393 @@
+# 刀 AI 数据库扩展技术 - 知识库 SQLite 存储引擎
+# 本脚本为知识库提供嵌入式 SQLite 存储：WAL 模式，写入由专用写线程按组提交（group commit），
+# 调用方只需把语句放入队列，不会阻塞在事务提交和 fsync 上；读取使用各线程独立的只读连接，
+# 只读取已提交的数据而不等待组提交；组提交失败时逐条重试，仍失败的写入记录日志并通知调用方。
+
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from typing import Dict, List, Any, Callable, Iterator, Optional, Tuple
+
+from segment_store import HistoryView, TimeSegment
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS historical_data (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    data_id INTEGER,
+    metrics TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_historical_data_timestamp ON historical_data (timestamp);
+
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (name, version)
+);
+CREATE INDEX IF NOT EXISTS idx_models_stored_at ON models (stored_at);
+
+CREATE TABLE IF NOT EXISTS model_blobs (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (name, version)
+);
+
+CREATE TABLE IF NOT EXISTS optimization_results (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    action TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_optimization_results_timestamp ON optimization_results (timestamp);
+CREATE INDEX IF NOT EXISTS idx_optimization_results_action ON optimization_results (action);
+
+CREATE TABLE IF NOT EXISTS kb_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_INSERT_HISTORY = "INSERT INTO historical_data (timestamp, data_id, metrics) VALUES (?, ?, ?)"
+_STOP = object()
+
+
+class SQLiteBackend:
+    """SQLite 存储引擎：单写线程组提交，多线程并发读"""
+
+    def __init__(self, path: str, group_commit_ms: float = 5, max_batch: int = 5000,
+                 queue_size: int = 100000, synchronous: str = 'NORMAL'):
+        """group_commit_ms 为一个事务等待后续写入的最长时间，max_batch 为单个事务的最大语句数"""
+        self.path = path
+        self.group_commit_seconds = group_commit_ms / 1000.0
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self.commits = 0
+        self.committed_statements = 0
+        self.failed_statements = 0
+
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        conn.close()
+        self._writer = threading.Thread(target=self._writer_loop, name='kb_sqlite_writer', daemon=True)
+        self._writer.start()
+        logger.info("SQLite 存储引擎已启动: %s，组提交等待: %.1f 毫秒", path, group_commit_ms)
+
+    # ---- 写入 ----
+
+    def submit(self, sql: str, params: Tuple = (), callback: Optional[Callable[[int], None]] = None,
+               errback: Optional[Callable[[Exception], None]] = None) -> None:
+        """把写语句放入写队列；callback 在提交后以影响行数调用，errback 在语句最终写入失败时以异常调用。
+        队列满时阻塞以形成背压"""
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put((sql, params, callback, errback))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前提交的写入全部落盘；没有待写入数据时立即返回"""
+        with self._pending_lock:
+            if not self._pending:
+                return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _collect_batch(self, first: Any) -> List[Any]:
+        """以第一条语句为起点收集一批写入：先取走队列中已有的，再在组提交窗口内等待后续写入"""
+        batch = [first]
+        deadline = time.monotonic() + self.group_commit_seconds
+        while len(batch) < self.max_batch and not isinstance(batch[-1], threading.Event) and batch[-1] is not _STOP:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            batch.append(item)
+        return batch
+
+    def _execute_batch(self, conn: sqlite3.Connection, statements: List[Tuple]) -> List[Tuple[Callable[[int], None], int]]:
+        """在一个事务中执行一批语句并提交，返回待调用的 (callback, 影响行数)"""
+        callbacks: List[Tuple[Callable[[int], None], int]] = []
+        i = 0
+        while i < len(statements):
+            sql, params, callback, _ = statements[i]
+            if callback is not None:
+                callbacks.append((callback, conn.execute(sql, params).rowcount))
+                i += 1
+                continue
+            # 连续的同一语句合并为 executemany
+            j = i + 1
+            while j < len(statements) and statements[j][0] == sql and statements[j][2] is None:
+                j += 1
+            conn.executemany(sql, [item[1] for item in statements[i:j]])
+            i = j
+        conn.commit()
+        self.commits += 1
+        self.committed_statements += len(statements)
+        return callbacks
+
+    def _retry_individually(self, conn: sqlite3.Connection,
+                            statements: List[Tuple]) -> List[Tuple[Callable[[int], None], int]]:
+        """组提交失败后逐条重试，每条语句单独提交；仍然失败的语句记录日志并通过 errback 通知调用方"""
+        callbacks: List[Tuple[Callable[[int], None], int]] = []
+        for statement in statements:
+            try:
+                callbacks.extend(self._execute_batch(conn, [statement]))
+            except Exception as e:
+                conn.rollback()
+                self.failed_statements += 1
+                logger.error("SQLite 写入失败: %s，参数: %r，错误: %s", statement[0], statement[1], str(e))
+                errback = statement[3]
+                if errback is not None:
+                    try:
+                        errback(e)
+                    except Exception as callback_error:
+                        logger.error("SQLite 写入失败回调出错: %s", str(callback_error))
+        return callbacks
+
+    def _writer_loop(self) -> None:
+        conn = sqlite3.connect(self.path)
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        stopping = False
+        while not stopping:
+            batch = self._collect_batch(self._queue.get())
+            statements = [item for item in batch if isinstance(item, tuple)]
+            waiters = [item for item in batch if isinstance(item, threading.Event)]
+            stopping = batch[-1] is _STOP
+            # 参数错误等非 SQLite 异常同样按失败处理，写线程不能退出，否则 flush 和等待写入的调用方会永远阻塞
+            try:
+                try:
+                    callbacks = self._execute_batch(conn, statements)
+                except Exception as e:
+                    conn.rollback()
+                    logger.warning("SQLite 组提交失败，逐条重试 %d 条写入: %s", len(statements), str(e))
+                    callbacks = self._retry_individually(conn, statements)
+                for callback, rowcount in callbacks:
+                    try:
+                        callback(rowcount)
+                    except Exception as e:
+                        logger.error("SQLite 写入回调出错: %s", str(e))
+            except Exception as e:
+                logger.error("SQLite 写线程处理批次出错: %s", str(e))
+            finally:
+                with self._pending_lock:
+                    self._pending -= len(statements)
+                for waiter in waiters:
+                    waiter.set()
+        conn.close()
+
+    # ---- 读取 ----
+
+    def _reader(self) -> sqlite3.Connection:
+        """获取当前线程的读连接（线程内复用），WAL 模式下读写互不阻塞"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def query(self, sql: str, params: Tuple = (), consistent: bool = False) -> List[Tuple]:
+        """执行读查询，读到的是已提交的数据，不等待组提交；consistent 为真时先等待未提交的写入，保证读到自己的写入"""
+        if consistent:
+            self.flush()
+        return self._reader().execute(sql, params).fetchall()
+
+    def iter_query(self, sql: str, params: Tuple = (), batch_size: int = 1024,
+                   consistent: bool = False) -> Iterator[Tuple]:
+        if consistent:
+            self.flush()
+        cursor = self._reader().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    # ---- 模型注册表 ----
+
+    def insert_model(self, record: Dict) -> None:
+        self.submit("INSERT OR REPLACE INTO models (name, version, stored_at, record) VALUES (?, ?, ?, ?)",
+                    (record['name'], record['version'], record['stored_at'], json.dumps(record, ensure_ascii=False)))
+
+    def delete_model(self, name: str, version: int) -> None:
+        self.submit("DELETE FROM models WHERE name = ? AND version = ?", (name, version))
+        self.submit("DELETE FROM model_blobs WHERE name = ? AND version = ?", (name, version))
+
+    def load_models(self) -> Iterator[Dict]:
+        """按模型名和版本顺序返回全部模型记录"""
+        for (record,) in self.iter_query("SELECT record FROM models ORDER BY name, version"):
+            yield json.loads(record)
+
+    def put_model_blob(self, name: str, version: int, data: bytes) -> None:
+        self.submit("INSERT OR REPLACE INTO model_blobs (name, version, data) VALUES (?, ?, ?)",
+                    (name, version, sqlite3.Binary(data)))
+
+    def load_model_blob(self, name: str, version: int) -> Optional[bytes]:
+        # 注册后立即读取的版本可能仍在写队列中，需要等待写入以免误判为已回收
+        rows = self.query("SELECT data FROM model_blobs WHERE name = ? AND version = ?", (name, version),
+                          consistent=True)
+        return bytes(rows[0][0]) if rows else None
+
+    # ---- 优化结果与元数据 ----
+
+    def insert_optimization_result(self, record: Dict) -> None:
+        self.submit("INSERT INTO optimization_results (timestamp, action, record) VALUES (?, ?, ?)",
+                    (record['timestamp'], record['action'], json.dumps(record, ensure_ascii=False)))
+
+    def iter_optimization_results(self) -> Iterator[Dict]:
+        for (record,) in self.iter_query("SELECT record FROM optimization_results ORDER BY id"):
+            yield json.loads(record)
+
+    def put_meta(self, key: str, value: str) -> None:
+        self.submit("INSERT OR REPLACE INTO kb_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self.query("SELECT value FROM kb_meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def stats(self) -> Dict[str, float]:
+        """返回组提交统计"""
+        return {
+            'commits': self.commits,
+            'committed_statements': self.committed_statements,
+            'failed_statements': self.failed_statements,
+            'avg_batch_size': self.committed_statements / self.commits if self.commits else 0.0,
+            'queued': self._queue.qsize()
+        }
+
+    def close(self) -> None:
+        """写完队列中的剩余数据后停止写线程并关闭所有连接"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        logger.info("SQLite 存储引擎已关闭: %s", self.path)
+
+
+class SQLiteHistoryStore:
+    """基于 SQLiteBackend 的历史数据存储，接口与 SegmentStore 一致"""
+
+    def __init__(self, backend: SQLiteBackend, retention_seconds: float = 7 * 86400,
+                 expire_interval: float = 60, segment_seconds: int = 3600, seal_delay_seconds: float = 300):
+        """expire_interval 为两次过期清理之间的最短间隔（秒），避免每次写入都发出删除语句；
+        segment_seconds 和 seal_delay_seconds 与分段存储的封存节奏一致，用于决定何时保存汇总快照"""
+        self.backend = backend
+        self.retention_seconds = retention_seconds
+        self.expire_interval = expire_interval
+        self.segment_seconds = segment_seconds
+        self.seal_delay_seconds = seal_delay_seconds
+        self._sealed_period = self._period(time.time())
+        self._last_expire = -math.inf
+        self._count_lock = threading.Lock()
+        self._count = backend.query("SELECT COUNT(*) FROM historical_data")[0][0]
+
+    def append(self, record: Dict) -> None:
+        self.backend.submit(_INSERT_HISTORY, (record['timestamp'], record.get('data_id'),
+                                              json.dumps(record.get('metrics', {}), ensure_ascii=False)),
+                            errback=self._on_insert_failed)
+        with self._count_lock:
+            self._count += 1
+
+    def _on_insert_failed(self, error: Exception) -> None:
+        with self._count_lock:
+            self._count -= 1
+
+    def _period(self, now: float) -> int:
+        return int((now - self.seal_delay_seconds) // self.segment_seconds)
+
+    def seal(self, now: float) -> int:
+        """SQLite 已负责持久化，无需封存；与分段存储一样每过一个时间段（加封存延迟）返回 1，
+        调用方据此保存汇总快照，崩溃后只需从快照水位之后重放"""
+        period = self._period(now)
+        if period <= self._sealed_period:
+            return 0
+        self._sealed_period = period
+        return 1
+
+    def compact(self, max_span_seconds: float = 86400) -> int:
+        return 0
+
+    def _on_expired(self, rowcount: int) -> None:
+        with self._count_lock:
+            self._count -= rowcount
+        if rowcount:
+            logger.info("删除过期历史数据，记录数: %d", rowcount)
+
+    def expire(self, now: float) -> int:
+        """异步删除超出保留期的记录（由写线程执行），返回 0"""
+        if now - self._last_expire < self.expire_interval:
+            return 0
+        self._last_expire = now
+        self.backend.submit("DELETE FROM historical_data WHERE timestamp < ?", (now - self.retention_seconds,),
+                            callback=self._on_expired)
+        return 0
+
+    @staticmethod
+    def _to_segment(rows: List[Tuple], start_time: float, end_time: float) -> TimeSegment:
+        segment = TimeSegment(start_time, end_time)
+        for timestamp, data_id, metrics in rows:
+            segment.append({'timestamp': timestamp, 'metrics': json.loads(metrics), 'data_id': data_id})
+        return segment
+
+    def range(self, start_time: float, end_time: float) -> HistoryView:
+        """按时间戳索引检索 [start_time, end_time] 内的记录"""
+        if end_time < start_time:
+            return HistoryView([])
+        rows = self.backend.query(
+            "SELECT timestamp, data_id, metrics FROM historical_data "
+            "WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp, id", (start_time, end_time))
+        segment = self._to_segment(rows, start_time, end_time)
+        return HistoryView([(segment, 0, len(segment))] if rows else [])
+
+    def count(self, start_time: float, end_time: float) -> int:
+        return self.backend.query("SELECT COUNT(*) FROM historical_data WHERE timestamp BETWEEN ? AND ?",
+                                  (start_time, end_time))[0][0]
+
+    def records_after(self, timestamp: float) -> Iterator[Dict]:
+        """按时间顺序返回时间戳大于 timestamp 的记录"""
+        for ts, data_id, metrics in self.backend.iter_query(
+                "SELECT timestamp, data_id, metrics FROM historical_data WHERE timestamp > ? ORDER BY timestamp, id",
+                (timestamp,)):
+            yield {'timestamp': ts, 'metrics': json.loads(metrics), 'data_id': data_id}
+
+    def iter_segments(self) -> Iterator[TimeSegment]:
+        """以单个时间段返回全部记录（兼容按段遍历的调用方）"""
+        rows = self.backend.query("SELECT timestamp, data_id, metrics FROM historical_data ORDER BY timestamp, id")
+        if rows:
+            yield self._to_segment(rows, rows[0][0], rows[-1][0])
+
+    def storage_stats(self) -> Dict[str, int]:
+        return {'sealed_segments': 0, 'sealed_records': 0, 'sealed_bytes': 0}
+
+    def close(self) -> None:
+        """连接由 SQLiteBackend 统一关闭"""
+
+    def __len__(self) -> int:
+        return self._count
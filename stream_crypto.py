@@ -0,0 +1,298 @@
+# 刀 AI 数据库扩展技术 - 流式分块加密
+# 本脚本实现分块 AES-256-GCM 流式认证加密：数据按固定大小分块，每块独立加密并带认证标签，
+# nonce 由随机前缀、块序号和末块标志组成（防止块被重排、截断或拼接），内存占用只与块大小有关；
+# 由于各块密文长度固定，可以只读取并解密任意一块，实现随机访问。直接运行本脚本可测试加解密吞吐量。
+
+import argparse
+import io
+import os
+import struct
+import tempfile
+import time
+import logging
+from typing import Dict, List, Any, BinaryIO, Iterator, Optional, Tuple, Union
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DAOE'
+FORMAT_VERSION = 1
+# 文件头：魔数、格式版本、明文块大小、nonce 随机前缀（7 字节），整个文件头作为每块的附加认证数据
+_HEADER = struct.Struct('>4sBI7s')
+HEADER_SIZE = _HEADER.size
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# 块大小上限，避免按伪造的文件头分配过大的缓冲区
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+Source = Union[bytes, bytearray, memoryview, BinaryIO]
+# encrypt_into/decrypt_into 自 cryptography 43 起提供，旧版本退回到 encrypt/decrypt（每块分配一次输出对象）
+_HAS_INTO = hasattr(AESGCM, 'encrypt_into') and hasattr(AESGCM, 'decrypt_into')
+
+
+class DecryptionError(ValueError):
+    """密文格式错误，或认证失败（密钥错误、数据被篡改、截断或重排）"""
+
+
+def _read_full(src: BinaryIO, buf: bytearray) -> int:
+    """尽量读满 buf，返回读取的字节数（只在流结束时少于 len(buf)）"""
+    view = memoryview(buf)
+    total = 0
+    while total < len(buf):
+        n = src.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def _nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    return prefix + struct.pack('>IB', index, 1 if last else 0)
+
+
+class StreamCipher:
+    """分块 AES-GCM 流式加解密；输入可以是文件对象（按块 readinto 到复用的缓冲区）或字节类对象（按 memoryview 切片，不复制）"""
+
+    def __init__(self, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if len(key) not in (16, 24, 32):
+            raise ValueError("AES 密钥长度必须为 16、24 或 32 字节")
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"无效的块大小: {chunk_size}")
+        self._aead = AESGCM(key)
+        self.chunk_size = chunk_size
+
+    # ---- 加密 ----
+
+    def _plaintext_chunks(self, src: Source, chunk_size: int) -> Iterator[Tuple[memoryview, bool]]:
+        """产出 (明文块视图, 是否末块)；文件对象预读一块以确定末块，空输入产出一个空的末块"""
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            view = memoryview(src).cast('B')
+            if not len(view):
+                yield view, True
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size], start + chunk_size >= len(view)
+            return
+        current, ahead = bytearray(chunk_size), bytearray(chunk_size)
+        n = _read_full(src, current)
+        while True:
+            m = _read_full(src, ahead) if n == chunk_size else 0
+            yield memoryview(current)[:n], m == 0
+            if m == 0:
+                return
+            current, ahead = ahead, current
+            n = m
+
+    def _new_header(self) -> Tuple[bytes, bytes]:
+        prefix = os.urandom(7)
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, self.chunk_size, prefix), prefix
+
+    def iter_encrypt(self, src: Source) -> Iterator[bytes]:
+        """逐块产出密文（首先产出文件头），适合作为流式响应体"""
+        header, prefix = self._new_header()
+        yield header
+        for index, (chunk, last) in enumerate(self._plaintext_chunks(src, self.chunk_size)):
+            yield self._aead.encrypt(_nonce(prefix, index, last), chunk, header)
+
+    def encrypt_stream(self, src: Source, dst: BinaryIO) -> int:
+        """把 src 加密写入 dst，返回写出的字节数；支持时密文写入复用的输出缓冲区，不为每块分配新对象"""
+        header, prefix = self._new_header()
+        dst.write(header)
+        written = HEADER_SIZE
+        out = bytearray(self.chunk_size + TAG_SIZE)
+        out_view = memoryview(out)
+        for index, (chunk, last) in enumerate(self._plaintext_chunks(src, self.chunk_size)):
+            size = len(chunk) + TAG_SIZE
+            if _HAS_INTO:
+                self._aead.encrypt_into(_nonce(prefix, index, last), chunk, header, out_view[:size])
+                dst.write(out_view[:size])
+            else:
+                dst.write(self._aead.encrypt(_nonce(prefix, index, last), chunk, header))
+            written += size
+        return written
+
+    def encrypt(self, data: Union[bytes, bytearray, memoryview]) -> bytes:
+        """加密内存中的数据，返回完整密文"""
+        return b''.join(self.iter_encrypt(data))
+
+    # ---- 解密 ----
+
+    @staticmethod
+    def _parse_header(header: bytes) -> Tuple[int, bytes]:
+        if len(header) != HEADER_SIZE:
+            raise DecryptionError("密文过短，缺少文件头")
+        magic, version, chunk_size, prefix = _HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise DecryptionError("不是受支持的加密格式")
+        return chunk_size, bytes(prefix)
+
+    def _open_chunk(self, header: bytes, prefix: bytes, index: int, last: bool, chunk: memoryview,
+                    out: Optional[memoryview] = None) -> Any:
+        try:
+            if out is not None and _HAS_INTO:
+                self._aead.decrypt_into(_nonce(prefix, index, last), chunk, header, out)
+                return out
+            if out is not None:
+                out[:] = self._aead.decrypt(_nonce(prefix, index, last), chunk, header)
+                return out
+            return self._aead.decrypt(_nonce(prefix, index, last), chunk, header)
+        except InvalidTag:
+            raise DecryptionError(f"第 {index} 块认证失败（密钥错误、数据被篡改、截断或重排）") from None
+
+    def _ciphertext_chunks(self, src: Source) -> Iterator[Tuple[bytes, bytes, int, bool, memoryview]]:
+        """产出 (文件头, nonce 前缀, 块序号, 是否末块, 密文块视图)"""
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            view = memoryview(src).cast('B')
+            header = bytes(view[:HEADER_SIZE])
+            chunk_size, prefix = self._parse_header(header)
+            body = view[HEADER_SIZE:]
+            step = chunk_size + TAG_SIZE
+            count = max(1, -(-len(body) // step))
+            for index in range(count):
+                yield header, prefix, index, index == count - 1, body[index * step:(index + 1) * step]
+            return
+        header = src.read(HEADER_SIZE)
+        chunk_size, prefix = self._parse_header(header)
+        step = chunk_size + TAG_SIZE
+        current, ahead = bytearray(step), bytearray(step)
+        n = _read_full(src, current)
+        index = 0
+        while True:
+            m = _read_full(src, ahead) if n == step else 0
+            yield header, prefix, index, m == 0, memoryview(current)[:n]
+            if m == 0:
+                return
+            current, ahead = ahead, current
+            n = m
+            index += 1
+
+    def iter_decrypt(self, src: Source) -> Iterator[bytes]:
+        """逐块产出明文；任一块认证失败时抛出 DecryptionError"""
+        for header, prefix, index, last, chunk in self._ciphertext_chunks(src):
+            yield self._open_chunk(header, prefix, index, last, chunk)
+
+    def decrypt_stream(self, src: Source, dst: BinaryIO) -> int:
+        """把 src 解密写入 dst，返回写出的明文字节数；明文写入复用的输出缓冲区。
+        注意认证按块进行，某块认证失败前已写出的块是已通过认证的部分明文"""
+        written = 0
+        out: Optional[bytearray] = None
+        for header, prefix, index, last, chunk in self._ciphertext_chunks(src):
+            if len(chunk) < TAG_SIZE:
+                raise DecryptionError(f"第 {index} 块长度不足")
+            if out is None:
+                out = bytearray(self._parse_header(header)[0])
+            size = len(chunk) - TAG_SIZE
+            view = self._open_chunk(header, prefix, index, last, chunk, memoryview(out)[:size])
+            dst.write(view)
+            written += size
+        return written
+
+    def decrypt(self, data: Union[bytes, bytearray, memoryview]) -> bytes:
+        """解密内存中的完整密文"""
+        return b''.join(self.iter_decrypt(data))
+
+    # ---- 随机访问 ----
+
+    @staticmethod
+    def _layout(src: Source) -> Tuple[bytes, int, bytes, int]:
+        """返回 (文件头, 明文块大小, nonce 前缀, 密文总长度)"""
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            view = memoryview(src).cast('B')
+            header, total = bytes(view[:HEADER_SIZE]), len(view)
+        else:
+            src.seek(0)
+            header = src.read(HEADER_SIZE)
+            total = src.seek(0, io.SEEK_END)
+        chunk_size, prefix = StreamCipher._parse_header(header)
+        return header, chunk_size, prefix, total
+
+    @staticmethod
+    def _read_at(src: Source, offset: int, length: int) -> memoryview:
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            return memoryview(src).cast('B')[offset:offset + length]
+        src.seek(offset)
+        return memoryview(src.read(length))
+
+    def plaintext_size(self, src: Source) -> int:
+        _, chunk_size, _, total = self._layout(src)
+        count = max(1, -(-(total - HEADER_SIZE) // (chunk_size + TAG_SIZE)))
+        return total - HEADER_SIZE - count * TAG_SIZE
+
+    def decrypt_chunk(self, src: Source, index: int) -> bytes:
+        """只读取并解密第 index 块（src 为可 seek 的文件对象或字节类对象）"""
+        header, chunk_size, prefix, total = self._layout(src)
+        step = chunk_size + TAG_SIZE
+        count = max(1, -(-(total - HEADER_SIZE) // step))
+        if not 0 <= index < count:
+            raise IndexError(f"块序号超出范围: {index}（共 {count} 块）")
+        chunk = self._read_at(src, HEADER_SIZE + index * step, step)
+        return self._open_chunk(header, prefix, index, index == count - 1, chunk)
+
+    def read_range(self, src: Source, offset: int, length: int) -> bytes:
+        """读取明文 [offset, offset + length) 范围，只解密覆盖该范围的块"""
+        _, chunk_size, _, _ = self._layout(src)
+        end = min(offset + length, self.plaintext_size(src))
+        parts: List[bytes] = []
+        position = offset
+        while position < end:
+            index = position // chunk_size
+            chunk = self.decrypt_chunk(src, index)
+            start = position - index * chunk_size
+            parts.append(chunk[start:start + end - position])
+            position = (index + 1) * chunk_size
+        return b''.join(parts)
+
+
+def benchmark(size_mb: int = 256, chunk_size: int = DEFAULT_CHUNK_SIZE,
+              directory: Optional[str] = None) -> Dict[str, float]:
+    """在临时文件上测试流式加解密吞吐量（MB/s）和单块随机读取延迟（毫秒）"""
+    import resource
+    cipher = StreamCipher(AESGCM.generate_key(256), chunk_size)
+    block = os.urandom(1024 * 1024)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        plain_path, cipher_path, out_path = (os.path.join(tmp, name) for name in ('plain', 'cipher', 'out'))
+        with open(plain_path, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(block)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        with open(plain_path, 'rb', buffering=0) as src, open(cipher_path, 'wb') as dst:
+            cipher.encrypt_stream(src, dst)
+        encrypt_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        with open(cipher_path, 'rb', buffering=0) as src, open(out_path, 'wb') as dst:
+            cipher.decrypt_stream(src, dst)
+        decrypt_seconds = time.perf_counter() - started
+        chunks = size_mb * 1024 * 1024 // chunk_size
+        with open(cipher_path, 'rb') as src:
+            started = time.perf_counter()
+            for i in range(100):
+                cipher.decrypt_chunk(src, (i * 7919) % chunks)
+            random_access_ms = (time.perf_counter() - started) / 100 * 1000
+        rss_growth_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    return {
+        'size_mb': size_mb,
+        'chunk_kb': chunk_size // 1024,
+        'encrypt_mb_per_s': size_mb / encrypt_seconds,
+        'decrypt_mb_per_s': size_mb / decrypt_seconds,
+        'random_chunk_ms': random_access_ms,
+        'peak_rss_growth_mb': rss_growth_mb
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, float]:
+    parser = argparse.ArgumentParser(description="刀 AI 流式分块加密吞吐量测试")
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--chunk-kb', type=int, default=DEFAULT_CHUNK_SIZE // 1024)
+    parser.add_argument('--dir', default=None, help="临时文件目录")
+    args = parser.parse_args(argv)
+    result = benchmark(args.size_mb, args.chunk_kb * 1024, args.dir)
+    logger.info("加解密测试结果: %s", result)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,14 @@
 # 注意：此代码仅用于演示目的，不执行实际的测试。
 
 import pytest
+import asyncio
+import json
+import math
 import time
 import random
+import threading
 from unittest.mock import patch, MagicMock
+from collections import deque
 from typing import Dict, List
 
 # 导入模拟组件（假设这些模块已存在）
@@ -13,13 +18,35 @@ try:
     from monitoring_agent import MonitoringAgent
     from predictive_engine import PredictiveEngine
     from optimization_executor import OptimizationExecutor
-    from database_connector import DatabaseConnector
+    from database_connector import DatabaseConnector, QueryResultCache, fingerprint_query
 except ImportError:
     # 模拟导入失败的情况
     MonitoringAgent = MagicMock
     PredictiveEngine = MagicMock
     OptimizationExecutor = MagicMock
     DatabaseConnector = MagicMock
+    QueryResultCache = MagicMock
+
+import numpy as np
+
+import gorilla_codec
+from api_interface import APIInterface
+from knowledge_base import KnowledgeBase
+from rollups import QuantileSketch
+from metrics_stream import MetricsBroadcaster
+from http_server import HTTPRequest
+from response_cache import unpack
+from request_limits import RateLimiter, UNAUTHENTICATED_KEY
+from audit_log import AuditLogWriter
+from access_control import DecisionAuditor, SessionCache
+from security_module import SecurityModule
+from anonymizer import BatchAnonymizer, anonymize_batches
+from stream_crypto import StreamCipher, DecryptionError, HEADER_SIZE, TAG_SIZE
+from data_visualizer import DataVisualizer
+from downsampling import lttb_indices
+from chart_loaders import NDJSONLoader, ColumnarLoader, write_columnar, to_list
+from chart_renderer import render_charts
+from shard_router import ShardRouter, Shard, HashShardMap, RangeShardMap
 
 # 测试夹具：模拟配置文件
 @pytest.fixture
@@ -138,5 +165,1030 @@ def test_database_connector_execute_query(config_path):
         assert result['success'], "查询执行失败"
         assert result['rows_affected'] == 10, "查询影响行数不正确"
 
+def test_query_result_cache_lru_and_table_invalidation():
+    """测试查询结果缓存的 LRU 淘汰与按表失效"""
+    cache = QueryResultCache(max_bytes=10 * 1024 * 1024)
+    result = {'success': True, 'data': [{'id': 1, 'value': 10}]}
+    assert cache.put("SELECT * FROM metrics WHERE id = %s", {'id': 1}, result)
+    
+    # 仅空白不同的查询命中同一条目
+    cached = cache.get("SELECT *   FROM metrics\n WHERE id = %s;", {'id': 1})
+    assert cached is not None and cached['cached'], "规范化 SQL 未命中缓存"
+    assert cache.get("SELECT * FROM metrics WHERE id = %s", {'id': 2}) is None, "参数不同不应命中"
+    
+    cache.put("SELECT * FROM other_table", None, result)
+    assert cache.invalidate_tables({'METRICS'}) == 1, "按表失效数量不正确"
+    assert cache.get("SELECT * FROM metrics WHERE id = %s", {'id': 1}) is None, "失效后仍命中缓存"
+    assert cache.get("SELECT * FROM other_table") is not None, "无关表的缓存被误失效"
+    
+    # 失效前开始的查询在失效后写回的旧结果被丢弃
+    generation = cache.generation("SELECT * FROM metrics WHERE id = %s")
+    cache.invalidate_tables({'metrics'})
+    assert not cache.put("SELECT * FROM metrics WHERE id = %s", {'id': 1}, result, generation), "失效前的旧结果被缓存"
+    assert cache.stats['stale_puts'] == 1, "旧结果计数不正确"
+    fresh = cache.generation("SELECT * FROM metrics WHERE id = %s")
+    assert cache.put("SELECT * FROM metrics WHERE id = %s", {'id': 1}, result, fresh), "代数未变化的结果应缓存"
+    cleared = cache.generation("SELECT * FROM other_table")
+    cache.clear()
+    assert not cache.put("SELECT * FROM other_table", None, result, cleared), "清空前的旧结果被缓存"
+    
+    # 内存预算只容纳一个条目时按 LRU 淘汰最久未使用的条目
+    lru = QueryResultCache(max_bytes=10 * 1024 * 1024)
+    lru.put("SELECT * FROM a", None, result)
+    lru.max_bytes = lru.current_bytes * 3 // 2
+    lru.put("SELECT * FROM b", None, result)
+    assert lru.get("SELECT * FROM a") is None and lru.get("SELECT * FROM b") is not None, "LRU 淘汰顺序不正确"
+    assert lru.stats['evictions'] == 1, "淘汰计数不正确"
+    assert not lru.put("SELECT * FROM c", None, {'data': list(range(10000))}), "超出预算的结果不应缓存"
+
+def test_database_connector_query_cache_write_invalidation(tmp_path):
+    """测试连接器在写操作与优化后失效查询缓存"""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("""
+    database:
+      query_cache:
+        enabled: true
+        max_memory_mb: 1
+    """, encoding='utf-8')
+    connector = DatabaseConnector(str(config_file))
+    connector.connection_status = True
+    
+    with patch('database_connector.time.sleep'), \
+         patch('database_connector.random.choice', side_effect=lambda seq: seq[0]):
+        first = connector.execute_query("SELECT * FROM metrics")
+        second = connector.execute_query("SELECT * FROM metrics")
+        assert second.get('cached') and second['data'] == first['data'], "重复读查询未命中缓存"
+        
+        connector.execute_query("INSERT INTO metrics VALUES (1)")
+        assert not connector.execute_query("SELECT * FROM metrics").get('cached'), "写操作后缓存未失效"
+        
+        connector.apply_optimization({'action': 'create_index', 'parameters': {'table': 'metrics'}})
+        assert not connector.execute_query("SELECT * FROM metrics").get('cached'), "DDL 后缓存未失效"
+        
+        fresh = connector.execute_query("SELECT * FROM metrics")
+        expected = [dict(row) for row in fresh['data']]
+        fresh['data'][0]['value'] = -1
+        cached = connector.execute_query("SELECT * FROM metrics")
+        cached['data'].append({'id': -1})
+        assert connector.execute_query("SELECT * FROM metrics")['data'] == expected, "调用方修改结果影响了缓存"
+        connector.execute_query("SELECT * FROM main.metrics WHERE name = 'a  b'")
+        assert connector.query_cache.get("SELECT * FROM main.metrics WHERE name = 'a b'") is None, "字符串字面量内的空白被合并"
+        connector.execute_query("WITH t AS (SELECT 1) DELETE FROM main.metrics")
+        assert connector.query_cache.get("SELECT  * FROM main.metrics WHERE name = 'a  b'") is None, "带库名的表写入后缓存未失效"
+        connector.execute_query("WITH t AS (SELECT 1) DELETE FROM metrics")
+        assert not connector.execute_query("WITH t AS (SELECT 1) DELETE FROM metrics").get('cached'), "WITH 写语句被缓存"
+
+def test_database_connector_instrumentation_and_plan_capture(tmp_path):
+    """测试按指纹聚合的延迟统计与慢查询执行计划抓取"""
+    assert fingerprint_query("SELECT * FROM t WHERE id = 5 AND name = 'a'") == \
+        fingerprint_query("select *  from t where id = 42 and name = 'bb'"), "字面量不同的查询指纹不一致"
+    
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"""
+    database:
+      instrumentation:
+        enabled: true
+        slow_query_threshold: 0.0
+      sharding:
+        enabled: true
+        shards:
+          - name: shard_0
+            path: {tmp_path / 'shard_0.db'}
+    """, encoding='utf-8')
+    connector = DatabaseConnector(str(config_file))
+    assert connector.connect(), "分片模式连接失败"
+    try:
+        connector.execute_query("CREATE TABLE metrics (id INTEGER, value REAL)")
+        for i in range(3):
+            connector.execute_query(f"INSERT INTO metrics VALUES ({i}, {i * 0.5})")
+            connector.execute_query(f"SELECT * FROM metrics WHERE id = {i}")
+        
+        stats = connector.instrumentation.get_stats()
+        select_fp = fingerprint_query("SELECT * FROM metrics WHERE id = 0")
+        assert stats[select_fp]['count'] == 3 and stats[select_fp]['rows_returned'] == 3, "指纹统计不正确"
+        assert sum(stats[select_fp]['histogram'].values()) == 3, "延迟直方图计数不正确"
+        plan = connector.instrumentation.get_plan(select_fp)
+        assert plan is not None and plan['plan']['steps'], "慢查询未抓取执行计划"
+    finally:
+        connector.disconnect()
+
+# 测试分片查询路由器
+def test_shard_router_routing_and_scatter_gather(tmp_path):
+    """测试单键路由、跨分片并行查询与读写分离"""
+    paths = [str(tmp_path / f"shard_{i}.db") for i in range(3)]
+    replica = str(tmp_path / "shard_0_replica.db")
+    shards = [Shard(f"shard_{i}", path) for i, path in enumerate(paths)]
+    router = ShardRouter(shards, HashShardMap([s.name for s in shards]), key_column='tenant_id')
+    try:
+        router.execute("CREATE TABLE metrics (tenant_id INTEGER, value REAL)")
+        for tenant_id in range(30):
+            result = router.execute("INSERT INTO metrics VALUES (:tenant_id, :value)",
+                                    {'tenant_id': tenant_id, 'value': tenant_id * 1.5})
+            assert result['success'] and len(result['shards']) == 1, "单键写入未路由到单个分片"
+        
+        single = router.execute("SELECT * FROM metrics WHERE tenant_id = :tenant_id", {'tenant_id': 7})
+        assert single['shards'] == [router.shard_map.locate(7)] and len(single['data']) == 1, "单键查询路由错误"
+        
+        merged = router.execute("SELECT * FROM metrics")
+        assert len(merged['shards']) == 3 and len(merged['data']) == 30, "跨分片合并结果不完整"
+        streamed = list(router.stream_query("SELECT tenant_id FROM metrics"))
+        assert sorted(row['tenant_id'] for row in streamed) == list(range(30)), "流式合并结果不正确"
+        
+        with pytest.raises(ValueError):
+            router.route("DELETE FROM metrics WHERE value > 10")
+        with pytest.raises(ValueError):
+            router.route("WITH old AS (SELECT 1) DELETE FROM metrics")
+        with patch.object(router, '_connection', side_effect=RuntimeError("分片不可用")):
+            with pytest.raises(RuntimeError):
+                list(router.stream_query("SELECT tenant_id FROM metrics"))
+        
+        stats = router.get_shard_stats()
+        assert all(stats[name]['count'] > 0 for name in router.shards), "分片延迟统计缺失"
+    finally:
+        router.close()
+    
+    # 读查询路由到副本，写查询路由到主库
+    shard = Shard('shard_0', paths[0], [replica])
+    assert shard.pick_target(is_read=True) == replica and shard.pick_target(is_read=False) == paths[0]
+    
+    range_map = RangeShardMap([(100, 'low'), (200, 'mid')], 'high')
+    assert [range_map.locate(k) for k in (5, 100, 150, 999)] == ['low', 'mid', 'mid', 'high'], "范围分片定位错误"
+
+# 测试知识库
+def test_knowledge_base_segmented_history_retention(config_path):
+    """测试历史数据按时间分段存储并按整段淘汰过期数据"""
+    kb = KnowledgeBase(config_path)
+    now = time.time()
+    # 默认保留 7 天：插入 10 天前到现在、每小时一条的数据
+    for hours_ago in range(240, -1, -1):
+        kb.store_historical_data({'timestamp': now - hours_ago * 3600, 'metrics': {'cpu_usage': float(hours_ago)}})
+    
+    retention_cutoff = now - 7 * 86400
+    oldest = min(d['timestamp'] for d in kb.historical_data)
+    assert oldest >= retention_cutoff - kb.history.segment_seconds, "过期时间段未被删除"
+    assert len(kb.history) == len(kb.historical_data), "分段计数与记录数不一致"
+    
+    recent = kb.retrieve_historical_data(now - 5 * 3600 - 1, now)
+    assert len(recent) == 6, "时间范围检索结果数量不正确"
+
+def test_knowledge_base_indexed_range_retrieval(config_path):
+    """测试基于时间索引的范围检索与列式返回"""
+    kb = KnowledgeBase(config_path)
+    now = time.time()
+    timestamps = [now - i * 60 for i in range(600)]
+    random.shuffle(timestamps)  # 乱序写入仍需保持段内有序
+    for ts in timestamps:
+        kb.store_historical_data({'timestamp': ts, 'metrics': {'cpu_usage': 50.0, 'query_time': 0.1}})
+    
+    start, end = now - 90 * 60, now - 30 * 60
+    view = kb.retrieve_historical_data(start, end)
+    expected = sorted(ts for ts in timestamps if start <= ts <= end)
+    assert [d['timestamp'] for d in view] == expected, "范围检索结果不正确或无序"
+    assert view[0]['timestamp'] == expected[0] and view[-1]['timestamp'] == expected[-1], "视图下标访问不正确"
+    
+    columns = kb.retrieve_historical_data(start, end, columnar=True)
+    assert list(columns['timestamp']) == expected, "列式时间戳不正确"
+    assert columns['cpu_usage'].shape == (len(expected),), "列式指标长度不正确"
+    assert len(kb.retrieve_historical_data(now + 10, now + 20)) == 0, "空范围应返回空结果"
+
+def test_knowledge_base_persistent_columnar_segments(tmp_path):
+    """测试历史数据封存为内存映射列式段、后台压缩以及重启恢复"""
+    import os
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"""
+    knowledge_base:
+      storage_dir: {tmp_path / 'kb'}
+      compaction_interval: 3600
+    """, encoding='utf-8')
+    now = time.time()
+    start = now - 2 * 86400
+    kb = KnowledgeBase(str(config_file))
+    for i in range(600):
+        kb.store_historical_data({'timestamp': start + i * 240, 'metrics': {'cpu_usage': float(i)}})
+    kb.store_model('predictive_model', {'accuracy': 0.9})
+    kb.store_optimization_result({'action': 'create_index', 'success': True})
+    
+    sealed = [segment for segment in kb.history.iter_segments() if segment.sealed]
+    assert sealed, "已结束的时间段未被封存"
+    parts = {segment.path: open(segment.path, 'rb').read() for segment in sealed}
+    before = kb.retrieve_historical_data(start, now)
+    assert kb.history.compact() > 0, "封存段未被压缩合并"
+    # 合并前取得的视图仍可读取已被替换的段
+    assert len(before.to_columns()['cpu_usage']) == len(before) and before[0]['metrics']['cpu_usage'] == 0.0, \
+        "合并后旧视图不可读"
+    before.close()
+    expected = [d['timestamp'] for d in kb.retrieve_historical_data(start, now)]
+    count = len(kb.history)
+    kb.close()
+    # 模拟合并段写入后、旧段删除前崩溃
+    for path, data in parts.items():
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+    
+    restarted = KnowledgeBase(str(config_file))
+    try:
+        view = restarted.retrieve_historical_data(start, now)
+        assert [d['timestamp'] for d in view] == expected, "重启后历史数据不一致"
+        assert len(restarted.history) == count and not any(os.path.exists(path) for path in parts), "崩溃遗留的旧段未被跳过"
+        assert view[10]['metrics']['cpu_usage'] == 10.0, "封存段记录还原不正确"
+        columns = restarted.retrieve_historical_data(start, now, columnar=True)
+        assert columns['cpu_usage'].sum() == sum(range(600)), "列式读取结果不正确"
+        assert restarted.retrieve_model('predictive_model') is not None, "重启后模型丢失"
+        assert len(restarted.optimization_results) == 1, "重启后优化结果丢失"
+        assert restarted.get_optimization_stats('create_index')['successes'] == 1, "重启后优化统计丢失"
+        with open(tmp_path / 'kb' / 'optimization_results.jsonl', encoding='utf-8') as f:
+            assert len(f.readlines()) == 1, "关闭时优化结果日志未改写为检查点"
+    finally:
+        restarted.close()
+
+def test_knowledge_base_model_registry_versions_and_gc(tmp_path):
+    """测试模型版本单调递增、按前缀不误匹配、模型数据延迟加载以及旧版本回收"""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"""
+    knowledge_base:
+      storage_dir: {tmp_path / 'kb'}
+      model_registry:
+        keep_versions: 2
+    """, encoding='utf-8')
+    kb = KnowledgeBase(str(config_file))
+    for i in range(4):
+        kb.store_model('predictive_model', {'accuracy': 0.8, 'round': i}, model_blob=bytes([i]) * 1024)
+    kb.store_model('predictive_model_v2', {'accuracy': 0.5})
+    
+    latest = kb.retrieve_model('predictive_model')
+    assert latest['version'] == 4 and latest['metadata']['round'] == 3, "最新版本不正确"
+    assert kb.model_registry.versions('predictive_model') == [3, 4], "旧版本未被回收"
+    assert kb.retrieve_model('predictive_model', 1) is None, "已回收版本仍可检索"
+    assert kb.retrieve_model('predictive', None) is None, "模型名前缀不应匹配其他模型"
+    assert 'blob' not in latest and kb.retrieve_model_blob('predictive_model', 'v3') == bytes([2]) * 1024, "模型数据加载不正确"
+    kb.close()
+    
+    restarted = KnowledgeBase(str(config_file))
+    try:
+        assert restarted.model_registry.versions('predictive_model') == [3, 4], "重启后版本索引不一致"
+        restarted.store_model('predictive_model', {'accuracy': 0.9})
+        assert restarted.retrieve_model('predictive_model')['version'] == 5, "重启后版本号未单调递增"
+        assert restarted.retrieve_model_blob('predictive_model', 4) == bytes([3]) * 1024, "重启后模型数据丢失"
+    finally:
+        restarted.close()
+
+def test_knowledge_base_optimization_analytics(tmp_path):
+    """测试优化结果按操作/表/列增量聚合，且内存中的结果列表有界"""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("""
+    knowledge_base:
+      max_optimization_results: 10
+      optimization_half_life_seconds: 3600
+    """, encoding='utf-8')
+    kb = KnowledgeBase(str(config_file))
+    now = time.time()
+    reductions = [10.0, 20.0, 30.0, 40.0]
+    for i in range(40):
+        kb.store_optimization_result({
+            'timestamp': now - (40 - i) * 600,
+            'action': 'create_index',
+            'success': i >= 20,
+            'parameters': {'target_table': 'orders', 'column': 'id' if i % 2 else 'user_id'},
+            'impact': {'query_time_reduction': reductions[i % 4]},
+            'execution_time': float(i % 10 + 1)
+        })
+    kb.store_optimization_result({'action': 'partition_data', 'success': True, 'table': 'logs'})
+    
+    assert len(kb.optimization_results) == 10, "优化结果列表未按上限截断"
+    overall = kb.get_optimization_stats('create_index')
+    assert overall['total'] == 40 and overall['success_rate'] == 0.5, "成功率统计不正确"
+    assert overall['decayed_success_rate'] > 0.9, "近期加权未偏向最近的结果"
+    impact = overall['impact']['query_time_reduction']
+    assert abs(impact['mean'] - 25.0) < 1e-9 and abs(impact['variance'] - float(np.var(reductions * 10, ddof=1))) < 1e-9, "影响均值/方差不正确"
+    assert abs(overall['execution_time']['p50'] - 5.5) <= 0.6, "执行时间分位数不正确"
+    assert kb.get_optimization_stats('create_index', 'orders', 'id')['total'] == 20, "按列聚合不正确"
+    assert set(kb.summarize_optimizations('orders')) == {'create_index'}, "按表汇总不正确"
+    assert kb.get_optimization_stats('partition_data', 'logs')['successes'] == 1, "按表聚合不正确"
+
+def test_knowledge_base_sqlite_backend(tmp_path):
+    """测试 SQLite 存储引擎的组提交写入、按时间检索、模型注册表以及重启恢复"""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"""
+    knowledge_base:
+      backend: sqlite
+      storage_dir: {tmp_path / 'kb'}
+      sqlite:
+        group_commit_ms: 2
+    """, encoding='utf-8')
+    now = time.time()
+    kb = KnowledgeBase(str(config_file))
+    for i in range(2000):
+        kb.store_historical_data({'timestamp': now - 2000 + i, 'metrics': {'cpu_usage': float(i)}})
+    kb.store_model('predictive_model', {'accuracy': 0.9}, model_blob=b'weights')
+    kb.store_model('predictive_model', {'accuracy': 0.95})
+    kb.store_optimization_result({'action': 'create_index', 'success': True, 'table': 'orders'})
+    
+    assert len(kb.history) == 2000, "历史数据计数不正确"
+    assert kb.backend.flush(timeout=5), "写入未在超时内提交"
+    view = kb.retrieve_historical_data(now - 1000, now)
+    assert len(view) == 1000 and view[0]['metrics']['cpu_usage'] == 1000.0, "按时间检索结果不正确"
+    stats = kb.backend.stats()
+    assert stats['commits'] < stats['committed_statements'], "写入未按组提交"
+    errors, rowcounts = [], []
+    kb.backend.submit("INSERT INTO kb_meta (key, value) VALUES (?, ?)", ('dup', 'a'))
+    kb.backend.submit("INSERT INTO kb_meta (key, value) VALUES (?, ?)", ('dup', 'b'), errback=errors.append)
+    kb.backend.submit("UPDATE kb_meta SET value = ? WHERE key = ?", ('c', 'dup'), callback=rowcounts.append)
+    assert kb.backend.flush(timeout=5), "写入未在超时内提交"
+    assert len(errors) == 1 and rowcounts == [1], "组提交失败后未逐条重试并通知调用方"
+    assert kb.backend.get_meta('dup') == 'c' and kb.backend.stats()['failed_statements'] == 1, "组提交失败丢弃了正常写入"
+    # 参数无法绑定等非 SQLite 异常不应导致写线程退出
+    kb.backend.submit("INSERT INTO kb_meta (key, value) VALUES (?, ?)", ('bad', 2 ** 70), errback=errors.append)
+    kb.backend.put_meta('after_bad', 'ok')
+    assert kb.backend.flush(timeout=5) and kb.backend.get_meta('after_bad') == 'ok', "写线程在异常后停止"
+    assert len(errors) == 2, "非 SQLite 异常未通知调用方"
+    # 与分段存储相同的节奏保存汇总快照，而不是只在关闭时保存
+    kb.store_historical_data({'timestamp': now, 'metrics': {'cpu_usage': 1.0}})
+    kb.history._sealed_period -= 1
+    kb.store_historical_data({'timestamp': now, 'metrics': {'cpu_usage': 2.0}})
+    assert kb.backend.flush(timeout=5) and kb.backend.get_meta('rollups'), "汇总快照未按封存节奏保存"
+    kb.close()
+    
+    restarted = KnowledgeBase(str(config_file))
+    try:
+        assert restarted.backend.query("PRAGMA journal_mode")[0][0] == 'wal', "未启用 WAL 模式"
+        assert len(restarted.history) == 2002, "重启后历史数据丢失"
+        assert restarted.retrieve_model('predictive_model')['version'] == 2, "重启后模型版本不正确"
+        assert restarted.retrieve_model_blob('predictive_model', 1) == b'weights', "重启后模型数据丢失"
+        assert restarted.get_optimization_stats('create_index', 'orders')['total'] == 1, "重启后优化结果丢失"
+        aggregated = restarted.retrieve_aggregated_data(now - 2000, now, max_points=100)
+        assert sum(aggregated['series']['cpu_usage']['count']) == 2002, "重启后汇总数据不完整"
+    finally:
+        restarted.close()
+
+def test_gorilla_codec_roundtrip_and_compressed_segments(tmp_path):
+    """测试 Gorilla 编码无损往返以及压缩封存段的范围查询"""
+    now = time.time()
+    timestamps = np.array([now + i * 10 + random.uniform(0, 0.01) for i in range(500)])
+    cpu = np.round(np.random.uniform(10, 90, 500), 1)
+    cpu[7] = np.nan
+    ids = np.array([-2 ** 63, 2 ** 63 - 1, 0, 5, -7], dtype=np.int64)
+    assert np.array_equal(gorilla_codec.decode_timestamps(gorilla_codec.encode_timestamps(timestamps), 500), timestamps)
+    decoded = gorilla_codec.decode_floats(gorilla_codec.encode_floats(cpu), 500)
+    assert np.array_equal(decoded, cpu, equal_nan=True), "浮点 XOR 编码往返不一致"
+    assert np.array_equal(gorilla_codec.decode_ints(gorilla_codec.encode_ints(ids), 5), ids), "整数编码往返不一致"
+    regular = np.full(1024, 42.0)
+    assert len(gorilla_codec.encode_floats(regular)) * 10 < regular.nbytes, "恒定序列压缩率不足"
+    # 配置小数位数时浮点指标量化后编码：在精度内无损还原，缺失值保留
+    from segment_store import _encode_block, _decode_block
+    noisy = np.round(np.random.uniform(10, 90, 1024), 1)
+    noisy[3] = np.nan
+    codec, data = _encode_block('cpu_usage', noisy, precision=1)
+    assert codec == 'q1' and len(data) * 3 < noisy.nbytes, "量化编码压缩率不足"
+    assert np.array_equal(_decode_block(codec, data, 1024, '<f8'), noisy, equal_nan=True), "量化编码往返不一致"
+    
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(f"""
+    knowledge_base:
+      storage_dir: {tmp_path / 'kb'}
+      compression: gorilla
+      compression_block_rows: 64
+    """, encoding='utf-8')
+    kb = KnowledgeBase(str(config_file))
+    start = now - 86400
+    try:
+        for i in range(2000):
+            kb.store_historical_data({'timestamp': start + i * 30, 'metrics': {'cpu_usage': round(i * 0.1, 1)}})
+        sealed = [segment for segment in kb.history.iter_segments() if segment.sealed]
+        assert sealed and all(segment.compressed for segment in sealed), "封存段未压缩"
+        
+        lo, hi = start + 300 * 30, start + 310 * 30
+        columns = kb.retrieve_historical_data(lo, hi, columnar=True)
+        assert list(columns['timestamp']) == [start + i * 30 for i in range(300, 311)], "压缩段范围查询时间戳不正确"
+        assert list(columns['cpu_usage']) == [round(i * 0.1, 1) for i in range(300, 311)], "压缩段指标值不正确"
+    finally:
+        kb.close()
+
+def test_knowledge_base_rollups_respect_point_budget(config_path):
+    """测试写入时维护的多粒度汇总以及按点数预算选择粒度"""
+    kb = KnowledgeBase(config_path)
+    now = time.time()
+    start = now - 3 * 86400
+    values = []
+    for i in range(3 * 86400 // 60):
+        value = float(i % 100)
+        values.append(value)
+        kb.store_historical_data({'timestamp': start + i * 60, 'metrics': {'cpu_usage': value}})
+    
+    small = kb.retrieve_aggregated_data(now - 600, now, max_points=100)
+    assert small['resolution'] == 0, "样本数不超预算时应返回原始数据"
+    
+    result = kb.retrieve_aggregated_data(start, now, max_points=100)
+    assert result['resolution'] == 3600, "未选择满足点数预算的最细粒度"
+    series = result['series']['cpu_usage']
+    assert len(series['timestamp']) <= 100, "输出点数超过预算"
+    assert sum(series['count']) == len(values), "汇总计数与样本数不一致"
+    assert min(series['min']) == 0.0 and max(series['max']) == 99.0, "汇总最值不正确"
+    
+    sketch = QuantileSketch()
+    for value in range(1, 1001):
+        sketch.add(float(value))
+    assert abs(sketch.quantile(0.5) - 500) <= 500 * 0.02 and abs(sketch.quantile(0.99) - 990) <= 990 * 0.02, "分位数草图误差过大"
+    for value in (math.inf, -math.inf, math.nan):
+        sketch.add(value)
+    assert sketch.count == 1000, "非有限值不应计入分位数草图"
+    kb.rollups.add(now, {'cpu_usage': math.inf, 'memory_usage': -math.inf})
+    assert sum(kb.retrieve_aggregated_data(start, now, max_points=100)['series']['cpu_usage']['count']) == len(values), \
+        "汇总计入了非有限值"
+    
+    daily = kb.retrieve_aggregated_data(start, now, max_points=2)
+    assert len(daily['series']['cpu_usage']['timestamp']) <= 2, "粗粒度汇总未按预算合并"
+    
+    kb.store_historical_data({'timestamp': now + 1, 'metrics': {'cpu_usage': 1.0, 'memory_usage': 50.0}})
+    raw = kb.retrieve_aggregated_data(now - 600, now + 2, max_points=100, metrics=['cpu_usage', 'memory_usage'])
+    assert raw['resolution'] == 0 and None in raw['series']['memory_usage']['avg'], "缺失指标应记为 None"
+    json.dumps(raw, allow_nan=False)
+
 if __name__ == "__main__":
-    pytest.main(["-v", __file__])
\ No newline at end of file
+    pytest.main(["-v", __file__])
+
+def test_api_interface_http_server_keepalive_pipelining_and_drain(config_path):
+    """测试 API HTTP 服务的长连接、流水线按序响应、连接数上限以及优雅排空"""
+    api = APIInterface(config_path)
+    api.config['api'] = {'port': 0, 'max_connections': 2, 'max_pipelined_requests': 2}
+    
+    async def read_response(reader):
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        headers = dict(line.split(': ', 1) for line in head[1:] if line)
+        body = await reader.readexactly(int(headers['Content-Length']))
+        return int(head[0].split(' ')[1]), headers, json.loads(body)
+    
+    async def scenario():
+        stop = asyncio.Event()
+        serve_task = asyncio.ensure_future(api.serve(stop))
+        while api.server is None or api.server._server is None:
+            await asyncio.sleep(0.01)
+        port = api.server.port
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        key = 'X-API-Key: demo_api_key_123456\r\n'
+        writer.write((f"GET /system_status HTTP/1.1\r\n{key}\r\n"
+                      f"GET /performance_metrics?start_time=2025-05-14T18:00:00Z&end_time=2025-05-14T18:01:00Z HTTP/1.1\r\n{key}\r\n"
+                      "GET /system_status HTTP/1.1\r\nX-API-Key: wrong\r\n\r\n"
+                      "GET /missing HTTP/1.1\r\n\r\n").encode('latin-1'))
+        responses = [await read_response(reader) for _ in range(4)]
+        assert [r[0] for r in responses] == [200, 200, 401, 404], "流水线响应顺序或状态码不正确"
+        assert 'components' in responses[0][2]['data'] and len(responses[1][2]['data']) == 2, "响应内容不正确"
+        assert responses[3][1]['Connection'] == 'keep-alive', "HTTP/1.1 连接未保持"
+        
+        second = await asyncio.open_connection('127.0.0.1', port)
+        third_reader, _ = await asyncio.open_connection('127.0.0.1', port)
+        assert (await read_response(third_reader))[0] == 503, "超出连接数上限未拒绝"
+        
+        writer.write(b'POST /trigger_optimization HTTP/1.1\r\n' + key.encode() +
+                     b'Content-Length: 26\r\n\r\n{"action": "create_index"}')
+        status, headers, body = await read_response(reader)
+        assert body['data']['action'] == 'create_index', "POST 请求处理不正确"
+        stop.set()
+        await asyncio.wait_for(serve_task, 5)
+        assert await reader.read() == b'' and await second[0].read() == b'', "排空时空闲连接未关闭"
+        assert api.server.active_connections == 0, "排空后仍有活动连接"
+    
+    asyncio.run(scenario())
+
+def test_api_interface_performance_metrics_pagination_and_downsampling(config_path):
+    """测试性能指标游标分页（相同时间戳不重复不遗漏）以及按点数预算降采样"""
+    kb = KnowledgeBase(config_path)
+    now = time.time()
+    start = now - 3000
+    for i in range(2500):
+        kb.store_historical_data({'timestamp': start + i // 2, 'metrics': {'cpu_usage': float(i)}})
+    api = APIInterface(config_path, knowledge_base=kb)
+    key = api.api_key
+    
+    seen, cursor, pages = [], None, 0
+    while True:
+        response = api.get_performance_metrics(key, str(start), str(now), cursor=cursor, limit=333)
+        assert response['status_code'] == 200 and len(response['data']) <= 333, "分页大小超出上限"
+        seen.extend(point['cpu_usage'] for point in response['data'])
+        pages += 1
+        cursor = response['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [float(i) for i in range(2500)] and pages == 8, "分页结果不完整或顺序不稳定"
+    
+    sampled = api.get_performance_metrics(key, str(start), str(now), max_points=50)['data']
+    series = sampled['series']['cpu_usage']
+    assert sampled['resolution'] > 0 and len(series['timestamp']) <= 50, "降采样点数超出预算"
+    assert min(series['min']) == 0.0 and max(series['max']) == 2499.0 and sum(series['count']) == 2500, "降采样未保留极值"
+    assert api.get_performance_metrics(key, str(start), str(now), cursor='bogus')['status_code'] == 400, "非法游标未拒绝"
+
+def test_metrics_stream_fanout_resume_and_slow_consumers(config_path):
+    """测试指标推送的分块流式输出、断线续传以及慢速订阅者的合并处理"""
+    api = APIInterface(config_path)
+    api.config['api'] = {'port': 0}
+    
+    async def read_chunk(reader):
+        size = int((await reader.readline()).strip(), 16)
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    
+    async def scenario():
+        stop = asyncio.Event()
+        serve_task = asyncio.ensure_future(api.serve(stop))
+        while api.server is None or api.server._server is None:
+            await asyncio.sleep(0.01)
+        key = 'X-API-Key: demo_api_key_123456\r\n'
+        reader, writer = await asyncio.open_connection('127.0.0.1', api.server.port)
+        writer.write(f"GET /metrics/stream?format=ndjson HTTP/1.1\r\n{key}\r\n".encode())
+        head = (await reader.readuntil(b'\r\n\r\n')).decode()
+        assert 'Transfer-Encoding: chunked' in head and 'application/x-ndjson' in head, "推送响应头不正确"
+        await asyncio.sleep(0.05)
+        # 发布方在其他线程中调用
+        await asyncio.get_running_loop().run_in_executor(None, lambda: [
+            api.broadcaster.publish('metrics', {'cpu_usage': float(i)}) for i in range(3)])
+        received = []
+        while len(received) < 3:
+            received.extend(json.loads(line) for line in (await read_chunk(reader)).splitlines())
+        assert [e['seq'] for e in received] == [1, 2, 3] and received[2]['data']['cpu_usage'] == 2.0, "推送事件不正确"
+        
+        resume_reader, resume_writer = await asyncio.open_connection('127.0.0.1', api.server.port)
+        resume_writer.write(f"GET /metrics/stream HTTP/1.1\r\n{key}Last-Event-ID: 1\r\n\r\n".encode())
+        await resume_reader.readuntil(b'\r\n\r\n')
+        frames = (await read_chunk(resume_reader)).decode()
+        assert frames.startswith('id: 2\nevent: metrics') and 'id: 3' in frames, "断线续传未补发缓冲事件"
+        
+        # HTTP/1.0 客户端不使用分块编码，以关闭连接标记响应结束
+        legacy_reader, legacy_writer = await asyncio.open_connection('127.0.0.1', api.server.port)
+        legacy_writer.write(f"GET /metrics/stream?format=ndjson HTTP/1.0\r\n{key}\r\n".encode())
+        head = (await legacy_reader.readuntil(b'\r\n\r\n')).decode()
+        assert 'Transfer-Encoding' not in head and 'Connection: close' in head, "HTTP/1.0 推送响应头不正确"
+        await asyncio.sleep(0.05)
+        await asyncio.get_running_loop().run_in_executor(None, api.broadcaster.publish, 'metrics', {'cpu_usage': 3.0})
+        assert json.loads(await legacy_reader.readline())['seq'] == 4, "HTTP/1.0 推送事件不正确"
+        
+        stop.set()
+        await asyncio.wait_for(serve_task, 5)
+        assert (await reader.read()).endswith(b'0\r\n\r\n'), "关闭时推送流未正常结束"
+        assert b'0\r\n\r\n' not in await legacy_reader.read(), "HTTP/1.0 推送流不应带分块结束标记"
+    
+    asyncio.run(scenario())
+    
+    async def slow_consumer():
+        broadcaster = MetricsBroadcaster(queue_size=4)
+        broadcaster.attach_loop(asyncio.get_running_loop())
+        subscriber = broadcaster.subscribe()
+        for i in range(10):
+            broadcaster.publish('metrics', {'i': i})
+            if i == 5:
+                broadcaster.publish('anomaly', {'i': i})
+        stream = broadcaster.stream(subscriber, 'ndjson')
+        events = [json.loads(line) for line in (await stream.__anext__()).splitlines()]
+        await stream.aclose()
+        assert events[0]['type'] == 'lag' and events[0]['data']['dropped'] > 0, "积压时未发送 lag 事件"
+        assert any(e['type'] == 'anomaly' for e in events) and len(events) <= 5, "合并时丢失异常事件或队列越界"
+        assert events[-1]['data'] == {'i': 9} and not broadcaster.subscribers, "合并后最新事件丢失或订阅未释放"
+    
+    asyncio.run(slow_consumer())
+
+def test_api_interface_async_optimization_jobs(config_path):
+    """测试优化请求立即返回 202、幂等键合并重复提交以及长轮询等待任务完成"""
+    api = APIInterface(config_path)
+    api.config['api'] = {'port': 0, 'jobs': {'max_workers': 2, 'simulated_time_scale': 0.05}}
+    api.jobs.max_queued = 3
+    key = api.api_key
+    
+    started = time.perf_counter()
+    first = api.trigger_optimization(key, 'create_index', {'target_table': 't'}, idempotency_key='k1')
+    assert first['status_code'] == 202 and time.perf_counter() - started < 0.1, "提交优化任务未立即返回"
+    duplicate = api.trigger_optimization(key, 'create_index', idempotency_key='k1')
+    assert duplicate['data']['job_id'] == first['data']['job_id'] and duplicate['data']['duplicate'], "幂等键未合并重复提交"
+    assert api.trigger_optimization('wrong', 'create_index')['status_code'] == 401, "未校验 API 密钥"
+    api.trigger_optimization(key, 'create_index')
+    api.trigger_optimization(key, 'create_index')
+    assert api.trigger_optimization(key, 'create_index')['status_code'] == 503, "排队任务超出上限未拒绝"
+    
+    async def scenario():
+        stop = asyncio.Event()
+        serve_task = asyncio.ensure_future(api.serve(stop))
+        while api.server is None or api.server._server is None:
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_connection('127.0.0.1', api.server.port)
+        writer.write((f"GET {first['data']['status_url']}&wait=5 HTTP/1.1\r\n"
+                      f"X-API-Key: {key}\r\n\r\n").encode())
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        length = int(next(line for line in head if line.startswith('Content-Length')).split(': ')[1])
+        body = json.loads(await reader.readexactly(length))
+        stop.set()
+        await asyncio.wait_for(serve_task, 5)
+        return body
+    
+    job = asyncio.run(scenario())['data']
+    assert job['status'] in ('succeeded', 'failed') and job['progress'] == 1.0, "长轮询未等到任务完成"
+    assert job['result']['action'] == 'create_index', "任务结果不正确"
+    assert api.get_optimization_status('other_key', job['job_id'])['status_code'] == 401, "未校验 API 密钥"
+
+def test_api_interface_response_cache_conditional_requests_and_encodings(config_path):
+    """测试响应缓存：TTL 内复用响应体、ETag 条件请求返回 304、gzip 与 MessagePack 协商"""
+    import gzip
+    kb = KnowledgeBase(config_path)
+    now = time.time()
+    for i in range(200):
+        kb.store_historical_data({'timestamp': now - 200 + i, 'metrics': {'cpu_usage': float(i)}})
+    api = APIInterface(config_path, knowledge_base=kb)
+    target = f"/performance_metrics?start_time={now - 300}&end_time={now}"
+    
+    def get(path, **headers):
+        headers = {'x-api-key': api.api_key, **headers}
+        return asyncio.run(api.handle_request(HTTPRequest('GET', path, 'HTTP/1.1', headers)))
+    
+    with patch.object(api, 'get_performance_metrics', wraps=api.get_performance_metrics) as build:
+        first = get(target)
+        second = get(target)
+        assert build.call_count == 1 and first.body == second.body, "TTL 内未复用缓存的响应体"
+    etag = first.headers['ETag']
+    assert first.status == 200 and 'Last-Modified' in first.headers, "响应缺少 ETag/Last-Modified"
+    assert get(target, **{'if-none-match': etag}).status == 304, "ETag 匹配时未返回 304"
+    assert get(target, **{'if-modified-since': first.headers['Last-Modified']}).status == 304, "未处理 If-Modified-Since"
+    assert get(target, **{'if-none-match': '"stale"'}).status == 200, "ETag 不匹配时不应返回 304"
+    
+    gzipped = get(target, **{'accept-encoding': 'br, gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip' and gzip.decompress(gzipped.body) == first.body, "gzip 协商不正确"
+    assert gzipped.headers['ETag'] != etag, "不同表示应使用不同的 ETag"
+    binary = get(target, accept='application/msgpack')
+    assert binary.headers['Content-Type'] == 'application/msgpack' and len(binary.body) < len(first.body), "二进制编码未生效"
+    assert unpack(binary.body) == json.loads(first.body), "MessagePack 解码结果与 JSON 不一致"
+    assert get(target, **{'x-api-key': 'wrong'}).status == 401, "缓存命中时跳过了密钥校验"
+    
+    api.response_cache.entries[next(iter(api.response_cache.entries))].expires_at = 0
+    assert get(target, **{'if-none-match': etag}).status == 304, "过期重建后内容未变时应仍返回 304"
+
+def test_api_interface_bounded_accounting_and_rate_limiting(config_path):
+    """测试请求统计内存有界、按 API 密钥令牌桶限流返回 429 以及令牌按时间补充"""
+    api = APIInterface(config_path)
+    api.rate_limiter = RateLimiter(rate=10, burst=5)
+    
+    def get(path, key):
+        return asyncio.run(api.handle_request(HTTPRequest('GET', path, 'HTTP/1.1', {'x-api-key': key})))
+    
+    statuses = [get('/optimization_jobs', api.api_key).status for _ in range(8)]
+    assert statuses == [200] * 5 + [429] * 3, "超出突发容量后未返回 429"
+    limited = get('/optimization_jobs', api.api_key)
+    assert limited.status == 429 and limited.headers['Retry-After'] == '1', "429 响应缺少 Retry-After"
+    assert get('/optimization_jobs', 'other_key').status == 401, "不同密钥之间的限流未隔离"
+    time.sleep(0.15)
+    assert get('/optimization_jobs', api.api_key).status == 200, "令牌未按时间补充"
+    
+    api.rate_limiter = RateLimiter(rate=1e6, burst=1e6, max_keys=100)
+    for i in range(1000):
+        get(f'/missing/{i}', f'key_{i}')
+    stats = api.request_accounting.get_stats()
+    assert stats['other']['count'] == 1000 and len(api.request_accounting.stats) == len(api._routes) + 1, "未知路径撑大了统计表"
+    assert stats['/optimization_jobs']['status'] == {'2xx': 6, '4xx': 5} and stats['/optimization_jobs']['rate_limited'] == 4, "状态码统计不正确"
+    assert list(api.rate_limiter.buckets) == [UNAUTHENTICATED_KEY], "无效密钥未共用令牌桶"
+    api.rate_limiter = RateLimiter(rate=10, burst=5)
+    assert [get('/optimization_jobs', f'random_{i}').status for i in range(6)] == [401] * 5 + [429], "随机密钥绕过了限流"
+    assert get('/optimization_jobs', api.api_key).status == 200, "无效密钥挤占了有效密钥的令牌桶"
+    limiter = RateLimiter(rate=1e6, burst=1e6, max_keys=100)
+    for i in range(1000):
+        limiter.acquire(f'key_{i}')
+    assert len(limiter.buckets) == 100, "令牌桶数量未受上限约束"
+    
+    import threading
+    threads = []
+    api._routes[('GET', '/optimization_jobs')] = lambda request: threads.append(threading.current_thread()) or {"status_code": 200}
+    assert get('/optimization_jobs', api.api_key).status == 200 and threads[0] is not threading.main_thread(), \
+        "同步处理函数阻塞了事件循环线程"
+
+def test_audit_log_writer_rotation_index_and_recovery(tmp_path):
+    """测试审计日志：多线程下编号唯一且单调、文件轮转与时间索引查询、重启后编号续接以及队列满时丢弃"""
+    import threading
+    writer = AuditLogWriter(str(tmp_path / 'audit'), max_file_bytes=4096, block_events=16, fsync=False)
+    ids = []
+    
+    def produce(worker):
+        ids.extend(writer.append('access_check', {'worker': worker, 'i': i}) for i in range(500))
+    
+    threads = [threading.Thread(target=produce, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    middle = time.time()
+    for i in range(100):
+        writer.append('authentication', {'i': i})
+    assert writer.flush(5), "flush 超时"
+    assert sorted(ids) == list(range(1, 2001)), "事件编号重复或不连续"
+    assert writer.stats()['files'] > 5 and writer.stats()['batches'] < 2100 / 10, "未轮转文件或未批量写入"
+    
+    events = writer.query(middle, time.time() + 1)
+    assert [e['event_id'] for e in events] == list(range(2001, 2101)), "按时间范围查询结果不正确"
+    assert len(writer.query(0, middle, event_type='access_check')) == 2000, "按事件类型过滤不正确"
+    writer.close()
+    
+    reopened = AuditLogWriter(str(tmp_path / 'audit'), max_file_bytes=4096, max_files=2, fsync=False)
+    assert reopened.append('authentication', {}) == 2101, "重启后事件编号未续接"
+    reopened.append('authentication', {})
+    reopened.flush()
+    assert reopened.query(middle, time.time() + 1)[-1]['event_id'] == 2102, "重启后写入的事件不可查询"
+    reopened.close()
+    
+    blocked = AuditLogWriter(queue_size=10, overflow='drop', flush_interval=60)
+    results = [blocked.append('access_check', {}) for _ in range(15)]
+    assert results.count(-1) == 5 and blocked.stats()['dropped'] == 5, "队列满时未按策略丢弃"
+    blocked.close()
+    assert len(blocked.query(0, time.time() + 1)) == 10, "关闭时未写完队列中的事件"
+    
+    robust = AuditLogWriter(str(tmp_path / "robust"), flush_interval=0.01)
+    robust.append('login', {'when': object()})
+    assert robust.flush(timeout=2) and robust.stats()['dropped'] == 0, "不可序列化的详情应按字符串写入"
+    with patch.object(robust, '_write_batch', side_effect=RuntimeError("boom")):
+        robust.append('login', {})
+        assert robust.flush(timeout=2), "写入异常后 flush 不应挂起"
+    robust.append('login', {'user': 'a'})
+    assert robust.flush(timeout=2) and robust._thread.is_alive(), "写入异常不应终止写线程"
+    robust.close()
+
+def test_security_module_compiled_permissions_sessions_and_audit_modes(config_path):
+    """测试权限位掩码、会话令牌（TTL、LRU 淘汰与撤销）、允许决策的聚合审计以及 API 按会话授权"""
+    security = SecurityModule(config_path)
+    with patch('security_module.random.choice', return_value=True):
+        viewer = security.login('alice', 'pw', roles=['viewer'])
+        admin = security.login('bob', 'pw', roles=['admin'])
+    assert security.authorize(viewer, 'read') and not security.authorize(viewer, 'optimize'), "角色权限编译不正确"
+    assert security.check_access('bob', 'admin') and not security.check_access('bob', 'drop_table'), "未知权限应被拒绝"
+    security.grant_roles('alice', ['operator'])
+    assert security.authorize(viewer, 'optimize'), "权限变更未同步到现有会话"
+    assert security.logout(viewer) and not security.authorize(viewer, 'read'), "注销后令牌仍然有效"
+    assert security.revoke_user('bob') == 1 and not security.authorize(admin, 'read'), "撤销用户后会话仍然有效"
+    
+    sessions = SessionCache(ttl_seconds=0.05, max_sessions=2)
+    first, second, third = (sessions.create(f'u{i}', 1).token for i in range(3))
+    assert sessions.get(first) is None and sessions.get(third) is not None, "会话数超出上限时未淘汰最久未使用的会话"
+    time.sleep(0.06)
+    assert sessions.get(second) is None and len(sessions) == 1, "过期会话未失效"
+    
+    security.access_auditor = DecisionAuditor(security._log_audit_event, mode='aggregated', aggregate_interval=3600)
+    security.grant_roles('carol', ['viewer'])
+    for _ in range(1000):
+        security.check_access('carol', 'read')
+    security.check_access('carol', 'write')
+    security.close()
+    events = security.audit_log.query(0, time.time() + 1)
+    checks = [e for e in events if e['event_type'] == 'access_check' and e['details']['username'] == 'carol']
+    summary = [e for e in events if e['event_type'] == 'access_summary'][-1]['details']['allowed']
+    assert len(checks) == 1 and not checks[0]['details']['allowed'], "拒绝决策应逐条记录、允许决策不应逐条记录"
+    assert summary == [{'username': 'carol', 'action': 'read', 'count': 1000}], "允许决策汇总计数不正确"
+    
+    security = SecurityModule(config_path)
+    with patch('security_module.random.choice', return_value=True):
+        token = security.login('dave', 'pw', roles=['viewer'])
+    api = APIInterface(config_path, security_module=security)
+    assert api.get_optimization_status(token, 'missing')['status_code'] == 404, "会话令牌未通过 API 授权"
+    assert api.trigger_optimization(token, 'create_index')['status_code'] == 401, "只读角色不应能触发优化"
+    started = time.perf_counter()
+    for _ in range(10000):
+        api.authenticate_request(token)
+    assert (time.perf_counter() - started) / 10000 < 50e-6, "单次授权耗时过长"
+    security.close()
+
+def test_security_module_batch_anonymization(config_path):
+    """测试列式批量匿名化：HMAC 假名稳定且带密钥、规则编译、LRU 复用以及进程池并行结果一致"""
+    security = SecurityModule(config_path)
+    security.anonymizer = BatchAnonymizer(b'secret', rules=[
+        {'field': '^email$', 'action': 'redact'},
+        {'field': '^password', 'action': 'drop'},
+        {'field': 'user', 'action': 'pseudonymize'}
+    ], memo_size=50)
+    batch = {
+        'user_id': [f'user_{i % 20}' for i in range(1000)],
+        'email': ['a@b.c'] * 999 + [None],
+        'password_hash': ['x'] * 1000,
+        'cpu_usage': np.arange(1000.0)
+    }
+    result = security.anonymize_batch(batch)
+    assert 'password_hash' not in result and result['cpu_usage'] is batch['cpu_usage'], "列规则处理不正确"
+    assert result['email'][0] == '***' and result['email'][-1] is None, "脱敏处理不正确"
+    assert len(set(result['user_id'])) == 20 and result['user_id'][0] == result['user_id'][20], "假名不稳定"
+    assert result['user_id'][0] == security.anonymize_data({'user_id': 'user_0'})['user_id'], "单条与批量假名不一致"
+    assert BatchAnonymizer(b'other').pseudonymize('user_0') != result['user_id'][0], "假名未使用密钥"
+    assert security.anonymizer.stats()['memo_misses'] == 20, "重复值未复用缓存的假名"
+    
+    batches = [{'user_id': [f'user_{(i * 7 + j) % 50}' for j in range(300)], 'value': list(range(300))}
+               for i in range(4)]
+    parallel = list(anonymize_batches(batches, b'secret', security.anonymizer.rules, workers=2, chunk_rows=100))
+    assert len(parallel) == 12 and parallel[0]['value'] == list(range(100)), "并行结果的顺序或切分不正确"
+    merged = [value for chunk in parallel for value in chunk['user_id']]
+    expected = [value for b in batches for value in security.anonymize_batch(b)['user_id']]
+    assert merged == expected, "进程池与单进程的假名不一致"
+
+def test_stream_cipher_chunked_encryption_random_access_and_tamper_detection(config_path):
+    """测试分块流式加密：文件与内存往返一致、随机读取、篡改/截断/重排检测以及 SecurityModule 接口"""
+    import io
+    import os
+    cipher = StreamCipher(os.urandom(32), chunk_size=1024)
+    payload = os.urandom(10 * 1024 + 100)
+    encrypted = io.BytesIO()
+    written = cipher.encrypt_stream(io.BytesIO(payload), encrypted)
+    data = encrypted.getvalue()
+    assert written == len(data) == HEADER_SIZE + len(payload) + 11 * TAG_SIZE, "密文长度不正确"
+    assert cipher.decrypt(memoryview(data)) == payload, "内存解密结果不一致"
+    decrypted = io.BytesIO()
+    assert cipher.decrypt_stream(io.BytesIO(data), decrypted) == len(payload) and decrypted.getvalue() == payload, "流式解密结果不一致"
+    assert cipher.decrypt(cipher.encrypt(b'')) == b'' and cipher.decrypt(cipher.encrypt(payload[:2048])) == payload[:2048], "边界长度处理不正确"
+    with patch('stream_crypto._HAS_INTO', False):
+        fallback_encrypted, fallback_decrypted = io.BytesIO(), io.BytesIO()
+        cipher.encrypt_stream(io.BytesIO(payload), fallback_encrypted)
+        cipher.decrypt_stream(io.BytesIO(fallback_encrypted.getvalue()), fallback_decrypted)
+        assert fallback_decrypted.getvalue() == payload, "缺少 encrypt_into/decrypt_into 时的退回路径不正确"
+    
+    assert cipher.decrypt_chunk(encrypted, 10) == payload[10240:], "随机读取末块不正确"
+    assert cipher.read_range(data, 1000, 2100) == payload[1000:3100], "随机读取范围不正确"
+    
+    step = 1024 + TAG_SIZE
+    tampered = bytearray(data)
+    tampered[HEADER_SIZE + 5] ^= 1
+    swapped = data[:HEADER_SIZE] + data[HEADER_SIZE + step:HEADER_SIZE + 2 * step] + data[HEADER_SIZE:HEADER_SIZE + step] + data[HEADER_SIZE + 2 * step:]
+    for corrupted in (bytes(tampered), data[:HEADER_SIZE + 3 * step], swapped):
+        with pytest.raises(DecryptionError):
+            cipher.decrypt(corrupted)
+    with pytest.raises(DecryptionError):
+        StreamCipher(os.urandom(32), chunk_size=1024).decrypt(data)
+    
+    security = SecurityModule(config_path)
+    token = security.encrypt_data("敏感数据")
+    assert token != security.encrypt_data("敏感数据") and security.decrypt_data(token) == "敏感数据", "字符串加解密不正确"
+    security.close()
+
+
+def test_data_visualizer_lttb_downsampling_and_envelopes(config_path):
+    visualizer = DataVisualizer(config_path)
+    n = 100000
+    base = 1747245600
+    spike = 41234
+    rng = np.random.default_rng(0)
+    cpu = 50 + 10 * np.sin(np.arange(n) / 500.0) + rng.normal(0, 1, n)
+    cpu[spike] = 500
+    visualizer.data = {'performance_metrics': [
+        {'timestamp': base + i, 'query_execution_time': 0.1, 'cpu_usage': float(cpu[i]), 'memory_usage': 60.0}
+        for i in range(n)
+    ]}
+    chart = visualizer.generate_performance_trend(width=500)
+    points = len(chart['x_axis'])
+    assert points <= 3 * 500 and all(len(values) == points for values in chart['y_axis'].values()), "降采样点数未受宽度约束"
+    assert chart['x_axis'][0] == base and chart['x_axis'][-1] == base + n - 1, "首尾点未保留"
+    assert base + spike in chart['x_axis'] and max(chart['y_axis']['cpu_usage']) == 500, "峰值点被丢弃"
+    assert chart['downsampling']['source_points'] == n, "降采样信息不正确"
+    envelope = chart['envelopes']['cpu_usage']
+    assert len(envelope['x']) == len(envelope['max']) == 500 and max(envelope['max']) == 500, "包络不正确"
+    assert chart['x_axis'] == sorted(chart['x_axis']), "降采样后横轴不是升序"
+    
+    x = np.arange(20, dtype=float)
+    assert list(lttb_indices(x, x ** 2, 50)) == list(range(20)), "点数少于阈值时不应降采样"
+    visualizer.data = {'performance_metrics': [
+        {'timestamp': f'2025-05-14T18:0{i}:00Z', 'query_execution_time': 0.1, 'cpu_usage': i, 'memory_usage': 60.0}
+        for i in range(5)
+    ]}
+    chart = visualizer.generate_performance_trend()
+    assert len(chart['x_axis']) == 5 and 'envelopes' not in chart, "少量数据应原样输出"
+
+
+def test_data_visualizer_incremental_refresh_and_versioned_changes(config_path):
+    visualizer = DataVisualizer(config_path)
+    visualizer.store.history = deque(maxlen=4)
+    metrics = [{'timestamp': i, 'query_execution_time': 0.1 * i, 'cpu_usage': 50 + i, 'memory_usage': 60.0}
+               for i in range(10)]
+    visualizer.data = {'performance_metrics': metrics}
+    first = visualizer.refresh()
+    assert first == 1 and visualizer.refresh() == first, "无新数据时不应产生新版本"
+    
+    metrics.extend({'timestamp': i, 'query_execution_time': 0.1, 'cpu_usage': 90, 'memory_usage': 60.0}
+                   for i in range(10, 13))
+    second = visualizer.refresh()
+    changes = visualizer.changes_since(first)
+    assert changes['version'] == second and not changes['reset'] and len(changes['changes']) == 1, "增量版本不正确"
+    delta = changes['changes'][0]['delta']
+    assert delta['x'] == [10, 11, 12] and delta['y']['cpu_usage'] == [90, 90, 90], "增量应只包含新数据点"
+    assert delta['aggregates']['cpu_usage']['count'] == 13 and delta['aggregates']['cpu_usage']['max'] == 90, "汇总值不正确"
+    assert visualizer.changes_since(second)['changes'] == [], "最新版本不应有变化"
+    
+    for i in range(13, 18):
+        metrics.append({'timestamp': i, 'query_execution_time': 0.1, 'cpu_usage': 50, 'memory_usage': 60.0})
+        visualizer.refresh()
+    stale = visualizer.changes_since(first)
+    charts = {chart['chart_id']: chart for chart in stale['charts']}
+    assert stale['reset'] and charts['performance_trend']['source_points'] == 18, "过旧版本应返回完整快照"
+    
+    visualizer.data = {'performance_metrics': metrics[:5]}
+    visualizer.refresh()
+    latest = visualizer.changes_since(visualizer.store.version - 1)['changes'][0]
+    assert latest['kind'] == 'reset' and latest['delta']['x_axis'] == [0, 1, 2, 3, 4], "源数据变少时应重建图表"
+    assert latest['delta']['version'] == latest['version'], "reset 快照应携带提交后的版本号"
+    
+    # 增量最多携带最近 max_points 个点，被裁剪的增量标明源数据条数；快照读取与刷新并发时不出错
+    visualizer = DataVisualizer(config_path)
+    visualizer.max_points = 3
+    visualizer.data = {'performance_metrics': metrics[:10]}
+    visualizer.refresh()
+    delta = visualizer.changes_since(0)['changes'][0]['delta']
+    assert delta['x'] == [7, 8, 9] and delta['clipped'] and delta['source_rows'] == 10, "增量点数应受 max_points 限制"
+    assert delta['aggregates']['cpu_usage']['count'] == 10, "被裁剪的点仍应计入汇总"
+    errors = []
+    
+    def read_snapshots():
+        try:
+            for _ in range(200):
+                visualizer.changes_since(-1)
+        except Exception as e:
+            errors.append(e)
+    
+    reader = threading.Thread(target=read_snapshots)
+    reader.start()
+    for i in range(200):
+        metrics.append({'timestamp': 100 + i, 'query_execution_time': 0.1, 'cpu_usage': 50, 'memory_usage': 60.0})
+        visualizer.data = {'performance_metrics': metrics}
+        visualizer.refresh()
+    reader.join()
+    assert not errors, "并发读取快照不应出错"
+
+
+def test_data_visualizer_streaming_ndjson_and_memory_mapped_columnar_loaders(tmp_path):
+    n = 20000
+    spike = 12345
+    with open(tmp_path / "performance_metrics.ndjson", 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(json.dumps({'timestamp': 1000 + i, 'query_execution_time': 0.1, 'memory_usage': 60.0,
+                                'cpu_usage': 500.0 if i == spike else 50.0 + (i % 7)}) + '\n')
+    with open(tmp_path / "optimization_suggestions.ndjson", 'w', encoding='utf-8') as f:
+        for action, reduction in (('create_index', 25.5), ('partition_data', 18.2)):
+            f.write(json.dumps({'action': action, 'estimated_impact': {'query_time_reduction': reduction}}) + '\n')
+    
+    def visualizer_for(fmt: str, path) -> DataVisualizer:
+        config_file = tmp_path / f"{fmt}.yaml"
+        config_file.write_text(f"visualization:\n  loader:\n    format: {fmt}\n    path: {path}\n    batch_rows: 1000\n",
+                               encoding='utf-8')
+        return DataVisualizer(str(config_file))
+    
+    streaming = visualizer_for('ndjson', tmp_path)
+    chart = streaming.generate_performance_trend(width=200)
+    assert len(chart['x_axis']) <= 3 * 200 and chart['downsampling']['source_points'] == n, "流式降采样点数不正确"
+    assert chart['x_axis'][0] == 1000 and chart['x_axis'][-1] == 1000 + n - 1, "首尾点未保留"
+    assert 1000 + spike in chart['x_axis'] and max(chart['envelopes']['cpu_usage']['max']) == 500, "峰值点被丢弃"
+    impact = streaming.generate_optimization_impact()
+    assert impact['x_axis'] == ['create_index', 'partition_data'] and impact['y_axis']['query_time_reduction'] == [25.5, 18.2], "嵌套字段读取不正确"
+    
+    version = streaming.refresh()
+    with open(tmp_path / "performance_metrics.ndjson", 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'timestamp': 1000 + n, 'cpu_usage': 70.0}) + '\n')
+        f.write('{"timestamp": 99999')  # 尚未写完的行不读取
+    streaming.refresh()
+    delta = streaming.changes_since(version)['changes'][0]['delta']
+    assert delta['x'] == [1000 + n] and delta['y']['cpu_usage'] == [70.0] and delta['y']['memory_usage'] == [None], "增量读取不正确"
+    
+    source = NDJSONLoader(str(tmp_path), batch_rows=4096)
+    for dataset in ('performance_metrics', 'optimization_suggestions'):
+        fields = ('timestamp', 'query_execution_time', 'cpu_usage', 'memory_usage') if dataset == 'performance_metrics' \
+            else ('action', 'estimated_impact.query_time_reduction')
+        written = write_columnar(str(tmp_path / "columnar"), dataset, source.iter_batches(dataset, fields))
+        assert written == source.count(dataset), "列式文件行数不正确"
+    columns = ColumnarLoader(str(tmp_path / "columnar")).columns('performance_metrics', ('cpu_usage',))
+    assert isinstance(columns['cpu_usage'], np.memmap) and columns['cpu_usage'][spike] == 500, "列式数据应通过内存映射读取"
+    mapped = visualizer_for('columnar', tmp_path / "columnar")
+    chart = mapped.generate_performance_trend(width=200)
+    assert len(chart['x_axis']) <= 3 * 200 and 1000 + spike in chart['x_axis'], "列式数据降采样不正确"
+    assert mapped.generate_optimization_impact()['x_axis'] == ['create_index', 'partition_data'], "字典编码列解码不正确"
+    
+    mixed = [{'timestamp': np.array(['2025-05-14T18:00:00Z', '2025-05-14T18:01:00Z'], dtype=object),
+              'cpu_usage': np.array([50, 60], dtype=np.int64)},
+             {'timestamp': np.array(['2025-05-14T18:02:00Z', None], dtype=object),
+              'cpu_usage': np.array([50.7, np.nan])}]
+    assert write_columnar(str(tmp_path / "mixed"), 'performance_metrics', mixed) == 4, "列式文件行数不正确"
+    columns = ColumnarLoader(str(tmp_path / "mixed")).columns('performance_metrics', ('timestamp', 'cpu_usage'))
+    assert to_list(columns['cpu_usage']) == [50.0, 60.0, 50.7, None], "后续批次的类型不一致时列类型未拓宽"
+    assert columns['timestamp'].dtype.kind == 'M' and to_list(columns['timestamp'])[2:] == ['2025-05-14T18:02:00Z', None], \
+        "时间字符串列未以 datetime64 存储"
+
+
+def test_chart_renderer_parallel_rendering_and_content_hash_cache(config_path, tmp_path):
+    import struct
+    import xml.etree.ElementTree as ElementTree
+    visualizer = DataVisualizer(config_path)
+    charts = visualizer.report_charts(width=400)
+    cache_dir = str(tmp_path / "rendered")
+    results = render_charts(charts, cache_dir, width=400, height=200, workers=2)
+    assert all(sorted(result['rendered']) == ['png', 'svg'] for result in results.values()), "首次渲染应输出全部格式"
+    
+    trend = results['performance_trend']
+    root = ElementTree.parse(trend['svg']).getroot()
+    assert root.tag.endswith('svg') and len(root.findall('{http://www.w3.org/2000/svg}polyline')) >= 3, "SVG 输出不正确"
+    with open(trend['png'], 'rb') as f:
+        png = f.read()
+    assert png[:8] == b'\x89PNG\r\n\x1a\n' and struct.unpack('>II', png[16:24]) == (400, 200), "PNG 输出不正确"
+    
+    charts = visualizer.report_charts(width=400)  # 生成时间不同，内容相同
+    cached = render_charts(charts, cache_dir, width=400, height=200, workers=2)
+    assert all(result['rendered'] == [] for result in cached.values()), "内容未变的图表不应重新渲染"
+    assert cached['performance_trend']['png'] == trend['png'], "缓存路径应由内容决定"
+    
+    visualizer.data['performance_metrics'][0]['cpu_usage'] = 99.0
+    changed = render_charts(visualizer.report_charts(width=400), cache_dir, width=400, height=200, workers=2)
+    assert sorted(changed['performance_trend']['rendered']) == ['png', 'svg'], "内容变化的图表应重新渲染"
+    assert changed['anomaly_report']['rendered'] == [], "未变化的图表不应重新渲染"
+    
+    duplicate = render_charts({'db1': charts['optimization_impact'], 'db2': charts['optimization_impact']},
+                              str(tmp_path / "dedup"), formats=['svg'], workers=1)
+    assert duplicate['db1']['svg'] == duplicate['db2']['svg'] and len(duplicate['db1']['rendered'] + duplicate['db2']['rendered']) == 1, "相同内容应只渲染一次"